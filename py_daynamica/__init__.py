@@ -0,0 +1,6 @@
+"""
+Processing steps of Daynamica exports (s1_io_data ... s10_day_similarity) and their utilities.
+
+Heavy packages (geopandas, shapely, pyproj, pointpats, matplotlib, seaborn, plotly, xlsxwriter) are imported inside
+the functions using them, so that importing a module of the package is fast (see benchmark.import_time).
+"""
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Person-level and rolling-window activity space merged from the daily results'
+
+__author__ = 'Xiaohuan Zeng'
+
+import math
+import numpy as np
+import pandas as pd
+
+from py_daynamica import person_day
+from py_daynamica.s5_cal_activity_space import unit_convert
+
+"""
+cal_convex_hull and cal_sde work per person-day. The activity space of a window of days (all valid days of a participant,
+weekdays only, rolling 7-day windows, ...) is merged from the results of its days, the points are read only ONCE:
+    - convex hull: the hull of the points of several days is the hull of the vertices of their daily hulls,
+      so the vertices of the daily hulls (cal_convex_hull) are merged, not the points
+    - SDE: the ellipse (pointpats.centrography.ellipse, method 'crimestat') only needs the number of points,
+      their sums and sums of squares and cross products, which are added over the days of the window
+      (the coordinates are relative to the mean point of each user to keep the sums of squares accurate)
+
+A window is a set of person days of one user, given as pairs (window, day), see person_windows and rolling_windows.
+The same rules as the daily tables apply: hulls are buffered by buffer_dis_meter and a Point has a zero area,
+the SDE of a Point is zero and the SDE of a LineString is (length, buffer_dis_meter).
+Points without coordinates are skipped (the daily cal_sde of a day with such points is NaN).
+"""
+
+
+class DailySpace(object):
+    """
+    days: one row per person day with activities: user_id, start_date, IsWeekend, day (local day index),
+          n (number of points), sx, sy, sxx, syy, sxy (sums of the coordinates relative to the user reference, ref_x, ref_y)
+    vertices: coordinates of the vertices of the daily hulls, the vertices of day i are offsets[i]:offsets[i+1]
+    """
+    def __init__(self, days, vertices, offsets):
+        self.days = days
+        self.vertices = vertices
+        self.offsets = offsets
+
+    def __len__(self):
+        return(self.days.shape[0])
+
+
+"""
+INPUT:  ucalitems_activity <activities after coordinate transformation (extract_geo_info), with x and y>
+        convex_hull <output of cal_convex_hull on the same activities>
+
+TASKS:  ONE pass over the points: sums of the coordinates by person day (bincount),
+        vertices of the daily hulls
+
+OUTPUT: DailySpace
+"""
+def build_daily_space(ucalitems_activity, convex_hull):
+    import shapely
+
+    row, days = person_day.factorize_person_days(ucalitems_activity)
+    x = ucalitems_activity['x'].values.astype(float)
+    y = ucalitems_activity['y'].values.astype(float)
+
+    # points without coordinates (no centroid) are skipped, as in the daily hulls
+    valid = np.isfinite(x) & np.isfinite(y)
+    row, x, y = row[valid], x[valid], y[valid]
+
+    # reference point of each user (mean point)
+    user, users = pd.factorize(days['user_id'])
+    point_user = user[row]
+    n_user = np.bincount(point_user, minlength=users.shape[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ref_x = np.bincount(point_user, weights=x, minlength=users.shape[0]) / n_user
+        ref_y = np.bincount(point_user, weights=y, minlength=users.shape[0]) / n_user
+    dx, dy = x - ref_x[point_user], y - ref_y[point_user]
+
+    sums = lambda weights: np.bincount(row, weights=weights, minlength=days.shape[0])
+    days['n'] = np.bincount(row, minlength=days.shape[0])
+    days['sx'], days['sy'] = sums(dx), sums(dy)
+    days['sxx'], days['syy'], days['sxy'] = sums(dx * dx), sums(dy * dy), sums(dx * dy)
+    days['ref_x'], days['ref_y'] = ref_x[user], ref_y[user]
+    days['day'] = days['start_date'].values.astype('datetime64[D]').astype(np.int64)
+
+    # vertices of the daily hulls, in the order of the days
+    hull_row = pd.MultiIndex.from_frame(days[person_day.key_cols]).get_indexer(pd.MultiIndex.from_frame(convex_hull[person_day.key_cols]))
+    if (hull_row < 0).any() or hull_row.shape[0] != days.shape[0]:
+        raise Exception("Sorry, convex_hull does not match the person days of ucalitems_activity")
+    coords, index = shapely.get_coordinates(convex_hull.geometry.values, return_index=True)
+    order = np.argsort(hull_row[index], kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(hull_row[index], minlength=days.shape[0]))])
+
+    print('# points: {0:0.0f}. # person days: {1:0.0f}. # hull vertices: {2:0.0f}'.format(x.shape[0], days.shape[0], coords.shape[0]))
+    return(DailySpace(days, coords[order], offsets))
+
+
+"""
+INPUT:  daily <DailySpace>
+        day_type <'Weekday' or 'Weekend' to keep these days only, None for all days>
+
+OUTPUT: windows (one per user: user_id, window_start, window_end), pairs (window, day) of the rows of daily.days
+"""
+def person_windows(daily, day_type = None):
+    days = daily.days
+    day_rows = np.flatnonzero(days['IsWeekend'].values == day_type) if day_type is not None else np.arange(days.shape[0])
+    window, users = pd.factorize(days['user_id'].values[day_rows])
+    windows = pd.DataFrame({'user_id': users})
+    windows['window_start'] = days['start_date'].iloc[day_rows].groupby(window).min().values
+    windows['window_end'] = days['start_date'].iloc[day_rows].groupby(window).max().values
+    return(windows, window, day_rows)
+
+"""
+INPUT:  daily <DailySpace>
+        window_days <length of the windows in days>
+        day_type <'Weekday' or 'Weekend' to keep these days only, None for all days>
+
+OUTPUT: windows (one per user and day with activities, the window ends on this day: user_id, window_start, window_end),
+        pairs (window, day) of the rows of daily.days
+"""
+def rolling_windows(daily, window_days = 7, day_type = None):
+    days = daily.days
+    rows = np.flatnonzero(days['IsWeekend'].values == day_type) if day_type is not None else np.arange(days.shape[0])
+    user = pd.factorize(days['user_id'].values[rows], sort=True)[0]
+    day = days['day'].values[rows]
+
+    # days are sorted by user and date: the window ending on day i starts at the first day >= day[i] - window_days + 1
+    key = user.astype(np.int64) * (day.max() - day.min() + 2 * window_days + 1 if day.shape[0] > 0 else 1) + (day - (day.min() if day.shape[0] > 0 else 0))
+    first = np.searchsorted(key, key - window_days + 1)
+    size = np.arange(rows.shape[0]) + 1 - first
+    window = np.repeat(np.arange(rows.shape[0]), size)
+    day_rows = rows[np.repeat(first, size) + (np.arange(window.shape[0]) - np.repeat(np.cumsum(size) - size, size))]
+
+    windows = pd.DataFrame({'user_id': days['user_id'].values[rows]})
+    windows['window_end'] = days['start_date'].values[rows]
+    windows['window_start'] = windows['window_end'] - pd.Timedelta(days=window_days - 1)
+    return(windows[['user_id', 'window_start', 'window_end']], window, day_rows)
+
+
+# standard deviational ellipse from the centered sums (the same formulas as pointpats.centrography.ellipse, method 'crimestat')
+def ellipse_from_moments(n, x2, y2, xy):
+    left = x2 - y2
+    right = np.sqrt(left ** 2 + 4 * xy ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        theta1 = np.where(xy == 0, 0, np.arctan(-(left + right) / (2 * xy)))
+        theta2 = np.where(xy == 0, np.pi / 2, np.arctan(-(left - right) / (2 * xy)))
+        term = lambda t: np.cos(t) ** 2 * y2 - 2 * np.sin(t) * np.cos(t) * xy + np.sin(t) ** 2 * x2
+        correction = np.sqrt(2) * np.sqrt(n) / np.sqrt(n - 2)
+        s1 = np.sqrt(np.maximum(term(theta1), 0) / n) * correction
+        s2 = np.sqrt(np.maximum(term(theta2), 0) / n) * correction
+    # the angle of the major axis is the angle of the other term (as in pointpats)
+    swap = s2 > s1
+    return(np.where(swap, s2, s1), np.where(swap, s1, s2), np.where(swap, theta1, theta2))
+
+# polygons of ellipses (center, semi-axes and angle), the same orientation as matplotlib Ellipse(angle=-theta_degree)
+def ellipse_polygons(cx, cy, sx, sy, theta, n_vertices = 64):
+    import shapely
+
+    a = np.linspace(0, 2 * np.pi, n_vertices + 1)[None, :]
+    ex, ey = sx[:, None] * np.cos(a), sy[:, None] * np.sin(a)
+    cos, sin = np.cos(theta)[:, None], np.sin(theta)[:, None]
+    coords = np.stack([cx[:, None] + ex * cos + ey * sin, cy[:, None] - ex * sin + ey * cos], axis=-1)
+    valid = np.isfinite(coords).all(axis=(1, 2))
+    result = np.full(cx.shape[0], None, dtype=object)
+    if valid.any():
+        result[valid] = shapely.polygons(coords[valid])
+    return(result)
+
+
+"""
+INPUT:  daily <DailySpace>
+        windows, window, day_rows <output of person_windows or rolling_windows>
+        buffer_dis_meter: buffer distance in meters
+        crs <crs of the geometries, e.g. ucalitems_activity.crs>
+
+TASKS:  merge the daily hull vertices and the daily sums of each window, no point is read
+
+OUTPUT: a dictionary of tables 'convex_hull' and 'sde', one row per window, the same columns as cal_convex_hull and cal_sde
+        with window_start, window_end, days (number of days with activities) and points instead of start_date
+"""
+def merge_windows(daily, windows, window, day_rows, buffer_dis_meter, crs = None):
+    import shapely
+    import geopandas as gpd
+
+    days = daily.days
+    n_windows = windows.shape[0]
+    windows = windows.reset_index(drop=True)
+    windows['days'] = np.bincount(window, minlength=n_windows)
+
+    # convex hull of the vertices of the daily hulls of each window
+    count = np.diff(daily.offsets)[day_rows]
+    vertex_window = np.repeat(window, count)
+    vertex_rows = np.repeat(daily.offsets[day_rows], count) + (np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count))
+    # windows without vertices (no coordinates) have no hull
+    hull = np.full(n_windows, None, dtype=object)
+    hull_windows, vertex_window = np.unique(vertex_window, return_inverse=True)
+    if hull_windows.shape[0] > 0:
+        hull[hull_windows] = shapely.convex_hull(shapely.multipoints(daily.vertices[vertex_rows], indices=vertex_window))
+
+    convex_hull = gpd.GeoDataFrame(windows.copy(), geometry=hull, crs=crs)
+    convex_hull['buffer'] = convex_hull['geometry'].buffer(buffer_dis_meter)
+    convex_hull['area_meter'] = convex_hull['buffer'].area
+    convex_hull['area_mile'] = convex_hull['area_meter'] / (unit_convert**2)
+    convex_hull['len_meter'] = convex_hull['geometry'].length
+    convex_hull['geometry_type'] = convex_hull.geom_type
+    convex_hull.loc[convex_hull['geometry_type']=='Point','area_mile'] = 0
+
+    # SDE from the sums of the days of each window, centered on the mean point of the window
+    total = {col: np.bincount(window, weights=days[col].values[day_rows], minlength=n_windows) for col in ['n', 'sx', 'sy', 'sxx', 'syy', 'sxy']}
+    n = total['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x, mean_y = total['sx'] / n, total['sy'] / n
+    sx, sy, theta = ellipse_from_moments(n, total['sxx'] - n * mean_x ** 2, total['syy'] - n * mean_y ** 2, total['sxy'] - n * mean_x * mean_y)
+    windows['points'] = n.astype(np.int64)
+    convex_hull['points'] = windows['points']
+
+    # reference point of the user of each window
+    first_day = day_rows[np.unique(window, return_index=True)[1]]
+    ref_x, ref_y = days['ref_x'].values[first_day], days['ref_y'].values[first_day]
+    sde = windows.copy()
+    sde['sx_meter'] = sx
+    sde['sy_meter'] = sy
+    sde['theta'] = theta
+    sde['theta_degree'] = np.degrees(theta)
+    sde = gpd.GeoDataFrame(sde, geometry=ellipse_polygons(ref_x + mean_x, ref_y + mean_y, sx, sy, theta), crs=crs)
+    sde['geometry_type'] = convex_hull['geometry_type'].values
+    sde['len_meter'] = convex_hull['len_meter'].values
+
+    # if geometry type is point, set sx_meter and sy_meter as zero, if linestring, the travel distance and buffer_dis_meter
+    sde.loc[sde['geometry_type']=='Point','sx_meter'] = 0
+    sde.loc[sde['geometry_type']=='Point','sy_meter'] = 0
+    sde.loc[sde['geometry_type']=='LineString','sx_meter'] = sde['len_meter']
+    sde.loc[sde['geometry_type']=='LineString','sy_meter'] = buffer_dis_meter
+    sde['sx_mile'] = sde['sx_meter'] / unit_convert
+    sde['sy_mile'] = sde['sy_meter'] / unit_convert
+    sde['area_mile'] = math.pi * sde['sx_mile'] * sde['sy_mile']
+
+    print('# windows: {0:0.0f}. # (window, day) pairs: {1:0.0f}. # merged vertices: {2:0.0f}'.format(n_windows, window.shape[0], vertex_rows.shape[0]))
+    return({'convex_hull': convex_hull, 'sde': sde})
+
+
+"""
+INPUT:  ucalitems_activity, convex_hull <see build_daily_space>, or daily <DailySpace built once>
+        buffer_dis_meter
+        day_type <'Weekday' or 'Weekend' to keep these days only, None for all days>
+
+OUTPUT: participant-level activity space: 'convex_hull' and 'sde', one row per user (see merge_windows)
+"""
+def person_activity_space(ucalitems_activity, convex_hull, buffer_dis_meter, day_type = None, daily = None):
+    daily = build_daily_space(ucalitems_activity, convex_hull) if daily is None else daily
+    return(merge_windows(daily, *person_windows(daily, day_type), buffer_dis_meter, crs=convex_hull.crs))
+
+"""
+INPUT:  the same as person_activity_space
+        window_days <length of the rolling windows in days>
+
+OUTPUT: rolling-window activity space: 'convex_hull' and 'sde', one row per user and day with activities,
+        for the window of window_days days ending on this day (see merge_windows)
+"""
+def rolling_activity_space(ucalitems_activity, convex_hull, buffer_dis_meter, window_days = 7, day_type = None, daily = None):
+    daily = build_daily_space(ucalitems_activity, convex_hull) if daily is None else daily
+    return(merge_windows(daily, *rolling_windows(daily, window_days, day_type), buffer_dis_meter, crs=convex_hull.crs))
+
+if __name__=='__main__':
+    pass
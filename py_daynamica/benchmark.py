@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Benchmarks of the py_daynamica modules'
+
+__author__ = 'Xiaohuan Zeng'
+
+import sys
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+
+modules = ['s1_io_data', 's2_preprocess_data', 's3_valid_data', 's4_temporal_plot', 's5_cal_activity_space',
+           's6_daily_episode_summary', 's7_summary_subtype', 's8_time_use', 's9_sequence_pattern', 's10_day_similarity',
+           'local_day', 'place_index', 'pipeline']
+
+# heavy packages that should NOT be loaded by importing the modules above (they are imported on first use)
+heavy_packages = ['geopandas', 'shapely', 'pyproj', 'pointpats', 'matplotlib', 'seaborn', 'plotly', 'xlsxwriter']
+
+_import_script = """
+import sys, time
+t0 = time.perf_counter()
+import {0}
+t1 = time.perf_counter()
+print(t1 - t0)
+print(','.join(p for p in {1!r} if p in sys.modules))
+"""
+
+
+"""
+INPUT:  modules <names of the py_daynamica modules to import>
+        repeat <number of fresh interpreters per module, the minimum time is reported>
+
+TASKS:  import each module in a fresh python process (as a new pool worker or batch job would),
+        numpy and pandas are imported before the timer starts since every module needs them
+
+OUTPUT: table: module, import_seconds, heavy_packages_loaded
+"""
+def import_time(modules = modules, repeat = 3):
+    result_list = []
+    for module in modules:
+        times = []
+        for i in range(repeat):
+            script = 'import numpy, pandas\n' + _import_script.format('py_daynamica.' + module, heavy_packages)
+            output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout.splitlines()
+            times.append(float(output[-2]))
+        result_list.append([module, min(times), output[-1]])
+        print('{0:<28} {1:8.3f} s   {2}'.format(module, min(times), output[-1]))
+
+    result_df = pd.DataFrame(result_list, columns = ['module', 'import_seconds', 'heavy_packages_loaded'])
+    return(result_df)
+
+# mobility metrics of ONE person-day with a groupby apply (reference for mobility_time), home: (x, y) of the user
+def _mobility_apply(group, home):
+    group = group.sort_values(by='start_dt')
+    x, y = group['x'].values, group['y'].values
+    home_x, home_y = home.loc[group['user_id'].iloc[0], ['x', 'y']]
+    return(pd.Series({'radius_gyration_meter': np.sqrt(np.mean((x - x.mean()) ** 2 + (y - y.mean()) ** 2)),
+                      'path_length_meter': np.hypot(np.diff(x), np.diff(y)).sum(),
+                      'max_home_distance_meter': np.hypot(x - home_x, y - home_y).max()}))
+
+# minimum time (seconds) of repeat calls of func
+def _best_time(func, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return(min(times))
+
+"""
+INPUT:  ucalitems_activity <activities after extract_geo_info (x, y)>
+        repeat <number of runs, the minimum time is reported>
+        include_apply <True to also time the metrics computed with a groupby apply (slow on a full cohort)>
+
+TASKS:  time s5_cal_activity_space.cal_mobility_metrics against ONE groupby of the same activities by person-day
+        (the mean x and y; mean, std, min and max of x and y), and optionally against a per-group apply
+
+OUTPUT: table: method, seconds, ratio (to the single groupby)
+"""
+def mobility_time(ucalitems_activity, repeat = 3, include_apply = False):
+    import io
+    import contextlib
+    from py_daynamica import place_index, s5_cal_activity_space
+
+    df = ucalitems_activity[np.isfinite(ucalitems_activity['x'].values.astype(float))]
+    methods = {
+        'single groupby (mean x, y)': lambda: df.groupby(['user_id', 'start_date'])[['x', 'y']].mean(),
+        'single groupby (4 aggregates)': lambda: df.groupby(['user_id', 'start_date'])[['x', 'y']].agg(['mean', 'std', 'min', 'max']),
+        'cal_mobility_metrics': lambda: s5_cal_activity_space.cal_mobility_metrics(ucalitems_activity),
+    }
+    if include_apply:
+        def apply():
+            home = place_index.PlaceIndex(ucalitems_activity).home
+            return(df.groupby(['user_id', 'start_date']).apply(_mobility_apply, home))
+        methods['groupby apply'] = apply
+
+    result_list = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for method, func in methods.items():
+            result_list.append([method, _best_time(func, repeat)])
+    result_df = pd.DataFrame(result_list, columns = ['method', 'seconds'])
+    result_df['ratio'] = result_df['seconds'] / result_df['seconds'].iloc[0]
+    for row in result_df.itertuples():
+        print('{0:<30} {1:8.4f} s   x{2:0.1f}'.format(row.method, row.seconds, row.ratio))
+    return(result_df)
+
+if __name__=='__main__':
+    import_time()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Cluster bootstrap confidence intervals of the summary tables'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from py_daynamica import s6_daily_episode_summary, s7_summary_subtype
+
+"""
+Person days of the same participant are not independent, so participants (user_id) are resampled with replacement:
+a replicate is a vector of weights, the number of times each user is drawn (multinomial), and the replicates
+are drawn as a matrix W (replicates x users).
+
+The person-day values are aggregated ONCE per user and group (statistic and day type) into matrices (users x groups),
+then the statistics of all replicates are matrix products, e.g. the mean of each replicate and group is
+(W @ sums) / (W @ counts). Medians are computed on the values sorted by group with the cumulative weights of the users.
+Replicates are computed by chunks, in parallel over processes.
+For a stratified sample of users (see sampling), users are resampled within their strata.
+
+The confidence intervals are percentile intervals of the replicates, the standard errors are their standard deviations.
+"""
+
+
+# draw the weights of n replicates x n_users (number of times each user is drawn),
+# strata: stratum code of each user to draw the users within each stratum, None for one stratum
+def resample_weights(n_users, n_replicates, seed = 0, strata = None):
+    rng = np.random.default_rng(seed)
+    if strata is None:
+        return(rng.multinomial(n_users, np.full(n_users, 1 / n_users), size=n_replicates).astype(float))
+    weights = np.zeros((n_replicates, n_users))
+    for stratum in np.unique(strata):
+        users = np.flatnonzero(strata == stratum)
+        weights[:, users] = rng.multinomial(users.shape[0], np.full(users.shape[0], 1 / users.shape[0]), size=n_replicates)
+    return(weights)
+
+
+# data shared with the worker processes (set once per worker by the initializer)
+_data = None
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+# weighted median of the values of each group for each replicate (values sorted by group, integer weights)
+def _weighted_medians(weights, values, users, offsets):
+    result = np.full((weights.shape[0], offsets.shape[0] - 1), np.nan)
+    for g in range(offsets.shape[0] - 1):
+        if offsets[g + 1] == offsets[g]:
+            continue
+        cum = np.cumsum(weights[:, users[offsets[g]:offsets[g + 1]]], axis=1)
+        total = cum[:, -1]
+        # ranks (1-based) of the middle values of the resampled multiset, averaged when the number of values is even
+        lower = (cum < ((total + 1) // 2)[:, None]).sum(axis=1)
+        upper = (cum < (total // 2 + 1)[:, None]).sum(axis=1)
+        group_values = values[offsets[g]:offsets[g + 1]]
+        valid = total > 0
+        result[valid, g] = (group_values[np.minimum(lower[valid], group_values.shape[0] - 1)] +
+                            group_values[np.minimum(upper[valid], group_values.shape[0] - 1)]) / 2
+    return(result)
+
+def _person_day_chunk(seed, n_replicates):
+    weights = resample_weights(_data['n_users'], n_replicates, seed, _data['strata'])
+    count = weights @ _data['count']
+    sums = weights @ _data['sums']
+    squares = weights @ _data['squares']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count + _data['center']
+        std = np.sqrt(np.maximum(squares - sums ** 2 / count, 0) / (count - 1))
+    std[count <= 1] = np.nan
+    median = _weighted_medians(weights, _data['values'], _data['users'], _data['offsets'])
+    return({'median': median, 'mean': mean, 'std': std})
+
+def _ratio_chunk(seed, n_replicates):
+    weights = resample_weights(_data['n_users'], n_replicates, seed, _data['strata'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return({'ratio': (weights @ _data['numerator']) / (weights @ _data['denominator'])})
+
+# run the replicates by chunks (the seed of each chunk is derived from seed, so results do not depend on n_workers)
+def _run_replicates(func, data, n_replicates, seed, n_workers, chunk_size):
+    n_workers = n_workers or os.cpu_count() or 1
+    sizes = [min(chunk_size, n_replicates - start) for start in range(0, n_replicates, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if n_workers == 1:
+        _init_worker(data)
+        chunks = [func(s, n) for s, n in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(data,)) as executor:
+            chunks = list(executor.map(func, seeds, sizes))
+    return({key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0].keys()})
+
+# percentile intervals of the replicates (replicates x groups)
+def percentile_interval(replicates, alpha = 0.05):
+    return(np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0))
+
+# standard errors of the replicates (replicates x groups)
+def standard_error(replicates):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return(np.nanstd(replicates, axis=0, ddof=1))
+
+# stratum code of each user (users without a stratum raise an Exception), None if strata is None
+def _user_strata(users, strata):
+    if strata is None:
+        return(None)
+    codes = pd.Series(strata).reindex(users)
+    if codes.isna().any():
+        raise Exception("Sorry, stratum not found for user_id: {}".format(list(codes.index[codes.isna()])))
+    return(pd.factorize(codes.values)[0])
+
+
+"""
+INPUT:  per_day_df <long table of person-day values with user_id, the group columns and 'value', e.g. s6_daily_episode_summary.per_day_statistics>
+        by <group columns>
+        n_replicates, alpha <1 - confidence level>, seed
+        n_workers <number of processes, None for the number of cpus>, chunk_size <replicates computed at once by a process>
+        strata <user_id -> stratum (dict or Series) to resample the users within strata, None for no strata>
+
+OUTPUT: one row per group: by columns, and for median, mean, std: estimate (all data), ci_lower, ci_upper, se
+"""
+def person_day_bootstrap(per_day_df, by = ['IsWeekend', 'Statistics'], n_replicates = 1000, alpha = 0.05, seed = 0, n_workers = 1, chunk_size = 100,
+                         strata = None):
+    df = per_day_df[per_day_df['value'].notna()]
+    group, group_keys = pd.factorize(pd.MultiIndex.from_frame(df[by]), sort=True)
+    user, users = pd.factorize(df['user_id'])
+    n_groups, n_users = group_keys.shape[0], users.shape[0]
+    values = df['value'].values.astype(float)
+
+    # values centered by group to keep the sums of squares accurate
+    count = np.bincount(group, minlength=n_groups)
+    center = np.bincount(group, weights=values, minlength=n_groups) / count
+    centered = values - center[group]
+    cell = user * n_groups + group
+    matrix = lambda weights: np.bincount(cell, weights=weights, minlength=n_users * n_groups).reshape(n_users, n_groups)
+
+    # values sorted by group and value, with the user of each value, for the medians
+    order = np.lexsort((values, group))
+    data = {
+        'n_users': n_users, 'strata': _user_strata(users, strata), 'center': center,
+        'count': matrix(np.ones(values.shape[0])), 'sums': matrix(centered), 'squares': matrix(centered ** 2),
+        'values': values[order], 'users': user[order], 'offsets': np.concatenate([[0], np.cumsum(count)]),
+    }
+    replicates = _run_replicates(_person_day_chunk, data, n_replicates, seed, n_workers, chunk_size)
+
+    result = pd.DataFrame(list(group_keys), columns=by)
+    estimates = df.groupby(by)['value'].agg(['median', 'mean', np.std])
+    for stat in ['median', 'mean', 'std']:
+        lower, upper = percentile_interval(replicates[stat], alpha)
+        result[stat] = estimates[stat].values
+        result[stat + '_ci_lower'] = lower
+        result[stat + '_ci_upper'] = upper
+        result[stat + '_se'] = standard_error(replicates[stat])
+
+    print('# person-days: {0:0.0f}. # users: {1:0.0f}. # groups: {2:0.0f}. # replicates: {3:0.0f}'.format(df.shape[0], n_users, n_groups, n_replicates))
+    return(result)
+
+
+"""
+INPUT:  csv dict with selected valid dates (see s6_daily_episode_summary.overview_statistics)
+        stat_group_cols, n_replicates, alpha, seed, n_workers, strata <see person_day_bootstrap>
+
+OUTPUT: the overview statistics table (daily_summary) with confidence intervals and standard errors of the median, mean and SD:
+        columns 'Median_CI_Lower', 'Median_CI_Upper', 'Median_SE', 'Mean_CI_Lower', ... (no intervals for min and max)
+"""
+def overview_statistics_ci(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'], n_replicates = 1000, alpha = 0.05, seed = 0, n_workers = 1,
+                           strata = None):
+    per_day_df = s6_daily_episode_summary.per_day_statistics(csv_dict)
+    result = s6_daily_episode_summary.overview_statistics(csv_dict, stat_group_cols)
+    ci = person_day_bootstrap(per_day_df, stat_group_cols, n_replicates=n_replicates, alpha=alpha, seed=seed, n_workers=n_workers,
+                              strata=strata)
+
+    # intervals joined to the groups by the keys (not by position)
+    ci_cols = {}
+    for stat, col in [('median', 'Median'), ('mean', 'Mean'), ('std', 'SD')]:
+        ci_cols.update({stat + '_ci_lower': col + '_CI_Lower', stat + '_ci_upper': col + '_CI_Upper', stat + '_se': col + '_SE'})
+    ci = ci[list(stat_group_cols) + list(ci_cols)].rename(columns=ci_cols)
+    # statistics renamed as in s6_daily_episode_summary.format_statistics, e.g. '1_Recorded Data per Day (Minutes)'
+    ci['Statistics'] = ci['Statistics'].str.split('_').str[1]
+    result = result.merge(ci, on=list(stat_group_cols), how='left', validate='one_to_one')
+    return(result)
+
+
+"""
+INPUT:  ucalitems, day_summary, mytype, trip_count, cube, source <see s7_summary_subtype.activity_trip_subtype>
+        n_replicates, alpha, seed, n_workers, strata <see person_day_bootstrap>
+
+TASKS:  the mean per valid day of each subtype is (sum of the measure) / (number of valid days), the sums and the days
+        are aggregated by user, then each replicate is a ratio of two matrix products
+
+OUTPUT: long table: Type, variable, day_type, value (same as activity_trip_subtype), ci_lower, ci_upper, se, incl. the Total of all subtypes
+"""
+def activity_trip_subtype_ci(ucalitems, day_summary, mytype, trip_count = -1, cube = None, source = None,
+                             n_replicates = 1000, alpha = 0.05, seed = 0, n_workers = 1, strata = None):
+    agg_funcs = s7_summary_subtype.agg_dict[mytype]
+    if cube is not None:
+        ucalitems, agg_funcs = s7_summary_subtype.cube_source(cube, s7_summary_subtype.episode_source(ucalitems, source))
+        agg_funcs = {col: agg_funcs[col] for col in s7_summary_subtype.agg_dict[mytype].keys()}
+    df = ucalitems[ucalitems['type_decoded'] == mytype]
+    cols = list(s7_summary_subtype.agg_dict[mytype].keys())
+    df = df.groupby(['user_id', 'IsWeekend', 'subtype_decoded']).agg(agg_funcs).reset_index()
+    df['duration_after_split'] = df['duration_after_split'] * s7_summary_subtype.duration_unit[mytype]
+    if 'distance_after_split' in df.columns:
+        df['distance_after_split'] = df['distance_after_split'] / s7_summary_subtype.unit_convert
+
+    days = day_summary[day_summary['trip_count'] > trip_count]
+    users = pd.Index(pd.unique(np.concatenate([days['user_id'].values, df['user_id'].values])))
+    day_types = ['All Days', 'Weekend', 'Weekday']
+    subtypes = sorted(df['subtype_decoded'].unique()) + ['Total']
+
+    # columns of the matrices: (variable, day type, subtype)
+    keys = [(col, day_type, subtype) for col in cols for day_type in day_types for subtype in subtypes]
+    numerator = np.zeros((users.shape[0], len(keys)))
+    denominator = np.zeros((users.shape[0], len(keys)))
+    for j, (col, day_type, subtype) in enumerate(keys):
+        sub = df if day_type == 'All Days' else df[df['IsWeekend'] == day_type]
+        sub = sub if subtype == 'Total' else sub[sub['subtype_decoded'] == subtype]
+        np.add.at(numerator[:, j], users.get_indexer(sub['user_id']), sub[col].values)
+        sub_days = days if day_type == 'All Days' else days[days['IsWeekend'] == day_type]
+        np.add.at(denominator[:, j], users.get_indexer(sub_days['user_id']), 1)
+
+    data = {'n_users': users.shape[0], 'strata': _user_strata(users, strata), 'numerator': numerator, 'denominator': denominator}
+    replicates = _run_replicates(_ratio_chunk, data, n_replicates, seed, n_workers, chunk_size=100)
+    lower, upper = percentile_interval(replicates['ratio'], alpha)
+
+    type_col = ' '.join([mytype.title(), 'Type'])
+    result = pd.DataFrame(keys, columns=['variable', 'day_type', type_col])
+    result['variable'] = result['variable'].map(s7_summary_subtype.col_dict_final[mytype])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result['value'] = numerator.sum(axis=0) / denominator.sum(axis=0)
+    result['ci_lower'] = lower
+    result['ci_upper'] = upper
+    result['se'] = standard_error(replicates['ratio'])
+    return(result[[type_col, 'variable', 'day_type', 'value', 'ci_lower', 'ci_upper', 'se']])
+
+if __name__=='__main__':
+    pass
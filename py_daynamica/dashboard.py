@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Local dashboard on the precomputed aggregates'
+
+__author__ = 'Xiaohuan Zeng'
+
+import json
+import time
+import functools
+import numpy as np
+import pandas as pd
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from py_daynamica import s1_io_data, s4_temporal_plot, s7_summary_subtype
+
+"""
+A small local web app (standard library http.server, no web framework) on top of the precomputed aggregates:
+    - the subtype cube (s7_summary_subtype.build_subtype_cube): one row per person day, type and subtype
+    - day_summary of the valid days: one row per person day
+The tables are loaded ONCE and kept as columns of integer codes (ColumnTable), a slice is a boolean mask of np.isin
+on the codes and a roll-up is a bincount, so a request does not touch pandas groupby.
+The timeline of a user is rendered on request (s4_temporal_plot.timeline_figure), from an EpisodeStore or ucalitems_temporal_plot.
+
+Responses are cached by path and sorted query parameters (lru_cache), each response has the header X-Response-Time (ms)
+and the requests slower than budget_ms are printed.
+
+API (GET, query parameters are comma separated lists, all optional):
+    /api/options                         types, subtypes, day types, users
+    /api/subtype?type=&subtype=&day_type=&user=&source=&by=
+                                         mean per valid day of count, hours and meters by the columns "by" (default subtype_decoded),
+                                         the same means as s7_summary_subtype.activity_trip_subtype (before the unit conversion),
+                                         episodes without subtype are the subtype 'UNKNOWN'
+    /api/days?day_type=&user=&stat=      mean, median and number of valid days of the day_summary statistics
+    /api/timeline?user=                  html of the timeline of ONE user
+"""
+
+
+# label of the missing values of the text key columns, e.g. episodes without subtype kept by the subtype cube
+missing_label = 'UNKNOWN'
+
+
+class ColumnTable(object):
+    """
+    df: table to keep as columns: texts and dates as integer codes with their unique values, numbers as float arrays
+        (missing texts are labeled missing_label, other missing keys have their own code, so that every row has a cell)
+    """
+    def __init__(self, df, key_cols, value_cols):
+        self.rows = df.shape[0]
+        self.codes = {}
+        self.uniques = {}
+        for col in key_cols:
+            keys = df[col].fillna(missing_label) if df[col].dtype == object else df[col]
+            self.codes[col], self.uniques[col] = pd.factorize(keys, sort=True, use_na_sentinel=False)
+        self.values = {col: df[col].values.astype(float) for col in value_cols}
+
+    # rows of the slice: values of each key column to keep (None or missing for all values)
+    def mask(self, filters):
+        result = np.ones(self.rows, dtype=bool)
+        for col, values in filters.items():
+            if values is None:
+                continue
+            index = self.uniques[col].get_indexer(values)
+            result &= np.isin(self.codes[col], index[index >= 0])
+        return(result)
+
+    # sums of the values (and number of rows) of the slice by the key columns "by"
+    def rollup(self, by, mask, value_cols = None):
+        value_cols = list(self.values.keys()) if value_cols is None else value_cols
+        shape = tuple(self.uniques[col].shape[0] for col in by)
+        cell = np.ravel_multi_index(tuple(self.codes[col][mask] for col in by), shape) if by else np.zeros(mask.sum(), dtype=np.int64)
+        size = int(np.prod(shape)) if by else 1
+        count = np.bincount(cell, minlength=size)
+        keep = np.flatnonzero(count)
+        result = pd.DataFrame({col: self.uniques[col][index] for col, index in zip(by, np.unravel_index(keep, shape))})
+        result['rows'] = count[keep]
+        for col in value_cols:
+            result[col] = np.bincount(cell, weights=self.values[col][mask], minlength=size)[keep]
+        return(result)
+
+
+class Dashboard(object):
+    """
+    cube: subtype cube (s7_summary_subtype.build_subtype_cube) of the valid days
+    day_summary: day_summary of the valid days
+    episodes: EpisodeStore or ucalitems_temporal_plot for the timelines, None for no timeline
+    cache_size: number of cached responses, budget_ms: latency budget of a request
+    """
+    def __init__(self, cube, day_summary, episodes = None, cache_size = 1024, budget_ms = 200):
+        self.cube = ColumnTable(cube, ['user_id', 'IsWeekend', 'type_decoded', 'subtype_decoded', 'source'], list(s7_summary_subtype.cube_measures.keys()))
+        self.stat_cols = [col for col in day_summary.columns if pd.api.types.is_numeric_dtype(day_summary[col]) and col != 'person_day']
+        self.days = ColumnTable(day_summary, ['user_id', 'IsWeekend'], self.stat_cols)
+        self.episodes = episodes
+        self.budget_ms = budget_ms
+        self.response = functools.lru_cache(maxsize=cache_size)(self._response)
+        print('# cube rows: {0:0.0f}. # valid days: {1:0.0f}. # users: {2:0.0f}'.format(self.cube.rows, self.days.rows, self.days.uniques['user_id'].shape[0]))
+
+    def options(self):
+        return({'type': list(self.cube.uniques['type_decoded']), 'subtype': list(self.cube.uniques['subtype_decoded']),
+                'day_type': list(self.days.uniques['IsWeekend']), 'user': list(self.days.uniques['user_id']),
+                'source': list(self.cube.uniques['source']), 'stat': self.stat_cols})
+
+    # number of valid days of the slice (the denominator of the means per valid day)
+    def valid_days(self, day_type = None, user = None):
+        return(int(self.days.mask({'IsWeekend': day_type, 'user_id': user}).sum()))
+
+    """
+    INPUT:  type, subtype, day_type ('Weekday' or 'Weekend'), user <lists of values, None for all>
+            source <'segment' or 'complete'>, by <columns of the cube>
+
+    OUTPUT: by columns, number of cube rows, sums of the measures, and the means per valid day ('<measure>_per_day')
+    """
+    def subtype(self, type = None, subtype = None, day_type = None, user = None, source = 'segment', by = ['subtype_decoded']):
+        mask = self.cube.mask({'type_decoded': type, 'subtype_decoded': subtype, 'IsWeekend': day_type, 'user_id': user, 'source': [source]})
+        result = self.cube.rollup(list(by), mask)
+        n_days = self.valid_days(day_type, user)
+        for col in s7_summary_subtype.cube_measures.keys():
+            result[col + '_per_day'] = result[col] / n_days if n_days > 0 else np.nan
+        return(result, n_days)
+
+    # mean and median of the day_summary statistics of the valid days of the slice
+    def day_statistics(self, day_type = None, user = None, stat = None):
+        mask = self.days.mask({'IsWeekend': day_type, 'user_id': user})
+        stat = self.stat_cols if stat is None else stat
+        values = np.column_stack([self.days.values[col][mask] for col in stat]) if mask.any() else np.full((0, len(stat)), np.nan)
+        with np.errstate(invalid='ignore'):
+            result = pd.DataFrame({'Statistics': stat, 'mean': values.mean(axis=0), 'median': np.median(values, axis=0)})
+        result['days'] = int(mask.sum())
+        return(result)
+
+    # html of the timeline of ONE user
+    def timeline(self, user_id):
+        if self.episodes is None:
+            return(None)
+        fig = s4_temporal_plot.timeline_figure(s4_temporal_plot.user_episodes(self.episodes, user_id))
+        if fig is None:
+            return(None)
+        return(fig.to_html(full_html=True, include_plotlyjs='cdn', config=s4_temporal_plot.config))
+
+    """
+    INPUT:  path, query <tuple of sorted (name, value) pairs, so that equal requests share the cache>
+
+    OUTPUT: (status, content type, body as bytes)
+    """
+    def _response(self, path, query):
+        params = {name: value.split(',') for name, value in query if value != ''}
+        one = lambda name, default: params[name][0] if name in params else default
+        if path == '/api/options':
+            body = json.dumps(self.options())
+        elif path == '/api/subtype':
+            result, n_days = self.subtype(params.get('type'), params.get('subtype'), params.get('day_type'), params.get('user'),
+                                          one('source', 'segment'), params.get('by', ['subtype_decoded']))
+            body = json.dumps({'valid_days': n_days, 'rows': json.loads(result.to_json(orient='records'))})
+        elif path == '/api/days':
+            body = self.day_statistics(params.get('day_type'), params.get('user'), params.get('stat')).to_json(orient='records')
+        elif path == '/api/timeline':
+            html = self.timeline(one('user', None))
+            if html is None:
+                return(404, 'text/plain', b'no episodes')
+            return(200, 'text/html', html.encode('utf-8'))
+        elif path == '/':
+            return(200, 'text/html', index_html.encode('utf-8'))
+        else:
+            return(404, 'text/plain', b'not found')
+        return(200, 'application/json', body.encode('utf-8'))
+
+    # response of a url path with query, cached; KeyError (unknown column) and ValueError are bad requests
+    def handle(self, url):
+        start = time.perf_counter()
+        parsed = urlparse(url)
+        try:
+            status, content_type, body = self.response(parsed.path, tuple(sorted(parse_qsl(parsed.query, keep_blank_values=True))))
+        except (KeyError, ValueError) as e:
+            status, content_type, body = 400, 'text/plain', 'bad request: {}'.format(e).encode('utf-8')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > self.budget_ms:
+            print('slow request ({0:0.0f} ms > {1:0.0f} ms): {2}'.format(elapsed_ms, self.budget_ms, url))
+        return(status, content_type, body, elapsed_ms)
+
+    # http server on localhost, serve_forever() to run it
+    def server(self, host = '127.0.0.1', port = 8050):
+        dashboard = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body, elapsed_ms = dashboard.handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type + '; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Response-Time', '{0:0.1f}'.format(elapsed_ms))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return(ThreadingHTTPServer((host, port), Handler))
+
+    # run the dashboard (blocks until interrupted)
+    def run(self, host = '127.0.0.1', port = 8050):
+        server = self.server(host, port)
+        print('dashboard: http://{}:{}/'.format(host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+"""
+INPUT:  csv_dict_sub <csv dict with selected valid dates, with leg2trip>
+        episodes <EpisodeStore for the timelines, None to use ucalitems_temporal_plot>
+
+OUTPUT: Dashboard, the subtype cube is built once from the episodes
+"""
+def dashboard_from_dict(csv_dict_sub, episodes = None, **kwargs):
+    cube = csv_dict_sub.get('subtype_cube')
+    if cube is None:
+        cube = s7_summary_subtype.build_subtype_cube(csv_dict_sub['ucalitems_temporal_plot'], csv_dict_sub.get('leg2trip'))
+    episodes = csv_dict_sub.get('ucalitems_temporal_plot') if episodes is None else episodes
+    return(Dashboard(cube, csv_dict_sub['day_summary'], episodes, **kwargs))
+
+# Dashboard of a folder saved by s1_io_data.dict2file (tables subtype_cube or ucalitems_temporal_plot, and day_summary)
+def dashboard_from_folder(folder_path, episodes = None, **kwargs):
+    return(dashboard_from_dict(s1_io_data.path2dict(folder_path), episodes, **kwargs))
+
+
+# page of the dashboard: selections call the api and show the tables, the timeline is opened in a frame
+index_html = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Daynamica dashboard</title>
+<style>body{font-family:Calibri,sans-serif;margin:20px} select{min-width:160px} table{border-collapse:collapse;margin:10px 0}
+td,th{border:1px solid #ccc;padding:2px 8px;text-align:right} th{background:#f0f0f0}</style></head>
+<body>
+<h3>Daynamica dashboard</h3>
+<div id="filters"></div>
+<p id="info"></p>
+<h4>Per valid day by subtype</h4><div id="subtype"></div>
+<h4>Day summary</h4><div id="days"></div>
+<h4>Timeline</h4><iframe id="timeline" width="1100" height="600" frameborder="0"></iframe>
+<script>
+const names = ['type', 'subtype', 'day_type', 'source', 'user'];
+function table(rows) {
+  if (!rows.length) return '<p>no rows</p>';
+  const cols = Object.keys(rows[0]);
+  const fmt = v => typeof v === 'number' ? (Number.isInteger(v) ? v : v.toFixed(3)) : v;
+  return '<table><tr>' + cols.map(c => '<th>' + c + '</th>').join('') + '</tr>' +
+    rows.map(r => '<tr>' + cols.map(c => '<td>' + fmt(r[c]) + '</td>').join('') + '</tr>').join('') + '</table>';
+}
+function query() {
+  return names.map(n => [n, Array.from(document.getElementById(n).selectedOptions).map(o => o.value).filter(v => v).join(',')])
+    .filter(p => p[1]).map(p => p[0] + '=' + encodeURIComponent(p[1])).join('&');
+}
+async function refresh() {
+  const q = query();
+  const t0 = performance.now();
+  const sub = await (await fetch('/api/subtype?' + q)).json();
+  const days = await (await fetch('/api/days?' + q)).json();
+  document.getElementById('info').textContent = 'valid days: ' + sub.valid_days + ' (' + (performance.now() - t0).toFixed(0) + ' ms)';
+  document.getElementById('subtype').innerHTML = table(sub.rows);
+  document.getElementById('days').innerHTML = table(days);
+  const users = Array.from(document.getElementById('user').selectedOptions).map(o => o.value).filter(v => v);
+  document.getElementById('timeline').src = users.length == 1 ? '/api/timeline?user=' + encodeURIComponent(users[0]) : 'about:blank';
+}
+fetch('/api/options').then(r => r.json()).then(options => {
+  document.getElementById('filters').innerHTML = names.map(n => n + ' <select id="' + n + '"' + (n == 'source' ? '' : ' multiple') + '>' +
+    (n == 'source' ? '' : '<option value="">(all)</option>') + options[n].map(v => '<option>' + v + '</option>').join('') + '</select>').join(' ');
+  names.forEach(n => document.getElementById(n).addEventListener('change', refresh));
+  refresh();
+});
+</script>
+</body></html>
+'''
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Data quality scan of the calendar items'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+"""
+The calendar items of a user are expected to tile the days: each item starts when the previous one ends.
+The items are sorted by user and start time ONCE, then each item is compared with the items before it by shifted arrays:
+    - overlap: the item starts before the latest end time of the previous items of the user
+    - gap: the item starts more than min_gap_minutes after the latest end time of the previous items of the user
+      (split days end at 23:59:59.999 and start at 00:00:00, the 1 ms between them is not a gap)
+    - nonpositive_duration: duration_after_split <= 0
+    - implausible_speed: trips faster than the maximum speed of their mode (distance / duration, a trip with a distance
+      and no duration has an infinite speed)
+Gaps and overlaps are counted on the day (start_date) of the item after them.
+
+Note: time zone aware start_dt / end_dt are compared in UTC, local date times without time zone (several time zones)
+are compared as wall clock times, so a change of daylight saving time may show as a gap or an overlap of one hour.
+"""
+
+unit_convert = 1609.344  # meters per mile
+
+# maximum plausible speed (miles per hour) of each trip subtype
+max_speed_mph = {
+    'CAR - DRIVER': 100,
+    'CAR - PASSENGER': 100,
+    'VEHICLE': 100,
+    'TAXI/UBER/LYFT': 100,
+    'RAIL': 150,
+    'BUS': 80,
+    'BIKE': 35,
+    'WALK': 10,
+    'WAIT': 10,
+}
+default_max_speed_mph = 150  # other trip subtypes, e.g. 'OTHER TRIPS' or 'TRIP'
+
+issue_cols = ['overlap', 'gap', 'nonpositive_duration', 'implausible_speed']
+
+
+# date time column to int64 nanoseconds (UTC for time zone aware columns)
+def _datetime_ns(values):
+    return(values.values.view(np.int64) if hasattr(values, 'dt') and values.dt.tz is not None else values.values.astype('datetime64[ns]').view(np.int64))
+
+
+"""
+INPUT:  ucalitems_ljoin_ucisurvey_split <table after split_ucalitems>
+        min_gap_minutes <shorter uncovered times between two items are not gaps>
+        speed_limits <maximum speed (mph) by trip subtype, default max_speed_mph>
+
+OUTPUT: one row per item, index of the input table:
+        the four issue flags (issue_cols), overlap_minutes, gap_minutes, speed_mph (NaN for activities)
+"""
+def flag_ucalitems(ucalitems_ljoin_ucisurvey_split, min_gap_minutes = 1, speed_limits = None):
+    df = ucalitems_ljoin_ucisurvey_split
+    speed_limits = max_speed_mph if speed_limits is None else speed_limits
+    start_ns = _datetime_ns(df['start_dt'])
+    end_ns = _datetime_ns(df['end_dt'])
+    user = pd.factorize(df['user_id'], sort=True)[0]
+
+    # sort by user and start time, latest end time of the previous items of the same user (running max shifted by one)
+    order = np.lexsort((end_ns, start_ns, user))
+    user_s, start_s, end_s = user[order], start_ns[order], end_ns[order]
+    latest_end = pd.Series(end_s).groupby(user_s).cummax().values
+    same_user = np.concatenate([[False], user_s[1:] == user_s[:-1]])
+    prev_end = np.concatenate([[0], latest_end[:-1]])
+
+    overlap_ns = np.where(same_user, np.minimum(end_s, prev_end) - start_s, 0).clip(min=0)
+    gap_ns = np.where(same_user, start_s - prev_end, 0).clip(min=0)
+    gap_ns = np.where(gap_ns > min_gap_minutes * 6e10, gap_ns, 0)
+
+    # back to the order of the table
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(order.shape[0])
+    result = pd.DataFrame(index=df.index)
+    result['overlap'] = (overlap_ns > 0)[inverse]
+    result['gap'] = (gap_ns > 0)[inverse]
+    result['nonpositive_duration'] = df['duration_after_split'].values <= 0
+
+    # speed of trips in miles per hour
+    is_trip = df['type_decoded'].values == 'TRIP'
+    limit = df['subtype_decoded'].map(speed_limits).fillna(default_max_speed_mph).values
+    distance = df['distance_after_split'].values / unit_convert
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.where(df['duration_after_split'].values > 0, distance / df['duration_after_split'].values, np.where(distance > 0, np.inf, 0))
+    result['implausible_speed'] = is_trip & (speed > limit)
+
+    result['overlap_minutes'] = overlap_ns[inverse] / 6e10
+    result['gap_minutes'] = gap_ns[inverse] / 6e10
+    result['speed_mph'] = np.where(is_trip, speed, np.nan)
+    return(result)
+
+
+"""
+INPUT:  ucalitems_ljoin_ucisurvey_split, min_gap_minutes, speed_limits <see flag_ucalitems>
+
+TASKS:  flag the items, then count the issues by person day with integer codes of (user_id, start_date)
+
+OUTPUT: a per-user, per-day issue table 'data_quality': user_id, start_date, items,
+        number of items with each issue (issue_cols), overlap_minutes, gap_minutes, issues (total count),
+        one row per person day of the table (days without issues have zeros)
+"""
+def scan_quality(ucalitems_ljoin_ucisurvey_split, min_gap_minutes = 1, speed_limits = None):
+    df = ucalitems_ljoin_ucisurvey_split
+    flags = flag_ucalitems(df, min_gap_minutes=min_gap_minutes, speed_limits=speed_limits)
+
+    day, days = pd.factorize(pd.MultiIndex.from_frame(df[['user_id', 'start_date']]), sort=True)
+    days = pd.MultiIndex.from_tuples(list(days), names=['user_id', 'start_date'])
+    result = days.to_frame(index=False)
+    result['items'] = np.bincount(day, minlength=days.shape[0])
+    for col in issue_cols:
+        result[col] = np.bincount(day, weights=flags[col].values, minlength=days.shape[0]).astype(np.int64)
+    for col in ['overlap_minutes', 'gap_minutes']:
+        result[col] = np.bincount(day, weights=flags[col].values, minlength=days.shape[0])
+    result['issues'] = result[issue_cols].sum(axis=1)
+
+    print('# person days: {0:0.0f}. # days with issues: {1:0.0f}. # items with '.format(result.shape[0], (result['issues'] > 0).sum()) +
+          ', '.join('{}: {:0.0f}'.format(col, flags[col].sum()) for col in issue_cols))
+    return(result)
+
+if __name__=='__main__':
+    pass
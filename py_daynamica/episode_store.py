@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Episode store on disk with random access by user'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+"""
+The store is a folder with one .npy file per column (column_<i>.npy), rows sorted by user_id and start_dt:
+    - numbers and booleans are saved as they are
+    - date times are saved as int64 nanoseconds (UTC for time zone aware columns)
+    - texts and other objects are saved as int32 codes, the unique values are saved in column_<i>.values.npy
+    - users.npy and offsets.npy: the rows of user users[i] are offsets[i]:offsets[i+1]
+The columns are opened as memory-mapped arrays, so loading one user reads only the rows of this user.
+"""
+
+store_file = '_store.json'
+
+
+"""
+INPUT:  ucalitems <ucalitems_temporal_plot, or another table of episodes with user_id and start_dt>
+        path <folder of the store, created if it does not exist>
+
+OUTPUT: the EpisodeStore saved in the folder
+"""
+def save_episode_store(ucalitems, path):
+    os.makedirs(path, exist_ok = True)
+    df = ucalitems.sort_values(by = ['user_id', 'start_dt'], kind = 'mergesort')
+    user_codes, users = pd.factorize(df['user_id'], sort = True)
+
+    columns = {}
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        dtype = str(values.dtype)
+        file = 'column_{}'.format(i)
+        coded = False
+        if dtype.startswith('datetime64[ns, '):
+            np.save(os.path.join(path, file + '.npy'), values.dt.tz_convert('UTC').dt.tz_localize(None).values.view(np.int64))
+        elif dtype.startswith('datetime64') or dtype.startswith('timedelta64'):
+            np.save(os.path.join(path, file + '.npy'), values.values.view(np.int64))
+        elif (values.dtype.kind in 'biuf'):
+            np.save(os.path.join(path, file + '.npy'), values.values)
+        else:
+            codes, uniques = pd.factorize(values)
+            np.save(os.path.join(path, file + '.npy'), codes.astype(np.int32))
+            np.save(os.path.join(path, file + '.values.npy'), np.asarray(uniques, dtype = object), allow_pickle = True)
+            coded = True
+        columns[col] = {'file': file, 'dtype': dtype, 'coded': coded}
+
+    np.save(os.path.join(path, 'users.npy'), np.asarray(users, dtype = object), allow_pickle = True)
+    np.save(os.path.join(path, 'offsets.npy'), np.concatenate([[0], np.cumsum(np.bincount(user_codes, minlength = users.shape[0]))]))
+    with open(os.path.join(path, store_file), 'w') as f:
+        json.dump({'rows': df.shape[0], 'columns': columns}, f, indent = 2)
+
+    print('# episodes: {0:0.0f}. # users: {1:0.0f}. store: {2}'.format(df.shape[0], users.shape[0], path))
+    return(EpisodeStore(path))
+
+
+class EpisodeStore(object):
+    """
+    path: folder saved by save_episode_store
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, store_file)) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.columns = meta['columns']
+
+        self.users = np.load(os.path.join(path, 'users.npy'), allow_pickle = True)
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.user_row = {user_id: i for i, user_id in enumerate(self.users)}
+
+        # memory-mapped columns and unique values of coded columns, opened on first use
+        self._arrays = {}
+        self._values = {}
+
+    def __len__(self):
+        return(self.rows)
+
+    def __contains__(self, user_id):
+        return(user_id in self.user_row)
+
+    def _array(self, col):
+        if col not in self._arrays:
+            self._arrays[col] = np.load(os.path.join(self.path, self.columns[col]['file'] + '.npy'), mmap_mode = 'r')
+        return(self._arrays[col])
+
+    def _column(self, col, rows):
+        values = np.asarray(self._array(col)[rows])
+        dtype = self.columns[col]['dtype']
+        if dtype.startswith('datetime64[ns, '):
+            return(pd.Series(values.view('datetime64[ns]')).dt.tz_localize('UTC').dt.tz_convert(dtype[len('datetime64[ns, '):-1]))
+        if dtype.startswith('datetime64') or dtype.startswith('timedelta64'):
+            return(pd.Series(values.view(dtype)))
+        if self.columns[col]['coded']:
+            if col not in self._values:
+                # one extra value for the code -1 (missing values)
+                uniques = np.load(os.path.join(self.path, self.columns[col]['file'] + '.values.npy'), allow_pickle = True)
+                self._values[col] = np.append(uniques, np.nan).astype(object)
+            result = pd.Series(self._values[col][values], dtype = object)
+            return(result.astype(dtype) if dtype != 'object' else result)
+        return(pd.Series(values))
+
+    # rows of ONE user, (start, stop)
+    def user_rows(self, user_id):
+        i = self.user_row.get(user_id)
+        if i is None:
+            return(0, 0)
+        return(self.offsets[i], self.offsets[i + 1])
+
+    """
+    INPUT:  user_ids <one user id or a list of user ids, None for all users>
+            columns <columns to load, None for all columns>
+
+    OUTPUT: episodes of the users, sorted by user_id and start_dt
+    """
+    def load(self, user_ids = None, columns = None):
+        columns = list(self.columns.keys()) if columns is None else columns
+        if user_ids is None:
+            rows = slice(0, self.rows)
+        elif np.ndim(user_ids) == 0:
+            rows = slice(*self.user_rows(user_ids))
+        else:
+            rows = np.concatenate([np.arange(*self.user_rows(user_id)) for user_id in user_ids] + [np.array([], dtype = np.int64)])
+        return(pd.DataFrame({col: self._column(col, rows) for col in columns}))
+
+if __name__=='__main__':
+    pass
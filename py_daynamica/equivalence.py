@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Golden-output equivalence harness of the reference and optimized code paths'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import sys
+import pickle
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from py_daynamica import pipeline, s7_summary_subtype
+
+"""
+Before a fast path is enabled, its outputs are compared with the outputs of a reference implementation on the SAME inputs:
+    - an implementation is a folder with the package py_daynamica, e.g. a checkout of an earlier version as the reference
+      (git worktree add <folder> <commit>) and this folder as the candidate
+    - inputs are synthetic (synthetic_export: several users and days, items across midnight and across the change of
+      daylight saving time, activities without centroid, ...) or recorded (a csv dict read by s1_io_data.path2dict);
+      the input tables of each function are prepared ONCE by the pipeline of this folder
+    - each case (a function and its input tables) runs in a fresh python process per implementation, with the folder
+      first in sys.path, so both versions of the package can be imported; the time is the minimum of repeat runs after
+      a warm-up run (packages imported on first use are not timed) and the memory is the peak of the allocations traced
+      by tracemalloc (a separate run)
+    - outputs are compared with numeric tolerances (compare_outputs): columns, row order, values, dtypes (optional),
+      geometries (symmetric difference area), dictionaries and tuples of tables
+
+The report has one row per case: status, differences, time and peak memory of both implementations, speedup and memory ratio.
+"""
+
+# columns added by the optimized paths, ignored if the reference does not have them (see person_day)
+default_ignore_columns = ['person_day']
+# tables of the pipeline adding optional outputs (see s6_daily_episode_summary.per_day_statistics)
+optional_tables = ['mobility']
+
+
+class Case(object):
+    """
+    name: case name
+    func: function name in the package, e.g. 's2_preprocess_data.split_ucalitems'
+    inputs: names of the input tables (arguments in order) in the prepared inputs, 'name.key' for a table in a dictionary
+    kwargs: other keyword arguments
+    reference_inputs: input tables of the reference if they are different (None for the same inputs),
+                      e.g. the episodes for the reference and the subtype cube for the candidate
+    """
+    def __init__(self, name, func, inputs, kwargs = {}, reference_inputs = None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.kwargs = dict(kwargs)
+        self.reference_inputs = self.inputs if reference_inputs is None else list(reference_inputs)
+
+    def __repr__(self):
+        return('Case({}: {}({}))'.format(self.name, self.func, ', '.join(self.inputs)))
+
+
+# functions with subtle behaviors (day boundaries at 23:59:59.999, IsWeekend, max 1440, Point / LineString rules, ...)
+default_cases = [
+    Case('split_ucalitems', 's2_preprocess_data.split_ucalitems', ['ucalitems_ljoin_ucisurvey'], {'local_timezone': 'US/Central'}),
+    Case('get_per_day_duration', 's2_preprocess_data.get_per_day_duration', ['ucalitems_ljoin_ucisurvey_split']),
+    Case('leg2trip', 's6_daily_episode_summary.leg2trip', ['valid_days.ucalitems_temporal_plot']),
+    Case('cal_convex_hull', 's5_cal_activity_space.cal_convex_hull', ['ucalitems_activity'], {'buffer_dis_meter': 100}),
+    Case('cal_sde', 's5_cal_activity_space.cal_sde', ['ucalitems_activity', 'convex_hull'], {'buffer_dis_meter': 100}),
+    Case('overview_statistics', 's6_daily_episode_summary.overview_statistics', ['csv_dict_sub']),
+    Case('overview_statistics_cube', 's6_daily_episode_summary.overview_statistics', ['csv_dict_sub_cube'], reference_inputs=['csv_dict_sub_missing']),
+    Case('activity_subtype', 's7_summary_subtype.activity_trip_subtype', ['valid_days.ucalitems_temporal_plot', 'valid_days.day_summary'],
+         {'mytype': 'ACTIVITY'}),
+    Case('trip_subtype', 's7_summary_subtype.activity_trip_subtype', ['leg2trip', 'valid_days.day_summary'], {'mytype': 'TRIP'}),
+    Case('person_day_subtype', 's7_summary_subtype.person_day_subtype', ['valid_days.ucalitems_temporal_plot', 'valid_days.day_summary'],
+         {'mytype': 'TRIP'}),
+]
+
+
+"""
+INPUT:  n_users, n_days, seed
+        start <first local day>, local_timezone
+
+OUTPUT: synthetic raw tables (ucalitems, calendar_item_survey, ema_survey) with the columns of a Daynamica export:
+        consecutive items per user (activities, trips, OFF and INACC items), items across midnight,
+        days across the change of daylight saving time (from 2023-03-08), activities without centroid,
+        items with and without confirmation, edit and survey responses
+"""
+def synthetic_export(n_users = 20, n_days = 7, seed = 0, start = '2023-03-08', local_timezone = 'US/Central'):
+    import polyline
+
+    rng = np.random.default_rng(seed)
+    activity_subtypes = ['HOME', 'WORK', 'EDUCATION', 'FOOD & MEAL', 'SHOPPING ERRANDS', 'OTHER', 'ACTIVITY']
+    trip_subtypes = ['CAR - DRIVER', 'BUS', 'WALK', 'BIKE', 'TRIP', 'OTHER']
+    first = pd.Timestamp(start, tz=local_timezone).value // 10**6 + 6 * 3600 * 1000
+    place = lambda: (44.97 + rng.normal(0, 0.05), -93.26 + rng.normal(0, 0.05))
+
+    items, surveys, emas = [], [], []
+    for u in range(n_users):
+        user_id = 'user{}@example.org'.format(u)
+        home, work = place(), place()
+        t, end, item_id, is_activity = first + int(rng.integers(0, 3600 * 1000)), first + n_days * 86400 * 1000, 0, True
+        while t < end:
+            item_id += 1
+            if is_activity:
+                item_type = 'ACTIVITY' if rng.random() > 0.1 else rng.choice(['OFF', 'INACC', 'DATA COLLECTION STARTED'])
+                subtype = rng.choice(activity_subtypes) if item_type == 'ACTIVITY' else item_type
+                duration = int(rng.integers(20, 900)) * 60000
+                location = home if subtype == 'HOME' else (work if subtype == 'WORK' else place())
+                centroid = polyline.encode([location], 5) if (item_type == 'ACTIVITY') and (rng.random() > 0.05) else 'None'
+                distance = 0.0
+            else:
+                item_type, subtype = 'TRIP', rng.choice(trip_subtypes)
+                duration = int(rng.integers(3, 60)) * 60000
+                centroid, distance = 'None', float(rng.uniform(100, 20000))
+            # 30% of the trips are followed by another trip leg
+            if not (item_type == 'TRIP' and rng.random() < 0.3):
+                is_activity = not is_activity
+            items.append({'user_id': user_id, 'cal_item_id': item_id, 'start_timestamp': t, 'end_timestamp': t + duration,
+                          'type_decoded': item_type, 'subtype_decoded': subtype, 'distance': distance,
+                          'confirm_timestamp': t + 1000 if rng.random() > 0.3 else 0, 'edit_timestamp': t + 2000 if rng.random() > 0.7 else 0,
+                          'centroid': centroid})
+            if rng.random() > 0.5:
+                for question_id in range(3):
+                    surveys.append({'user_id': user_id, 'calendar_item_id': item_id, 'calendar_item_timestamp': t,
+                                    'question_id': question_id, 'response': rng.choice(['a', 'b', np.nan])})
+            t += duration
+        for d in range(n_days):
+            emas.append({'user_id': user_id, 'ema_survey_date': str((pd.Timestamp(start) + pd.Timedelta(days=d)).date()), 'q1': 1})
+    return({'ucalitems': pd.DataFrame(items), 'calendar_item_survey': pd.DataFrame(surveys), 'ema_survey': pd.DataFrame(emas)})
+
+
+"""
+INPUT:  csv_dict <raw tables: synthetic_export or a recorded export read by s1_io_data.path2dict>
+        **params <parameters of the pipeline, see pipeline.default_params>
+
+OUTPUT: dictionary of the input tables of the cases: the tables of the pipeline, 'csv_dict_sub' (pipe.valid_dict()
+        without the optional tables, e.g. 'mobility' adds statistics the reference may not have), 'csv_dict_sub_missing'
+        (csv_dict_sub with some activities without subtype) and 'csv_dict_sub_cube' (the same with the table 'subtype_cube')
+"""
+def prepare_inputs(csv_dict, **params):
+    pipe = pipeline.Pipeline(csv_dict, **params)
+    inputs = {}
+    for name in ['ucalitems_ljoin_ucisurvey', 'ucalitems_ljoin_ucisurvey_split', 'day_summary', 'valid_days',
+                 'ucalitems_activity', 'convex_hull', 'sde', 'leg2trip']:
+        inputs[name] = pipe[name]
+    # split_ucalitems adds the person-day codes to its input, the input of the case is the table before splitting
+    inputs['ucalitems_ljoin_ucisurvey'] = inputs['ucalitems_ljoin_ucisurvey'].drop(columns=['person_day'], errors='ignore')
+    inputs['csv_dict_sub'] = {name: df for name, df in pipe.valid_dict().items() if name not in optional_tables}
+    # the summaries rolled up from the subtype cube instead of the episodes, with some activities without subtype
+    # (the cube must keep them: they are counted in the summaries of the episodes)
+    missing = dict(inputs['csv_dict_sub'])
+    activity_ids = missing['ucalitems_temporal_plot'].query("type_decoded=='ACTIVITY'")['id'].values[::50]
+    for name in ['ucalitems_ljoin_ucisurvey_split', 'ucalitems_temporal_plot']:
+        missing[name] = missing[name].copy()
+        missing[name].loc[missing[name]['id'].isin(activity_ids), 'subtype_decoded'] = np.nan
+    inputs['csv_dict_sub_missing'] = missing
+    cube = s7_summary_subtype.build_subtype_cube(missing['ucalitems_temporal_plot'], missing['leg2trip'])
+    inputs['csv_dict_sub_cube'] = dict(missing, subtype_cube=cube)
+    return(inputs)
+
+# input table of a case, 'name.key' for a table in a dictionary
+def _input(inputs, name):
+    name, _, key = name.partition('.')
+    return(inputs[name][key] if key else inputs[name])
+
+
+_worker_script = """
+import sys, time, pickle, tracemalloc, importlib, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {root!r})
+import io, contextlib
+module_name, func_name = {func!r}.rsplit('.', 1)
+func = getattr(importlib.import_module('py_daynamica.' + module_name), func_name)
+with open({input_file!r}, 'rb') as f:
+    args, kwargs = pickle.load(f)
+
+def run():
+    # fresh copies of the inputs, some functions add columns to their inputs
+    with open({input_file!r}, 'rb') as f:
+        a, k = pickle.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        output = func(*a, **k)
+        return(output, time.perf_counter() - t0)
+
+# warm-up run, not timed: packages imported on first use (e.g. pointpats in cal_sde) and caches are loaded
+run()
+times = []
+for i in range({repeat}):
+    output, seconds = run()
+    times.append(seconds)
+tracemalloc.start()
+run()
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+with open({output_file!r}, 'wb') as f:
+    pickle.dump({{'output': output, 'seconds': min(times), 'peak_bytes': peak}}, f)
+"""
+
+"""
+INPUT:  case <Case>, inputs <prepare_inputs>, root <folder with the package py_daynamica>, repeat, work_dir <temporary folder>
+        reference <True to run the case with its reference inputs>
+
+OUTPUT: dictionary: output, seconds, peak_bytes; or error (text) if the function failed
+"""
+def run_case(case, inputs, root, repeat = 3, work_dir = None, reference = False):
+    work_dir = work_dir or tempfile.mkdtemp()
+    names = case.reference_inputs if reference else case.inputs
+    input_file = os.path.join(work_dir, '{}.{}.input.pkl'.format(case.name, 'reference' if reference else 'candidate'))
+    output_file = os.path.join(work_dir, case.name + '.output.pkl')
+    if not os.path.exists(input_file):
+        with open(input_file, 'wb') as f:
+            pickle.dump(([_input(inputs, name) for name in names], case.kwargs), f)
+
+    script = _worker_script.format(root=os.path.abspath(root), func=case.func, input_file=input_file, output_file=output_file, repeat=repeat)
+    process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    if process.returncode != 0:
+        return({'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'exit code {}'.format(process.returncode)})
+    with open(output_file, 'rb') as f:
+        result = pickle.load(f)
+    os.remove(output_file)
+    return(result)
+
+
+# numeric differences of two arrays: number of values out of tolerance (NaN == NaN), max absolute difference
+def _numeric_diff(a, b, rtol, atol):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    both_nan = np.isnan(a) & np.isnan(b)
+    with np.errstate(invalid='ignore'):
+        close = np.isclose(a, b, rtol=rtol, atol=atol) | both_nan | (a == b)
+        diff = np.where(both_nan | (a == b), 0, np.abs(a - b))
+    return(int((~close).sum()), float(np.nanmax(diff)) if diff.shape[0] > 0 else 0.0)
+
+# geometries are equal if the area of their symmetric difference is within the tolerance of their area
+def _geometry_diff(a, b, rtol, atol):
+    import shapely
+
+    a, b = np.asarray(a, dtype=object), np.asarray(b, dtype=object)
+    missing = pd.isna(a) | pd.isna(b)
+    both = ~missing
+    diff = np.zeros(a.shape[0])
+    if both.any():
+        diff[both] = shapely.area(shapely.symmetric_difference(a[both], b[both]))
+        limit = atol + rtol * shapely.area(b[both])
+        # points and lines have no area: compare their distance instead
+        no_area = shapely.area(b[both]) == 0
+        diff[np.flatnonzero(both)[no_area]] = shapely.hausdorff_distance(a[both][no_area], b[both][no_area])
+        bad = diff[both] > np.where(no_area, atol + rtol, limit)
+    else:
+        bad = np.zeros(0, dtype=bool)
+    return(int(bad.sum() + (pd.isna(a) != pd.isna(b)).sum()), float(diff.max()) if diff.shape[0] > 0 else 0.0)
+
+"""
+INPUT:  reference, candidate <outputs: DataFrame, Series, numpy array, number, text, or dict / tuple / list of them>
+        rtol, atol <numeric tolerances>
+        ignore_columns <columns of the candidate tables not in the reference that are not differences>
+        check_dtype <True to report different dtypes>
+
+OUTPUT: list of differences (texts), max absolute difference of the numeric values
+"""
+def compare_outputs(reference, candidate, rtol = 1e-9, atol = 1e-9, ignore_columns = default_ignore_columns, check_dtype = False, path = ''):
+    differences, max_diff = [], 0.0
+    where = path or 'output'
+
+    if isinstance(reference, dict) or isinstance(reference, (tuple, list)):
+        keys = list(reference.keys()) if isinstance(reference, dict) else list(range(len(reference)))
+        other = list(candidate.keys()) if isinstance(candidate, dict) else list(range(len(candidate)))
+        if sorted(map(str, keys)) != sorted(map(str, other)) and set(keys) - set(other):
+            differences.append('{}: missing keys {}'.format(where, sorted(map(str, set(keys) - set(other)))))
+        for key in keys:
+            if key in other:
+                d, m = compare_outputs(reference[key], candidate[key], rtol, atol, ignore_columns, check_dtype, '{}[{!r}]'.format(path, key))
+                differences, max_diff = differences + d, max(max_diff, m)
+        return(differences, max_diff)
+
+    if isinstance(reference, pd.Series):
+        reference, candidate = reference.to_frame(), pd.Series(candidate).to_frame()
+    if isinstance(reference, pd.DataFrame):
+        if not isinstance(candidate, pd.DataFrame):
+            return(['{}: candidate is a {}'.format(where, type(candidate).__name__)], np.inf)
+        ref_cols, cand_cols = [str(col) for col in reference.columns], [str(col) for col in candidate.columns]
+        missing = [col for col in ref_cols if col not in cand_cols]
+        extra = [col for col in cand_cols if (col not in ref_cols) and (col not in ignore_columns)]
+        if missing or extra:
+            differences.append('{}: missing columns {}, extra columns {}'.format(where, missing, extra))
+        common = [col for col in ref_cols if col in cand_cols]
+        if [col for col in cand_cols if col in common] != common:
+            differences.append('{}: columns in a different order'.format(where))
+        if reference.shape[0] != candidate.shape[0]:
+            differences.append('{}: {} rows, candidate {} rows'.format(where, reference.shape[0], candidate.shape[0]))
+            return(differences, np.inf)
+        if not reference.index.equals(candidate.index):
+            differences.append('{}: different index (row order or labels)'.format(where))
+
+        ref_cols_map = dict(zip(ref_cols, reference.columns))
+        cand_cols_map = dict(zip(cand_cols, candidate.columns))
+        for col in common:
+            a, b = reference[ref_cols_map[col]], candidate[cand_cols_map[col]]
+            if check_dtype and a.dtype != b.dtype:
+                differences.append('{}.{}: dtype {}, candidate {}'.format(where, col, a.dtype, b.dtype))
+            n_bad, m = _compare_column(a, b, rtol, atol)
+            max_diff = max(max_diff, m)
+            if n_bad > 0:
+                differences.append('{}.{}: {} of {} values differ (max abs diff {:g})'.format(where, col, n_bad, a.shape[0], m))
+        return(differences, max_diff)
+
+    if isinstance(reference, np.ndarray) or np.ndim(reference) > 0:
+        n_bad, m = _compare_column(pd.Series(np.ravel(reference)), pd.Series(np.ravel(candidate)), rtol, atol)
+        return(['{}: {} values differ'.format(where, n_bad)] if n_bad > 0 else [], m)
+
+    n_bad, m = _compare_column(pd.Series([reference]), pd.Series([candidate]), rtol, atol)
+    return(['{}: {!r}, candidate {!r}'.format(where, reference, candidate)] if n_bad > 0 else [], m)
+
+# number of different values of two columns and max absolute difference (numbers, date times, geometries, others)
+def _compare_column(a, b, rtol, atol):
+    if a.shape[0] != b.shape[0]:
+        return(max(a.shape[0], b.shape[0]), np.inf)
+    if str(a.dtype) == 'geometry' or str(b.dtype) == 'geometry':
+        return(_geometry_diff(a.values, b.values, rtol, atol))
+    if pd.api.types.is_bool_dtype(a) and pd.api.types.is_bool_dtype(b):
+        return(int((a.values != b.values).sum()), 0.0)
+    if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+        return(_numeric_diff(a.values, b.values, rtol, atol))
+    if pd.api.types.is_datetime64_any_dtype(a) and pd.api.types.is_datetime64_any_dtype(b):
+        a_ns = pd.to_datetime(a).dt.tz_localize(None) if getattr(a.dt, 'tz', None) is not None else a
+        b_ns = pd.to_datetime(b).dt.tz_localize(None) if getattr(b.dt, 'tz', None) is not None else b
+        same_tz = str(getattr(a.dt, 'tz', None)) == str(getattr(b.dt, 'tz', None))
+        n_bad, m = _numeric_diff(a_ns.values.astype('datetime64[ns]').view(np.int64) / 1e9, b_ns.values.astype('datetime64[ns]').view(np.int64) / 1e9, 0, atol)
+        return(n_bad if same_tz else a.shape[0], m)
+    equal = (a.astype(object).values == b.astype(object).values) | (pd.isna(a).values & pd.isna(b).values)
+    return(int((~equal).sum()), 0.0 if equal.all() else np.inf)
+
+
+"""
+INPUT:  reference_root <folder with the reference package, e.g. a checkout of an earlier version>
+        candidate_root <folder with the optimized package, default: this folder>
+        csv_dict <raw tables, default: synthetic_export()>
+        cases <list of Case, default: default_cases>
+        repeat, rtol, atol, ignore_columns, check_dtype <see run_case and compare_outputs>
+        **params <parameters of the pipeline preparing the inputs>
+
+OUTPUT: report: case, status ('equal', 'different' or 'error'), differences, max_abs_diff,
+        reference_seconds, candidate_seconds, speedup, reference_peak_mb, candidate_peak_mb, memory_ratio
+"""
+def run_equivalence(reference_root, candidate_root = None, csv_dict = None, cases = default_cases, repeat = 3,
+                    rtol = 1e-9, atol = 1e-9, ignore_columns = default_ignore_columns, check_dtype = False, **params):
+    import io
+    import warnings
+    import contextlib
+
+    candidate_root = candidate_root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    csv_dict = synthetic_export() if csv_dict is None else csv_dict
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        inputs = prepare_inputs(csv_dict, **params)
+
+    work_dir = tempfile.mkdtemp()
+    result_list = []
+    for case in cases:
+        reference = run_case(case, inputs, reference_root, repeat, work_dir, reference=True)
+        candidate = run_case(case, inputs, candidate_root, repeat, work_dir)
+        row = {'case': case.name}
+        if 'error' in reference or 'error' in candidate:
+            row.update({'status': 'error', 'differences': 'reference: {} candidate: {}'.format(reference.get('error', 'ok'), candidate.get('error', 'ok'))})
+        else:
+            differences, max_diff = compare_outputs(reference['output'], candidate['output'], rtol, atol, ignore_columns, check_dtype)
+            row.update({'status': 'different' if differences else 'equal', 'differences': '; '.join(differences), 'max_abs_diff': max_diff,
+                        'reference_seconds': reference['seconds'], 'candidate_seconds': candidate['seconds'],
+                        'reference_peak_mb': reference['peak_bytes'] / 2**20, 'candidate_peak_mb': candidate['peak_bytes'] / 2**20})
+        result_list.append(row)
+        print('{0:<24} {1:<10} {2}'.format(case.name, row['status'], row['differences'][:200]))
+
+    result_df = pd.DataFrame(result_list, columns=['case', 'status', 'differences', 'max_abs_diff', 'reference_seconds', 'candidate_seconds',
+                                                   'reference_peak_mb', 'candidate_peak_mb'])
+    result_df['speedup'] = result_df['reference_seconds'] / result_df['candidate_seconds']
+    result_df['memory_ratio'] = result_df['candidate_peak_mb'] / result_df['reference_peak_mb']
+    return(result_df)
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Hot-folder ingestion of Daynamica exports'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from py_daynamica import s1_io_data, s2_preprocess_data, s3_valid_data, s4_temporal_plot, s5_cal_activity_space, person_day
+
+"""
+During fieldwork the export folder receives new files several times a day. HotFolder watches the folder and
+    1. finds new or changed export files (modification time and size), the table name follows path2dict
+       (the newest file of a table replaces the table), files modified less than settle_seconds ago may still be
+       copied and are left for the next poll
+    2. reads them (threads) and finds the users whose rows changed with a fingerprint of the rows of each user
+    3. preprocesses ONLY these users (S2 join and split, day_summary, S3 valid days) in a pool of worker processes,
+       by batches of users, and replaces their rows in the tables (the person-day codes are renumbered)
+    4. regenerates the schedule plots (plot_indi_temp) of these users in the pool, and saves the updated tables
+
+The steps are scheduled with asyncio: the folder is polled every poll_seconds, file reads, preprocessing and plots
+run in executors, so a batch of new files is processed while the next poll waits.
+A failed poll (e.g. a truncated or malformed file) is printed and does not stop watching: a file that can not be read
+is not marked as loaded and the changed users stay pending, so both are retried at the next poll.
+"""
+
+# raw tables exported by Daynamica, the tables are preprocessed by user
+raw_tables = ['ucalitems', 'calendar_item_survey', 'ema_survey']
+
+
+# files of the export folder: table name -> (path, modification time, size), the newest file of each table
+def scan_exports(folder_path, project_name, year):
+    files = {}
+    for entry in os.scandir(folder_path):
+        if not entry.is_file() or not entry.name.endswith('.csv'):
+            continue
+        name = s1_io_data.export_table_name(entry.name, project_name, year)
+        stat = entry.stat()
+        if (name not in files) or (stat.st_mtime_ns > files[name][1]):
+            files[name] = (entry.path, stat.st_mtime_ns, stat.st_size)
+    return(files)
+
+# fingerprint of the rows of each user (sum of row hashes, so the order of rows does not matter)
+def user_fingerprints(df):
+    codes, users = pd.factorize(df['user_id'])
+    keep = codes >= 0
+    fingerprint = np.zeros(users.shape[0], dtype=np.uint64)
+    np.add.at(fingerprint, codes[keep], pd.util.hash_pandas_object(df, index=False).values[keep])
+    return(pd.Series(fingerprint, index=users))
+
+# users with new, changed or removed rows between two fingerprints
+def changed_users(old, new):
+    old = pd.Series(dtype=np.uint64) if old is None else old
+    common = old.index.intersection(new.index)
+    changed = common[old[common].values != new[common].values]
+    return(set(changed) | set(new.index.difference(old.index)) | set(old.index.difference(new.index)))
+
+
+"""
+INPUT:  tables <raw tables (raw_tables) of ONE batch of users>
+        local_timezone, unix_time_unit, min_time_stamp <see s2_preprocess_data.split_ucalitems>
+        query_text <see s3_valid_data.filter_valid_days>
+
+TASKS:  run in a worker process: S2 join and split, day summary, S3 valid days of the batch
+
+OUTPUT: dictionary of tables: ucalitems_ljoin_ucisurvey, ucalitems_ljoin_ucisurvey_split, day_summary, ucalitems_temporal_plot
+"""
+def preprocess_users(tables, local_timezone, unix_time_unit, min_time_stamp, query_text):
+    csv_dict = dict(tables)
+    csv_dict['ucalitems_ljoin_ucisurvey'] = s2_preprocess_data.ucalitems_ljoin_ucisurvey(tables['calendar_item_survey'], tables['ucalitems'])
+    csv_dict['ucalitems_ljoin_ucisurvey'] = s5_cal_activity_space.str2cor_tb(csv_dict['ucalitems_ljoin_ucisurvey'])
+    csv_dict['ucalitems_ljoin_ucisurvey_split'] = s2_preprocess_data.split_ucalitems(csv_dict['ucalitems_ljoin_ucisurvey'], local_timezone,
+                                                                                     unix_time_unit=unix_time_unit, min_time_stamp=min_time_stamp)
+    csv_dict['day_summary'] = s2_preprocess_data.get_per_day_duration(csv_dict['ucalitems_ljoin_ucisurvey_split'])
+    csv_dict_sub = s3_valid_data.filter_valid_days(csv_dict, query_text)
+
+    result = {name: csv_dict[name] for name in ['ucalitems_ljoin_ucisurvey', 'ucalitems_ljoin_ucisurvey_split', 'day_summary']}
+    result['ucalitems_temporal_plot'] = csv_dict_sub['ucalitems_temporal_plot']
+    return(result)
+
+# schedule plot of ONE user, run in a worker process
+def plot_user(ucalitems_temporal_plot, user_id, directory):
+    s4_temporal_plot.plot_indi_temp(ucalitems_temporal_plot, user_id, directory)
+    return(user_id)
+
+
+class HotFolder(object):
+    """
+    folder_path, project_name, year: export folder and file naming (see s1_io_data.path2dict)
+    output_path: folder of the outputs, the updated tables are saved in <output_path>/tables (dict2file)
+                 and the schedule plots in <output_path>/plots
+    save_tables: tables saved after each update
+    n_workers: number of worker processes, None for the number of cpus
+    batch_users: number of users preprocessed by one task
+    local_timezone, unix_time_unit, min_time_stamp, query_text: parameters of the preprocessing (see preprocess_users)
+    settle_seconds: files modified less than settle_seconds ago are read at a later poll (they may still be copied)
+    """
+    def __init__(self, folder_path, output_path, project_name = '', year = '', save_tables = ['day_summary'],
+                 n_workers = None, batch_users = 20, local_timezone = 'US/Central', unix_time_unit = 'ms',
+                 min_time_stamp = 0, query_text = 'interact_by_confirm>0', settle_seconds = 5):
+        self.folder_path = folder_path
+        self.output_path = output_path
+        self.project_name = project_name
+        self.year = year
+        self.save_tables = list(save_tables)
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.batch_users = batch_users
+        self.params = (local_timezone, unix_time_unit, min_time_stamp, query_text)
+        self.settle_seconds = settle_seconds
+
+        self.files = {}         # table name -> (path, modification time, size) of the loaded file
+        self.raw = {}           # raw tables
+        self.fingerprints = {}  # table name -> fingerprint of each user
+        self.tables = {}        # preprocessed tables of all users
+        self.pending = set()    # changed users not preprocessed yet
+
+    # tables of the export folder with a new or changed file, modified at least settle_seconds ago
+    def changed_tables(self):
+        files = scan_exports(self.folder_path, self.project_name, self.year)
+        settled = time.time_ns() - self.settle_seconds * 1e9
+        return({name: file for name, file in files.items() if (name in raw_tables) and (self.files.get(name) != file) and (file[1] <= settled)})
+
+    # raw tables of a set of users
+    def user_tables(self, users):
+        return({name: df[df['user_id'].isin(users)] for name, df in self.raw.items()})
+
+    # replace the rows of the users in the preprocessed tables, then renumber the person-day codes
+    def replace_users(self, users, results):
+        for name in ['ucalitems_ljoin_ucisurvey', 'ucalitems_ljoin_ucisurvey_split', 'day_summary', 'ucalitems_temporal_plot']:
+            parts = [] if name not in self.tables else [self.tables[name][~self.tables[name]['user_id'].isin(users)]]
+            parts = parts + [result[name] for result in results]
+            if not parts:
+                continue
+            self.tables[name] = pd.concat(parts, ignore_index=True).sort_values(by='user_id', kind='mergesort', ignore_index=True)
+        if 'ucalitems_ljoin_ucisurvey_split' not in self.tables:
+            return
+        others = {name: self.tables[name] for name in ['ucalitems_ljoin_ucisurvey', 'day_summary', 'ucalitems_temporal_plot']}
+        self.tables['ucalitems_ljoin_ucisurvey_split'], others = person_day.recode(self.tables['ucalitems_ljoin_ucisurvey_split'], others)
+        self.tables.update(others)
+
+    """
+    INPUT:  executor <pool of worker processes>
+
+    TASKS:  one update: read the changed files, preprocess the changed users by batches, replace their rows,
+            regenerate their plots and save the tables
+
+    OUTPUT: sorted list of the updated users
+    """
+    async def update(self, executor):
+        loop = asyncio.get_running_loop()
+        changed = self.changed_tables()
+        if not changed and not self.pending:
+            return([])
+
+        # read the files in threads, a file that can not be read (e.g. truncated) is read again at the next poll
+        frames = await asyncio.gather(*[loop.run_in_executor(None, pd.read_csv, file[0]) for file in changed.values()], return_exceptions=True)
+        for (name, file), df in zip(changed.items(), frames):
+            if isinstance(df, Exception):
+                print('can not read {} ({}: {}), retry at the next poll...'.format(file[0], type(df).__name__, df))
+                continue
+            fingerprint = user_fingerprints(df)
+            self.pending |= changed_users(self.fingerprints.get(name), fingerprint)
+            self.raw[name], self.fingerprints[name], self.files[name] = df, fingerprint, file
+        if not self.pending or any(name not in self.raw for name in raw_tables):
+            print('# changed tables: {}. # changed users: {}. waiting for the tables: {}'.format(len(changed), len(self.pending), raw_tables))
+            return([])
+        # the users stay pending until their rows are replaced (retried at the next poll if the preprocessing fails)
+        users = sorted(self.pending)
+
+        # preprocess the changed users with calendar items by batches in the worker processes (users without items are removed)
+        item_users = set(self.raw['ucalitems']['user_id'])
+        batch_users = [user_id for user_id in users if user_id in item_users]
+        batches = [batch_users[i:i + self.batch_users] for i in range(0, len(batch_users), self.batch_users)]
+        results = await asyncio.gather(*[loop.run_in_executor(executor, preprocess_users, self.user_tables(batch), *self.params) for batch in batches])
+        self.replace_users(users, results)
+        self.pending -= set(users)
+
+        # plots of the changed users and tables
+        plot_path = os.path.join(self.output_path, 'plots')
+        table_path = os.path.join(self.output_path, 'tables')
+        os.makedirs(plot_path, exist_ok=True)
+        os.makedirs(table_path, exist_ok=True)
+        tb_plot = self.tables['ucalitems_temporal_plot']
+        plot_users = sorted(set(users) & set(tb_plot['user_id']))
+        await asyncio.gather(*[loop.run_in_executor(executor, plot_user, tb_plot[tb_plot['user_id'] == user_id], user_id, plot_path)
+                               for user_id in plot_users])
+        await loop.run_in_executor(None, s1_io_data.dict2file, {name: self.tables[name] for name in self.save_tables}, table_path)
+
+        print('# changed tables: {}. # changed users: {}. # batches: {}. # plots: {}'.format(len(changed), len(users), len(batches), len(plot_users)))
+        return(users)
+
+    """
+    INPUT:  poll_seconds <seconds between two scans of the folder>
+            stop <asyncio.Event to stop watching, None to watch until cancelled>
+            max_updates <stop after this number of scans, None for no limit>
+
+    TASKS:  scan the folder and update, until stopped; a failed update is printed and retried at the next poll
+            (the pool of worker processes is restarted if a worker died)
+    """
+    async def watch(self, poll_seconds = 60, stop = None, max_updates = None):
+        stop = stop or asyncio.Event()
+        n_updates = 0
+        executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        try:
+            while not stop.is_set():
+                try:
+                    await self.update(executor)
+                except BrokenProcessPool as e:
+                    print('update failed ({}: {}), restarting the worker processes...'.format(type(e).__name__, e))
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=self.n_workers)
+                except Exception as e:
+                    print('update failed ({}: {}), retry at the next poll...'.format(type(e).__name__, e))
+                n_updates = n_updates + 1
+                if (max_updates is not None) and (n_updates >= max_updates):
+                    break
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            executor.shutdown()
+
+    # run the watcher from a script (blocks until interrupted)
+    def run(self, poll_seconds = 60, max_updates = None):
+        asyncio.run(self.watch(poll_seconds, max_updates=max_updates))
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Array kernels of the sequential loops, with a NumPy and an optional numba backend'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import numpy as np
+
+"""
+Some steps are sequential within each user or person day (a value depends on the previous row of the same group):
+    - trip_ids:        complete trip ids of leg2trip (a new id unless a trip leg follows a trip leg of the same person day)
+    - longest_leg:     subtype of the longest leg (sum of distances by subtype) of each complete trip of leg2trip
+    - expand_days:     one piece per item and day of split_ucalitems (item index and day offset of each piece)
+    - paint_intervals: minute intervals [start, end) of the episodes of each person day, painted in start order (s8_time_use.time_use_matrix)
+
+The kernels take contiguous int64 / float64 arrays, with the rows sorted by user (and start time), so no pandas object
+is created in the loops. Each kernel has two implementations with the same outputs:
+    - 'numpy': vectorized reference (cumsum, bincount, repeat, maximum.at)
+    - 'numba': the loop of the kernel compiled by numba (optional dependency, compiled on first use)
+
+The backend is chosen at run time: set_backend('numpy' | 'numba' | 'auto') or the environment variable
+PY_DAYNAMICA_KERNELS, 'auto' (default) uses numba if it is installed.
+"""
+
+backends = ['numpy', 'numba']
+_state = {'backend': None}
+_compiled = {}
+
+
+# numba is imported on first use, so that importing this module is fast and numba stays optional
+def numba_available():
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return(False)
+    return(True)
+
+"""
+INPUT:  backend <'numpy', 'numba' or 'auto' (numba if installed, else numpy)>
+
+OUTPUT: name of the backend in use
+"""
+def set_backend(backend = 'auto'):
+    if backend == 'auto':
+        backend = 'numba' if numba_available() else 'numpy'
+    if backend not in backends:
+        raise Exception("Sorry, backend not correct: 'numpy', 'numba' or 'auto'")
+    if (backend == 'numba') and not numba_available():
+        raise Exception("Sorry, numba is not installed: pip install numba, or use the backend 'numpy'")
+    _state['backend'] = backend
+    return(backend)
+
+# backend in use, from PY_DAYNAMICA_KERNELS on first call
+def get_backend():
+    if _state['backend'] is None:
+        set_backend(os.environ.get('PY_DAYNAMICA_KERNELS', 'auto'))
+    return(_state['backend'])
+
+# compiled loop of a kernel (numba.njit, cached in the process)
+def _jit(loop):
+    if loop.__name__ not in _compiled:
+        import numba
+        _compiled[loop.__name__] = numba.njit(cache=True)(loop)
+    return(_compiled[loop.__name__])
+
+def _run(vectorized, loop, *args, backend = None):
+    backend = backend or get_backend()
+    if backend == 'numba':
+        return(_jit(loop)(*args))
+    return(vectorized(*args))
+
+
+"""
+INPUT:  is_trip <bool array, the episode is a trip leg>
+        group <int64 array, person-day code of each episode, rows sorted by person day and start time>
+
+OUTPUT: int64 array of complete trip ids (1, 2, ...): the id increases unless the episode and the previous episode
+        of the same person day are both trip legs; bool array of the first episode of each complete trip
+"""
+def trip_ids(is_trip, group, backend = None):
+    is_trip = np.ascontiguousarray(is_trip, dtype=np.bool_)
+    group = np.ascontiguousarray(group, dtype=np.int64)
+    return(_run(_trip_ids_numpy, _trip_ids_loop, is_trip, group, backend=backend))
+
+def _trip_ids_numpy(is_trip, group):
+    flag = np.ones(is_trip.shape[0], dtype=np.bool_)
+    flag[1:] = ~(is_trip[1:] & is_trip[:-1] & (group[1:] == group[:-1]))
+    return(np.cumsum(flag, dtype=np.int64), flag)
+
+def _trip_ids_loop(is_trip, group):
+    n = is_trip.shape[0]
+    ids = np.empty(n, dtype=np.int64)
+    flag = np.ones(n, dtype=np.bool_)
+    current = 0
+    for i in range(n):
+        if i > 0 and is_trip[i] and is_trip[i - 1] and group[i] == group[i - 1]:
+            flag[i] = False
+        else:
+            current += 1
+        ids[i] = current
+    return(ids, flag)
+
+
+"""
+INPUT:  trip <int64 array of trip ids 1..n_trips (output of trip_ids), rows of a trip are contiguous>
+        subtype <int64 array of subtype codes (sorted labels, e.g. pd.factorize(sort=True)), -1 for missing subtypes>
+        distance <float64 array of the distance of each leg, missing distances as 0>
+        n_subtypes <number of subtype codes>
+
+OUTPUT: int64 array of the subtype code with the largest sum of distances of each trip (ties: the smallest code),
+        -1 if no leg of the trip has a subtype
+"""
+def longest_leg(trip, subtype, distance, n_subtypes, backend = None):
+    trip = np.ascontiguousarray(trip, dtype=np.int64)
+    subtype = np.ascontiguousarray(subtype, dtype=np.int64)
+    distance = np.ascontiguousarray(np.nan_to_num(np.asarray(distance, dtype=np.float64)))
+    return(_run(_longest_leg_numpy, _longest_leg_loop, trip, subtype, distance, np.int64(n_subtypes), backend=backend))
+
+def _longest_leg_numpy(trip, subtype, distance, n_subtypes):
+    n_trips = trip[-1] if trip.shape[0] > 0 else 0
+    width = max(n_subtypes, 1)
+    keep = subtype >= 0
+    key = (trip[keep] - 1) * width + subtype[keep]
+    sums = np.bincount(key, weights=distance[keep], minlength=n_trips * width).reshape(n_trips, width)
+    exists = np.bincount(key, minlength=n_trips * width).reshape(n_trips, width) > 0
+    longest = np.argmax(np.where(exists, sums, -np.inf), axis=1)
+    return(np.where(exists.any(axis=1), longest, -1).astype(np.int64))
+
+def _longest_leg_loop(trip, subtype, distance, n_subtypes):
+    n = trip.shape[0]
+    n_trips = trip[n - 1] if n > 0 else 0
+    width = max(n_subtypes, 1)
+    longest = np.full(n_trips, -1, dtype=np.int64)
+    sums = np.zeros(width, dtype=np.float64)
+    exists = np.zeros(width, dtype=np.bool_)
+    start = 0
+    for i in range(n + 1):
+        if i < n and trip[i] == trip[start]:
+            continue
+        # rows start .. i - 1 are the legs of one trip
+        for j in range(start, i):
+            if subtype[j] >= 0:
+                sums[subtype[j]] += distance[j]
+                exists[subtype[j]] = True
+        best = -1
+        for k in range(width):
+            if exists[k] and (best < 0 or sums[k] > sums[best]):
+                best = k
+        for k in range(width):
+            sums[k] = 0.0
+            exists[k] = False
+        if start < n:
+            longest[trip[start] - 1] = best
+        start = i
+    return(longest)
+
+
+"""
+INPUT:  days <int64 array of the number of local days of each item (>= 1)>
+
+OUTPUT: int64 arrays with one row per piece (item and day): item index, day offset from the start day of the item (0, 1, ...)
+"""
+def expand_days(days, backend = None):
+    days = np.ascontiguousarray(days, dtype=np.int64)
+    return(_run(_expand_days_numpy, _expand_days_loop, days, backend=backend))
+
+def _expand_days_numpy(days):
+    rep = np.repeat(np.arange(days.shape[0]), days)
+    piece = np.arange(rep.shape[0]) - np.repeat(np.cumsum(days) - days, days)
+    return(rep, piece)
+
+def _expand_days_loop(days):
+    n_pieces = 0
+    for i in range(days.shape[0]):
+        n_pieces += days[i]
+    rep = np.empty(n_pieces, dtype=np.int64)
+    piece = np.empty(n_pieces, dtype=np.int64)
+    k = 0
+    for i in range(days.shape[0]):
+        for d in range(days[i]):
+            rep[k] = i
+            piece[k] = d
+            k += 1
+    return(rep, piece)
+
+
+"""
+INPUT:  row <int64 array, row of the matrix (person day) of each interval>
+        start, end <int64 arrays, columns [start, end) of each interval, 0 <= start <= end <= width>
+        code <int64 array, value of each interval (0 to 255)>
+        n_rows, width <shape of the matrix>
+
+TASKS:  paint the intervals in their order (e.g. sorted by start time): each column takes the code of the LAST interval
+        covering it, so an interval nested in another one replaces it only between its own start and end
+
+OUTPUT: uint8 matrix n_rows x width (0 where no interval)
+"""
+def paint_intervals(row, start, end, code, n_rows, width, backend = None):
+    row, start, end, code = [np.ascontiguousarray(x, dtype=np.int64) for x in [row, start, end, code]]
+    return(_run(_paint_intervals_numpy, _paint_intervals_loop, row, start, end, code, np.int64(n_rows), np.int64(width), backend=backend))
+
+def _paint_intervals_numpy(row, start, end, code, n_rows, width):
+    # one cell per interval and column, the last interval of each cell is the largest interval index (np.maximum.at)
+    dtype = np.int32 if max(n_rows * width, row.shape[0]) < 2**31 else np.int64
+    length = np.maximum(end - start, 0)
+    interval = np.repeat(np.arange(row.shape[0], dtype=dtype), length)
+    column = np.arange(interval.shape[0], dtype=dtype) - np.repeat((np.cumsum(length) - length).astype(dtype), length) + start[interval].astype(dtype)
+    last = np.full(n_rows * width, -1, dtype=dtype)
+    np.maximum.at(last, row[interval].astype(dtype) * width + column, interval)
+
+    matrix = np.zeros(n_rows * width, dtype=np.uint8)
+    painted = last >= 0
+    matrix[painted] = code[last[painted]]
+    return(matrix.reshape(n_rows, width))
+
+def _paint_intervals_loop(row, start, end, code, n_rows, width):
+    matrix = np.zeros((n_rows, width), dtype=np.uint8)
+    for i in range(row.shape[0]):
+        for c in range(start[i], end[i]):
+            matrix[row[i], c] = code[i]
+    return(matrix)
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Vectorized local calendar days on int64 timestamps'
+
+__author__ = 'Xiaohuan Zeng'
+
+import functools
+import numpy as np
+import pandas as pd
+
+"""
+All functions work on int64 arrays of nanoseconds since 1970-01-01 UTC (e.g. pd.DatetimeIndex.asi8)
+and return int64 arrays, no datetime or date objects are created.
+
+    - local day index: number of local calendar days since 1970-01-01, i.e. floor((utc + offset) / one day)
+    - utc offset: looked up in a transition table (UTC instants where the offset changes) computed once per
+      time zone and range of years, so the offsets are correct before and after daylight saving time changes
+
+The time zone "tz" can be ONE time zone name (e.g. 'US/Central') or an array of time zone names,
+one per timestamp (e.g. a local_timezone per user for multi-region studies).
+"""
+
+NS_PER_DAY = 86400 * 10**9
+
+# 1970-01-01 is a Thursday (dayofweek 3)
+day_names = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+
+
+# utc offset in nanoseconds computed by pandas, only used to build the transition table
+def _offset_by_pandas(ts_ns, tz):
+    utc = pd.DatetimeIndex(ts_ns.astype('datetime64[ns]')).tz_localize('UTC')
+    return(utc.tz_convert(tz).tz_localize(None).asi8 - ts_ns)
+
+
+"""
+INPUT:  tz <time zone name>, first_year, last_year
+
+TASKS:  sample the utc offset daily and locate each change of offset by bisection
+
+OUTPUT: transition table (transition, offset): int64 arrays, offset[i] applies from transition[i] (UTC, ns)
+"""
+@functools.lru_cache(maxsize=None)
+def transition_table(tz, first_year, last_year):
+    start = pd.Timestamp(year=first_year, month=1, day=1).value - NS_PER_DAY
+    end = pd.Timestamp(year=last_year + 1, month=1, day=1).value + NS_PER_DAY
+    grid = np.arange(start, end + 1, NS_PER_DAY, dtype=np.int64)
+    offset = _offset_by_pandas(grid, tz)
+
+    change = np.flatnonzero(offset[1:] != offset[:-1]) + 1
+    lo, hi = grid[change - 1], grid[change]
+    while (hi - lo > 1).any():
+        mid = lo + (hi - lo) // 2
+        before = _offset_by_pandas(mid, tz) == offset[change - 1]
+        lo = np.where(before, mid, lo)
+        hi = np.where(before, hi, mid)
+
+    transition = np.concatenate([grid[:1], hi])
+    offset = np.concatenate([offset[:1], offset[change]])
+    return(transition, offset)
+
+
+def _table_for(ts_ns, tz):
+    first_year = pd.Timestamp(int(ts_ns.min())).year - 1
+    last_year = pd.Timestamp(int(ts_ns.max())).year + 1
+    return(transition_table(tz, first_year, last_year))
+
+
+# apply func(ts_ns, tz) to each time zone, tz is one time zone name or an array of names
+def _by_timezone(func, ts_ns, tz):
+    ts_ns = np.asarray(ts_ns, dtype=np.int64)
+    if isinstance(tz, str) or np.ndim(tz) == 0:
+        if ts_ns.shape[0] == 0:
+            return(np.zeros(0, dtype=np.int64))
+        return(func(ts_ns, tz))
+
+    tz = np.asarray(tz, dtype=object)
+    result = np.zeros(ts_ns.shape[0], dtype=np.int64)
+    for tz_value in pd.unique(tz):
+        mask = tz == tz_value
+        result[mask] = func(ts_ns[mask], tz_value)
+    return(result)
+
+
+def _utc_offset(ts_ns, tz):
+    transition, offset = _table_for(ts_ns, tz)
+    idx = np.searchsorted(transition, ts_ns, side='right') - 1
+    return(offset[np.clip(idx, 0, None)])
+
+def _day_start(day, tz):
+    wall = day * NS_PER_DAY
+    transition, offset = _table_for(wall, tz)
+    lookup = lambda ts: offset[np.clip(np.searchsorted(transition, ts, side='right') - 1, 0, None)]
+    start = wall - lookup(wall - lookup(wall))
+
+    # local midnight does not exist (offset change at midnight): the day starts at the transition
+    in_gap = (start + lookup(start)) // NS_PER_DAY < day
+    if in_gap.any():
+        start[in_gap] = transition[np.searchsorted(transition, start[in_gap], side='right')]
+    return(start)
+
+
+# utc offset (ns) of each timestamp
+def utc_offset(ts_ns, tz):
+    return(_by_timezone(_utc_offset, ts_ns, tz))
+
+# local day index (days since 1970-01-01 in local time) of each timestamp
+def local_day(ts_ns, tz):
+    ts_ns = np.asarray(ts_ns, dtype=np.int64)
+    return((ts_ns + utc_offset(ts_ns, tz)) // NS_PER_DAY)
+
+# UTC timestamp (ns) of the local midnight starting each local day index
+def day_start(day, tz):
+    return(_by_timezone(_day_start, day, tz))
+
+# local wall clock time (ns) of each timestamp, e.g. to create timezone-naive local datetimes
+def local_wall_time(ts_ns, tz):
+    ts_ns = np.asarray(ts_ns, dtype=np.int64)
+    return(ts_ns + utc_offset(ts_ns, tz))
+
+# local day index to timezone-naive datetime64 dates (midnight) and day names
+def day2datetime(day):
+    return((np.asarray(day, dtype=np.int64) * NS_PER_DAY).astype('datetime64[ns]'))
+
+def day2dayname(day):
+    return(day_names[(np.asarray(day, dtype=np.int64) + 3) % 7])
+
+if __name__=='__main__':
+    pass
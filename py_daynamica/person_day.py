@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Integer codes of person days shared by the processing steps'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+"""
+A person day is a (user_id, start_date). split_ucalitems assigns each person day a dense integer code, the column 'person_day',
+sorted by user_id and start_date, from the integer user codes and local day indexes it already has (no hashing of texts and dates).
+The column is kept by the tables derived from the split table (day_summary, ucalitems_temporal_plot, leg2trip, ...),
+so grouping, joining and filtering by person day are done on the integer codes with bincount, np.isin or np.unique.
+
+Tables without the column (e.g. read from files saved before, or ema_survey) fall back to (user_id, start_date).
+"""
+
+key_cols = ['user_id', 'start_date']
+code_col = 'person_day'
+
+
+"""
+INPUT:  user_codes, day <integer user code (-1 for missing users) and local day index of each row of the split table>
+        other_user_codes, other_day <the same for the rows of another table, e.g. the items before splitting>
+
+OUTPUT: dense person-day codes of the rows (sorted by user code and day, -1 for missing users),
+        codes of the rows of the other table (-1 if the person day is not in the split table)
+"""
+def person_day_codes(user_codes, day, other_user_codes, other_day):
+    day = np.asarray(day, dtype=np.int64)
+    first_day = day.min() if day.shape[0] > 0 else 0
+    n_days = day.max() - first_day + 1 if day.shape[0] > 0 else 1
+    key = lambda u, d: np.where((u >= 0) & (d >= first_day) & (d < first_day + n_days), u.astype(np.int64) * n_days + (d - first_day), -1)
+
+    row_key = key(np.asarray(user_codes), day)
+    keys, inverse = np.unique(row_key[row_key >= 0], return_inverse=True)
+    codes = np.full(row_key.shape[0], -1, dtype=np.int64)
+    codes[row_key >= 0] = inverse
+
+    other_key = key(np.asarray(other_user_codes), np.asarray(other_day, dtype=np.int64))
+    if keys.shape[0] == 0:
+        return(codes, np.full(other_key.shape[0], -1, dtype=np.int64))
+    i = np.searchsorted(keys, other_key).clip(max=keys.shape[0] - 1)
+    other_codes = np.where((other_key >= 0) & (keys[i] == other_key), i, -1)
+    return(codes, other_codes)
+
+"""
+INPUT:  codes <person-day code of each row, rows with code -1 are skipped>
+        values <values to sum (missing values as 0), None to count the rows>
+        mask <rows to include, None for all rows>
+        size <minimum length of the output>
+
+OUTPUT: array of the sum (or count) of each person-day code
+"""
+def sum_by_code(codes, values = None, mask = None, size = 0):
+    keep = codes >= 0 if mask is None else (codes >= 0) & mask
+    weights = None if values is None else np.nan_to_num(np.asarray(values, dtype=float)[keep])
+    return(np.bincount(codes[keep], weights=weights, minlength=size))
+
+"""
+INPUT:  split <split table with user_id and start_date, e.g. concatenated from batches of users>
+        others <dictionary of other tables with user_id and start_date, e.g. day_summary, ucalitems_temporal_plot>
+
+TASKS:  renumber the person-day codes of all tables from the days of the split table,
+        e.g. after the tables of some users are replaced (the codes of each batch start from 0)
+
+OUTPUT: the split table and a dictionary of the other tables, with the column 'person_day'
+"""
+def recode(split, others = {}):
+    users = pd.Index(np.sort(pd.unique(split['user_id'].dropna())))
+    local_day = lambda df: df['start_date'].values.astype('datetime64[D]').astype(np.int64)
+    split_users, split_day = users.get_indexer(split['user_id']), local_day(split)
+
+    result = {name: df.assign(person_day = person_day_codes(split_users, split_day, users.get_indexer(df['user_id']), local_day(df))[1])
+              for name, df in others.items()}
+    split = split.assign(person_day = person_day_codes(split_users, split_day, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))[0])
+    return(split, result)
+
+# True if the table carries the person-day codes
+def has_codes(*dfs):
+    return(all(code_col in df.columns for df in dfs))
+
+# day name and weekend label of the dates
+def add_day_attributes(days):
+    days['dow'] = days['start_date'].dt.day_name()
+    days['IsWeekend'] = (days['start_date'].dt.dayofweek > 4).map({True:'Weekend', False:'Weekday'})
+    return(days)
+
+
+class PersonDayIndex(object):
+    """
+    days: one row per person day: user_id, start_date, dow, IsWeekend, the index is the person-day code
+    """
+    def __init__(self, days):
+        self.days = days
+
+    def __len__(self):
+        return(self.days.shape[0])
+
+    # number of codes (codes are 0 .. size - 1, some may not be in days after filtering)
+    @property
+    def size(self):
+        return(int(self.days.index.max()) + 1 if len(self) > 0 else 0)
+
+    # person-day code of each row of a table, -1 if the person day is not in the index
+    def codes(self, df):
+        if has_codes(df):
+            return(df[code_col].values)
+        rows = pd.MultiIndex.from_frame(self.days[key_cols]).get_indexer(pd.MultiIndex.from_frame(df[key_cols]))
+        return(np.where(rows >= 0, self.days.index.values[rows], -1))
+
+    # sum (or count) of each person-day code, see sum_by_code
+    def sum(self, codes, values = None, mask = None):
+        return(sum_by_code(codes, values, mask, self.size))
+
+    # attributes of the person days of the codes, rows in the order of the codes
+    def attributes(self, codes, columns = key_cols):
+        return(self.days.loc[codes, columns].reset_index(drop=True))
+
+
+"""
+INPUT:  df <table with user_id and start_date, e.g. ucalitems_ljoin_ucisurvey_split>
+
+OUTPUT: PersonDayIndex of the person days of the table, using the codes of the column 'person_day' if there is one
+"""
+def build_person_day_index(df):
+    if has_codes(df):
+        codes = df[code_col].values
+        keep = np.flatnonzero(codes >= 0)
+        index, first = np.unique(codes[keep], return_index=True)
+        days = df[key_cols].iloc[keep[first]].set_index(pd.Index(index, name=code_col))
+    else:
+        keys = pd.factorize(pd.MultiIndex.from_frame(df[key_cols].dropna()), sort=True)[1]
+        days = pd.DataFrame(list(keys), columns=key_cols).rename_axis(code_col)
+    return(PersonDayIndex(add_day_attributes(days)))
+
+
+"""
+INPUT:  df <table with user_id and start_date>
+
+OUTPUT: row <dense row number of the person day of each row of the table (0 .. # person days - 1)>,
+        person_days <table of these person days: user_id, start_date, dow, IsWeekend, sorted by user_id and start_date>
+"""
+def factorize_person_days(df):
+    if has_codes(df):
+        index, row = np.unique(df[code_col].values, return_inverse=True)
+        first = np.unique(row, return_index=True)[1]
+        person_days = df[key_cols].iloc[first].reset_index(drop=True)
+    else:
+        row, keys = pd.factorize(pd.MultiIndex.from_arrays([df['user_id'], df['start_date']]), sort=True)
+        person_days = pd.DataFrame(list(keys), columns=key_cols)
+    return(row, add_day_attributes(person_days))
+
+if __name__=='__main__':
+    pass
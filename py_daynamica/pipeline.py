@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Lazy, memoized stage graph of the processing steps'
+
+__author__ = 'Xiaohuan Zeng'
+
+import hashlib
+import pandas as pd
+
+from py_daynamica import activity_space_windows, data_quality, s2_preprocess_data, s3_valid_data, s5_cal_activity_space, s6_daily_episode_summary
+
+"""
+The processing steps S2-S6 are declared as stages with explicit inputs (tables), parameters and outputs.
+A table is computed the first time it is requested and memoized together with a fingerprint of
+    - the raw tables it depends on (hash of their content)
+    - the parameters used by the stage and all of its upstream stages
+so changing one parameter only recomputes the stages downstream of it, e.g. a new 'buffer_dis_meter'
+recomputes 'convex_hull', 'sde' and 'overview_statistics' while the splitting and day summaries are reused.
+
+Note: memoized tables are returned as they are (not copied), please do not modify them in place.
+"""
+
+# raw tables read by S1 (path2dict)
+raw_tables = ['ucalitems', 'calendar_item_survey', 'ema_survey']
+
+# default parameters of all stages
+default_params = {
+    'local_timezone': 'US/Central',
+    'unix_time_unit': 'ms',
+    'min_time_stamp': 0,
+    'query_text': 'interact_by_confirm>0',
+    'origin_crs': 4326,
+    'projected_crs': 26915,
+    'buffer_dis_meter': 100,
+    'place_radius_meter': 100,
+    'stat_group_cols': ['IsWeekend', 'Statistics'],
+}
+
+
+class Stage(object):
+    """
+    name: stage name
+    func: function called with the input tables (in order) and the parameters (as keywords)
+    inputs: names of the tables used by the stage
+    params: names of the parameters used by the stage
+    outputs: names of the tables produced by the stage, func returns a tuple if more than one output
+    """
+    def __init__(self, name, func, inputs, params=(), outputs=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.outputs = list(outputs) if outputs is not None else [name]
+
+    def __repr__(self):
+        return('Stage({}: {} -> {})'.format(self.name, self.inputs, self.outputs))
+
+
+# stage functions, thin wrappers of the functions in S2-S6
+def _split(calendar_item_survey, ucalitems, local_timezone, unix_time_unit, min_time_stamp):
+    ucalitems_ljoin_ucisurvey, responses = s2_preprocess_data.ucalitems_ljoin_ucisurvey(calendar_item_survey, ucalitems, return_responses=True)
+    ucalitems_ljoin_ucisurvey = s5_cal_activity_space.str2cor_tb(ucalitems_ljoin_ucisurvey)
+    # split_ucalitems adds the local date time columns to ucalitems_ljoin_ucisurvey, which are needed to filter activities
+    split = s2_preprocess_data.split_ucalitems(ucalitems_ljoin_ucisurvey, local_timezone,
+                                               unix_time_unit=unix_time_unit, min_time_stamp=min_time_stamp)
+    return(ucalitems_ljoin_ucisurvey, split, responses)
+
+def _valid_days(day_summary, ucalitems_ljoin_ucisurvey_split, ucalitems_ljoin_ucisurvey, ema_survey, calendar_item_survey, query_text):
+    csv_dict = {
+        'day_summary': day_summary,
+        'ucalitems_ljoin_ucisurvey_split': ucalitems_ljoin_ucisurvey_split,
+        'ucalitems_ljoin_ucisurvey': ucalitems_ljoin_ucisurvey,
+        'ema_survey': ema_survey,
+        'calendar_item_survey': calendar_item_survey,
+    }
+    return(s3_valid_data.filter_valid_days(csv_dict, query_text))
+
+def _ucalitems_activity(valid_days, origin_crs, projected_crs):
+    return(s5_cal_activity_space.extract_geo_info(valid_days['ucalitems_activity'], origin_crs, projected_crs))
+
+def _leg2trip(valid_days):
+    return(s6_daily_episode_summary.leg2trip(valid_days['ucalitems_temporal_plot']))
+
+def _overview_statistics(valid_days, convex_hull, sde, mobility, leg2trip, stat_group_cols):
+    csv_dict_sub = dict(valid_days, convex_hull=convex_hull, sde=sde, mobility=mobility, leg2trip=leg2trip)
+    return(s6_daily_episode_summary.overview_statistics(csv_dict_sub, stat_group_cols=stat_group_cols))
+
+
+default_stages = [
+    Stage('split', _split, ['calendar_item_survey', 'ucalitems'],
+          params=['local_timezone', 'unix_time_unit', 'min_time_stamp'],
+          outputs=['ucalitems_ljoin_ucisurvey', 'ucalitems_ljoin_ucisurvey_split', 'survey_responses']),
+    Stage('day_summary', s2_preprocess_data.get_per_day_duration, ['ucalitems_ljoin_ucisurvey_split']),
+    Stage('data_quality', data_quality.scan_quality, ['ucalitems_ljoin_ucisurvey_split']),
+    Stage('valid_days', _valid_days,
+          ['day_summary', 'ucalitems_ljoin_ucisurvey_split', 'ucalitems_ljoin_ucisurvey', 'ema_survey', 'calendar_item_survey'],
+          params=['query_text']),
+    Stage('ucalitems_activity', _ucalitems_activity, ['valid_days'], params=['origin_crs', 'projected_crs']),
+    Stage('convex_hull', s5_cal_activity_space.cal_convex_hull, ['ucalitems_activity'], params=['buffer_dis_meter']),
+    Stage('sde', s5_cal_activity_space.cal_sde, ['ucalitems_activity', 'convex_hull'], params=['buffer_dis_meter']),
+    Stage('mobility', s5_cal_activity_space.cal_mobility_metrics, ['ucalitems_activity'], params=['place_radius_meter']),
+    Stage('person_activity_space', activity_space_windows.person_activity_space, ['ucalitems_activity', 'convex_hull'],
+          params=['buffer_dis_meter']),
+    Stage('leg2trip', _leg2trip, ['valid_days']),
+    Stage('overview_statistics', _overview_statistics, ['valid_days', 'convex_hull', 'sde', 'mobility', 'leg2trip'],
+          params=['stat_group_cols']),
+]
+
+
+# fingerprint of a raw table based on its content, falls back to the object identity for unhashable columns
+def table_fingerprint(df):
+    sha = hashlib.sha1()
+    sha.update(repr(list(df.columns)).encode())
+    try:
+        sha.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        sha.update('{}_{}'.format(id(df), df.shape).encode())
+    return(sha.hexdigest())
+
+
+"""
+INPUT:  csv_dict <data dictionary from S1 (path2dict), only the raw tables are used>
+        **params <parameters to override default_params>
+
+TASKS:  build the stage graph, tables are computed lazily by pipeline[table_name]
+
+OUTPUT: a Pipeline object; origin_dict() and valid_dict() return the two data dictionaries used by
+        S3 (before filtering) and S7 (save_tables_plots, after filtering)
+"""
+class Pipeline(object):
+
+    def __init__(self, csv_dict, stages=default_stages, **params):
+        self.stages = {stage.name: stage for stage in stages}
+        self.producer = {}
+        for stage in stages:
+            for output in stage.outputs:
+                self.producer[output] = stage
+
+        self.params = dict(default_params)
+        self.params.update(params)
+
+        self.tables = {}
+        self.table_fp = {}
+        for key, value in csv_dict.items():
+            if key in raw_tables:
+                self.set_table(key, value)
+
+        self.memo = {}  # stage name -> (fingerprint, outputs)
+
+    def set_table(self, name, df):
+        self.tables[name] = df
+        self.table_fp[name] = table_fingerprint(df)
+
+    def set_params(self, **params):
+        for key in params:
+            if key not in self.params:
+                raise KeyError('Unknown parameter: {}'.format(key))
+        self.params.update(params)
+
+    def fingerprint(self, name):
+        if name in self.tables:
+            return(self.table_fp[name])
+        stage = self.producer[name]
+        sha = hashlib.sha1(stage.name.encode())
+        for param in stage.params:
+            sha.update('{}={!r}'.format(param, self.params[param]).encode())
+        for input_name in stage.inputs:
+            sha.update(self.fingerprint(input_name).encode())
+        return(sha.hexdigest())
+
+    # stages that will be (re)computed on the next access, in the order of the graph
+    def stale(self):
+        return([name for name, stage in self.stages.items()
+                if self.memo.get(name, (None,))[0] != self.fingerprint(stage.outputs[0])])
+
+    def __getitem__(self, name):
+        if name in self.tables:
+            return(self.tables[name])
+        if name not in self.producer:
+            raise KeyError('Unknown table: {}'.format(name))
+
+        stage = self.producer[name]
+        fp = self.fingerprint(name)
+        if self.memo.get(stage.name, (None,))[0] != fp:
+            args = [self[input_name] for input_name in stage.inputs]
+            kwargs = {param: self.params[param] for param in stage.params}
+            print('Stage: {}. computing {} ...'.format(stage.name, ', '.join(stage.outputs)))
+            outputs = stage.func(*args, **kwargs)
+            if len(stage.outputs) == 1:
+                outputs = (outputs,)
+            self.memo[stage.name] = (fp, dict(zip(stage.outputs, outputs)))
+
+        return(self.memo[stage.name][1][name])
+
+    # data dictionary before filtering valid days, i.e. csv_dict in the notebooks
+    def origin_dict(self):
+        csv_dict = dict(self.tables)
+        for name in ['ucalitems_ljoin_ucisurvey', 'ucalitems_ljoin_ucisurvey_split', 'day_summary']:
+            csv_dict[name] = self[name]
+        return(csv_dict)
+
+    # data dictionary after filtering valid days, i.e. csv_dict_sub in the notebooks
+    def valid_dict(self):
+        csv_dict_sub = dict(self['valid_days'])
+        for name in ['ucalitems_activity', 'convex_hull', 'sde', 'mobility', 'leg2trip']:
+            csv_dict_sub[name] = self[name]
+        return(csv_dict_sub)
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Index of repeatedly visited places by user'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+"""
+Activities are clustered into unique places per user on a grid of square cells (cell size = radius_meter):
+    - points in the same cell belong to the same place
+    - adjacent cells (incl. diagonal) whose centroids are within radius_meter are merged into one place
+The place of a point is the connected component of its cell, computed with vectorized label propagation
+over all users at once (no loop over users or points).
+
+Places of a user are numbered by number of visits (place_id 0 is the most visited place).
+"""
+
+# connected components of an undirected graph with n nodes and edges (a, b), returns the smallest node of each component
+def connected_components(n, a, b):
+    labels = np.arange(n)
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, a, labels[b])
+        np.minimum.at(new_labels, b, labels[a])
+        new_labels = new_labels[new_labels]  # pointer jumping
+        if (new_labels == labels).all():
+            return(labels)
+        labels = new_labels
+
+
+"""
+INPUT:  ucalitems_activity <activities with projected x and y in meters, after running extract_geo_info in S5>
+        radius_meter <cell size and the maximum distance to merge neighbouring cells>
+
+OUTPUT: place_code <code of the place of each activity (unique across users), -1 if the activity has no coordinates>,
+        places <table of unique places: user_id, place_id, x, y, visits, days, home_visits>
+"""
+def cluster_places(ucalitems_activity, radius_meter=100):
+    # activities without coordinates (e.g. centroid 'None') are not assigned to any place
+    valid = np.isfinite(ucalitems_activity['x'].values.astype(float)) & np.isfinite(ucalitems_activity['y'].values.astype(float))
+    activities = ucalitems_activity[valid]
+
+    x = activities['x'].values.astype(float)
+    y = activities['y'].values.astype(float)
+    user_codes, users = pd.factorize(activities['user_id'])
+    if x.shape[0] == 0:
+        places = pd.DataFrame({'place_code': np.zeros(0, dtype=np.int64), 'user_id': np.zeros(0, dtype=object), 'x': np.zeros(0), 'y': np.zeros(0),
+                               'visits': np.zeros(0, dtype=np.int64), 'days': np.zeros(0, dtype=np.int64), 'home_visits': np.zeros(0, dtype=int),
+                               'place_id': np.zeros(0, dtype=np.int64)})
+        return(np.full(valid.shape[0], -1, dtype=np.int64), places)
+
+    # one int64 key per (user, cell); cells are padded by one so that neighbours stay inside the key range
+    cx = np.floor(x / radius_meter).astype(np.int64)
+    cy = np.floor(y / radius_meter).astype(np.int64)
+    cx, cy = cx - cx.min() + 1, cy - cy.min() + 1
+    nx, ny = cx.max() + 2, cy.max() + 2
+    key = (user_codes * ny + cy) * nx + cx
+
+    cell_keys, cell_of_point = np.unique(key, return_inverse=True)
+    cell_count = np.bincount(cell_of_point)
+    cell_x = np.bincount(cell_of_point, weights=x) / cell_count
+    cell_y = np.bincount(cell_of_point, weights=y) / cell_count
+
+    # merge neighbouring cells (right, up, up-right, up-left) with centroids within radius_meter
+    edges_a, edges_b = [], []
+    for dx, dy in [(1, 0), (0, 1), (1, 1), (-1, 1)]:
+        neighbour = np.searchsorted(cell_keys, cell_keys + dy * nx + dx)
+        neighbour = np.minimum(neighbour, cell_keys.shape[0] - 1)
+        found = cell_keys[neighbour] == cell_keys + dy * nx + dx
+        found &= np.hypot(cell_x - cell_x[neighbour], cell_y - cell_y[neighbour]) <= radius_meter
+        edges_a.append(np.flatnonzero(found))
+        edges_b.append(neighbour[found])
+    cell_label = connected_components(cell_keys.shape[0], np.concatenate(edges_a), np.concatenate(edges_b))
+    place_code = pd.factorize(cell_label[cell_of_point])[0]
+
+    # place table
+    visits = np.bincount(place_code)
+    places = pd.DataFrame({
+        'place_code': np.arange(visits.shape[0]),
+        'user_id': users[user_codes[np.unique(place_code, return_index=True)[1]]],
+        'x': np.bincount(place_code, weights=x) / visits,
+        'y': np.bincount(place_code, weights=y) / visits,
+        'visits': visits,
+        'days': pd.DataFrame({'place_code': place_code, 'start_date': activities['start_date'].values}).drop_duplicates()['place_code'].value_counts().sort_index().values,
+        'home_visits': np.bincount(place_code, weights=(activities['subtype_decoded'].values == 'HOME'), minlength=visits.shape[0]).astype(int),
+    })
+    places.sort_values(by=['user_id', 'visits', 'place_code'], ascending=[True, False, True], inplace=True, ignore_index=True)
+    places['place_id'] = places.groupby('user_id').cumcount()
+
+    print('# activities: {0:0.0f}. # activities with coordinates: {1:0.0f}. # unique places: {2:0.0f}. # users: {3:0.0f}'.format(
+        valid.shape[0], x.shape[0], places.shape[0], users.shape[0]))
+
+    place_code_all = np.full(valid.shape[0], -1, dtype=np.int64)
+    place_code_all[valid] = place_code
+    return(place_code_all, places)
+
+
+"""
+INPUT:  ucalitems_activity <activities with projected x and y in meters, after running extract_geo_info in S5>
+        radius_meter <distance used to cluster activities into places>
+
+TASKS:  - place of each activity ('place_id', numbered per user)
+        - home of each user: the place with most HOME activities (the most visited place if there is no HOME activity)
+        - per person-day unique places with visit counts
+        - places or activities within a given distance of a point or of home
+"""
+class PlaceIndex(object):
+
+    def __init__(self, ucalitems_activity, radius_meter=100):
+        self.radius_meter = radius_meter
+        place_code, self.places = cluster_places(ucalitems_activity, radius_meter=radius_meter)
+        self.activities = ucalitems_activity[place_code >= 0]
+        self.place_code = place_code[place_code >= 0]
+
+        # places are sorted by user: row range of each user
+        self.user_ids = self.places['user_id'].unique()
+        user_codes = pd.Categorical(self.places['user_id'], categories=self.user_ids).codes
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(user_codes, minlength=self.user_ids.shape[0]))])
+        self.user_row = pd.Series(np.arange(self.user_ids.shape[0]), index=self.user_ids)
+
+        # row of each place code in self.places
+        self.place_row = np.empty(self.places.shape[0], dtype=np.int64)
+        self.place_row[self.places['place_code'].values] = np.arange(self.places.shape[0])
+
+        # home: most HOME visits, ties and users without HOME activities fall back to the most visited place
+        home = self.places.sort_values(by=['home_visits', 'visits'], ascending=False, kind='mergesort').drop_duplicates('user_id')
+        self.home = home.set_index('user_id')[['place_id', 'x', 'y']]
+
+        self.activity_place_row = self.place_row[self.place_code]
+
+    # place_id of each activity (with coordinates)
+    def place_id(self):
+        return(pd.Series(self.places['place_id'].values[self.activity_place_row], index=self.activities.index, name='place_id'))
+
+    # places of ONE user
+    def user_places(self, user_id):
+        i = self.user_row[user_id]
+        return(self.places.iloc[self.offsets[i]:self.offsets[i + 1]])
+
+    # places of ONE user within distance_meter of the point (x, y)
+    def within(self, user_id, x, y, distance_meter):
+        df = self.user_places(user_id)
+        return(df[np.hypot(df['x'].values - x, df['y'].values - y) <= distance_meter])
+
+    # distance (meters) between each activity and the home of the user
+    def distance_to_home(self):
+        home = self.home.reindex(self.activities['user_id'].values)
+        return(pd.Series(np.hypot(self.activities['x'].values - home['x'].values, self.activities['y'].values - home['y'].values),
+                         index=self.activities.index, name='distance_to_home'))
+
+    # activities within distance_meter of home
+    def activities_near_home(self, distance_meter):
+        return(self.activities[self.distance_to_home().values <= distance_meter])
+
+    """
+    OUTPUT: one row per person-day and place, with the place centroid (x, y) and the number of visits
+            the convex hull of the places approximates the convex hull of the activities (cal_convex_hull in S5),
+            but cal_sde does not use the visits: an ellipse of these rows is unweighted, not the ellipse of the activities
+    """
+    def person_day_places(self, group_cols = ["user_id", "start_date"]):
+        df = self.activities[group_cols].copy()
+        df['place_id'] = self.places['place_id'].values[self.activity_place_row]
+        df['place_row'] = self.activity_place_row
+        result = df.groupby(group_cols + ['place_id'], sort=True).agg(visits=('place_row', 'size'), place_row=('place_row', 'first')).reset_index()
+        result['x'] = self.places['x'].values[result['place_row'].values]
+        result['y'] = self.places['y'].values[result['place_row'].values]
+        result.drop(columns='place_row', inplace=True)
+
+        # keep the crs of the input table if it is a geodataframe
+        if hasattr(self.activities, 'crs') and self.activities.crs is not None:
+            import geopandas as gpd
+            result = gpd.GeoDataFrame(result, geometry=gpd.points_from_xy(result['x'], result['y']), crs=self.activities.crs)
+
+        print('# activities: {0:0.0f}. # person-day places: {1:0.0f}'.format(self.activities.shape[0], result.shape[0]))
+        return(result)
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Similarity and clustering of person days by daily schedule'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from py_daynamica import s8_time_use
+
+"""
+Each person day is a fixed-length vector of time slots (e.g. 96 slots of 15 minutes), the value of a slot is the
+label (activity type or travel mode) at the middle of the slot in the time use matrix of S8.
+
+The distance between two days is the Hamming distance: the share of time slots with different labels.
+With one-hot vectors X (one column per slot and label) the number of matching slots is X @ X.T, so distances are
+computed by blocks of rows with matrix products; only the compact slots are sent to the worker processes, and memory is
+bounded by the block size (block_size x # days) unless the full distance matrix is requested (it can be saved to a
+memory-mapped .npy file).
+"""
+
+
+"""
+INPUT:  ucalitems_temporal_plot after filtering valid days
+        slot_minutes <minutes per time slot>
+
+OUTPUT: slots <uint8 array, person-day x (1440 / slot_minutes), label codes of s8_time_use.time_use_labels>,
+        person_days <user_id, start_date, dow, IsWeekend of each row>
+"""
+def day_slots(ucalitems_temporal_plot, slot_minutes = 15):
+    matrix, person_days = s8_time_use.time_use_matrix(ucalitems_temporal_plot)
+    return(matrix[:, slot_minutes // 2::slot_minutes], person_days)
+
+
+# one-hot float32 matrix, one column per (slot, label) for the given labels (default: the labels present in slots)
+def one_hot(slots, labels = None):
+    labels = np.unique(slots) if labels is None else labels
+    codes = np.searchsorted(labels, slots)
+    n_labels = labels.shape[0]
+    result = np.zeros((slots.shape[0], slots.shape[1] * n_labels), dtype=np.float32)
+    cols = np.arange(slots.shape[1])[None, :] * n_labels + codes
+    result[np.arange(slots.shape[0])[:, None], cols] = 1
+    return(result)
+
+
+# compact slots shared with the worker processes (set once per worker by the initializer), the one-hot blocks are built in the workers
+_slots_x, _slots_y, _labels, _block_size = None, None, None, None
+
+def _init_worker(slots_x, slots_y, labels, block_size):
+    global _slots_x, _slots_y, _labels, _block_size
+    _slots_x, _slots_y, _labels, _block_size = slots_x, slots_y, labels, block_size
+
+# distances of the rows start:stop of slots_x to all rows of slots_y, by blocks of rows of slots_y (memory: two one-hot blocks)
+def _block_distance(start, stop):
+    x = one_hot(_slots_x[start:stop], _labels)
+    result = np.empty((stop - start, _slots_y.shape[0]), dtype=np.float32)
+    for y_start in range(0, _slots_y.shape[0], _block_size):
+        y = one_hot(_slots_y[y_start:y_start + _block_size], _labels)
+        result[:, y_start:y_start + _block_size] = 1 - (x @ y.T) / _slots_x.shape[1]
+    return(result)
+
+# distances between the rows of slots_x and slots_y by blocks of rows of slots_x, yields (start, stop, block)
+# with workers, at most 2 blocks per worker are computed or waiting at a time
+def iter_distance_blocks(slots_x, slots_y = None, block_size = 1024, n_workers = 1):
+    slots_y = slots_x if slots_y is None else slots_y
+    # the labels present in both tables so that the one-hot columns match
+    labels = np.union1d(np.unique(slots_x), np.unique(slots_y))
+
+    starts = list(range(0, slots_x.shape[0], block_size))
+    stops = [min(start + block_size, slots_x.shape[0]) for start in starts]
+
+    if n_workers == 1:
+        _init_worker(slots_x, slots_y, labels, block_size)
+        for start, stop in zip(starts, stops):
+            yield(start, stop, _block_distance(start, stop))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(slots_x, slots_y, labels, block_size)) as executor:
+            pending = collections.deque()
+            for start, stop in zip(starts, stops):
+                pending.append((start, stop, executor.submit(_block_distance, start, stop)))
+                if len(pending) >= 2 * n_workers:
+                    start, stop, future = pending.popleft()
+                    yield(start, stop, future.result())
+            while pending:
+                start, stop, future = pending.popleft()
+                yield(start, stop, future.result())
+
+
+"""
+INPUT:  slots <output of day_slots>
+        block_size <number of rows computed at once>
+        n_workers <number of worker processes, None for the number of cpus>
+        out <None to keep the matrix in memory, or a .npy file path to write a memory-mapped matrix>
+
+OUTPUT: float32 distance matrix (person-day x person-day)
+"""
+def distance_matrix(slots, block_size = 1024, n_workers = 1, out = None):
+    n_workers = n_workers or os.cpu_count() or 1
+    n = slots.shape[0]
+    if out is None:
+        result = np.empty((n, n), dtype=np.float32)
+    else:
+        result = np.lib.format.open_memmap(out, mode='w+', dtype=np.float32, shape=(n, n))
+
+    for start, stop, block in iter_distance_blocks(slots, block_size=block_size, n_workers=n_workers):
+        result[start:stop] = block
+
+    print('# person-days: {0:0.0f}. distance matrix size: {1:0.1f} MB'.format(n, result.nbytes / 1e6))
+    return(result)
+
+
+"""
+INPUT:  slots <output of day_slots>
+        n_neighbours <number of nearest person days>
+
+OUTPUT: indices and distances (person-day x n_neighbours) of the nearest other person days, computed by blocks
+"""
+def nearest_neighbours(slots, n_neighbours = 5, block_size = 1024, n_workers = 1):
+    n_workers = n_workers or os.cpu_count() or 1
+    n = slots.shape[0]
+    k = min(n_neighbours, n - 1)
+    indices = np.empty((n, k), dtype=np.int64)
+    distances = np.empty((n, k), dtype=np.float32)
+
+    for start, stop, block in iter_distance_blocks(slots, block_size=block_size, n_workers=n_workers):
+        block[np.arange(stop - start), np.arange(start, stop)] = np.inf  # exclude the day itself
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        nearest_dist = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(nearest_dist, axis=1, kind='stable')
+        indices[start:stop] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:stop] = np.take_along_axis(nearest_dist, order, axis=1)
+
+    return(indices, distances)
+
+
+"""
+INPUT:  distances <distance matrix>
+        k <number of clusters, from 1 to the number of rows>
+
+TASKS:  k-medoids (alternate between assigning days to the nearest medoid and updating the medoid of each cluster),
+        initial medoids chosen k-medoids++ style (far from the existing medoids)
+
+OUTPUT: medoids <row numbers>, labels <cluster of each row>
+"""
+def kmedoids(distances, k, max_iter = 100, seed = 0):
+    rng = np.random.default_rng(seed)
+    n = distances.shape[0]
+    if not 1 <= k <= n:
+        raise Exception("Sorry, k must be between 1 and the number of days ({}), got {}".format(n, k))
+
+    medoids = [rng.integers(n)]
+    for i in range(1, k):
+        # the days already chosen are excluded, days at distance 0 of all medoids are drawn uniformly if no other day is left
+        min_dist = distances[:, medoids].min(axis=1).astype(float) ** 2
+        min_dist[medoids] = 0
+        if min_dist.sum() == 0:
+            min_dist = np.ones(n)
+            min_dist[medoids] = 0
+        medoids.append(rng.choice(n, p=min_dist / min_dist.sum()))
+    medoids = np.array(medoids)
+
+    for i in range(max_iter):
+        # each medoid stays in its own cluster (also if it is identical to another medoid), so the medoids stay distinct
+        labels = np.argmin(distances[:, medoids], axis=1)
+        labels[medoids] = np.arange(k)
+        new_medoids = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if members.shape[0] > 0:
+                new_medoids[c] = members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))]
+        if (new_medoids == medoids).all():
+            break
+        medoids = new_medoids
+
+    labels = np.argmin(distances[:, medoids], axis=1)
+    labels[medoids] = np.arange(k)
+    return(medoids, labels)
+
+
+"""
+INPUT:  slots, person_days <outputs of day_slots>
+        k <number of clusters, reduced to the number of (sampled) person days if there are fewer days>
+        sample_size <k-medoids is run on a random sample of person days (all days if None or larger than the number of days),
+                     then all days are assigned to the nearest medoid by blocks, so memory is bounded by sample_size**2>
+
+OUTPUT: labels <person_days with columns 'cluster' and 'distance_to_medoid', can be merged with day_summary on ['user_id', 'start_date']>,
+        medoids <one row per cluster: the medoid person day, the number of days and the schedule of the medoid as text>
+"""
+def cluster_days(slots, person_days, k = 5, sample_size = 5000, block_size = 1024, n_workers = 1, seed = 0):
+    rng = np.random.default_rng(seed)
+    n = slots.shape[0]
+    sample = np.arange(n)
+    if (sample_size is not None) and (sample_size < n):
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+    if n == 0:
+        raise Exception("Sorry, no person day to cluster")
+    if k > sample.shape[0]:
+        print('k = {0:0.0f} is larger than the number of (sampled) person days, k = {1:0.0f} is used...'.format(k, sample.shape[0]))
+        k = sample.shape[0]
+
+    sample_medoids, _ = kmedoids(distance_matrix(slots[sample], block_size=block_size, n_workers=n_workers), k, seed=seed)
+    medoids = sample[sample_medoids]
+
+    cluster = np.empty(n, dtype=np.int64)
+    distance = np.empty(n, dtype=np.float32)
+    for start, stop, block in iter_distance_blocks(slots, slots[medoids], block_size=block_size, n_workers=n_workers):
+        cluster[start:stop] = np.argmin(block, axis=1)
+        distance[start:stop] = block[np.arange(stop - start), cluster[start:stop]]
+
+    labels = person_days.copy()
+    labels['cluster'] = cluster
+    labels['distance_to_medoid'] = distance
+
+    # describe the medoid schedule as the sequence of labels by slot
+    slot_minutes = s8_time_use.minutes_per_day // slots.shape[1]
+    medoid_table = person_days.iloc[medoids].reset_index(drop=True)
+    medoid_table.insert(0, 'cluster', np.arange(k))
+    medoid_table['days'] = np.bincount(cluster, minlength=k)
+    medoid_table['schedule'] = [schedule_text(slots[i], slot_minutes) for i in medoids]
+
+    print('# person-days: {0:0.0f}. # sampled: {1:0.0f}. # days by cluster: {2}'.format(n, sample.shape[0], medoid_table['days'].tolist()))
+    return(labels, medoid_table)
+
+
+# schedule of ONE slot vector as text, e.g. 00:00 HOME | 08:15 CAR - DRIVER | 08:45 WORKPLACE ...
+def schedule_text(slot_vector, slot_minutes):
+    change = np.flatnonzero(np.concatenate([[True], slot_vector[1:] != slot_vector[:-1]]))
+    return(' | '.join('{:02d}:{:02d} {}'.format(i * slot_minutes // 60, i * slot_minutes % 60, s8_time_use.time_use_labels[slot_vector[i]]) for i in change))
+
+if __name__=='__main__':
+    pass
@@ -6,26 +6,54 @@
 __author__ = 'Xiaohuan Zeng'
 
 import os
+import ast
+import json
+import time
+import datetime
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# file written by dict2file next to the tables, so that path2dict can restore column types and geometries
+schema_file = '_tables.json'
+
+file_extensions = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+csv_compression_extensions = {'gzip': '.gz', 'bz2': '.bz2', 'zip': '.zip', 'xz': '.xz', 'zstd': '.zst'}
+
+# table name of a Daynamica export file, e.g. <project_name>ucalitems<year>....csv -> 'ucalitems'
+# (an empty or None project_name / year is not removed, e.g. HotFolder(year = ''))
+def export_table_name(filename, project_name, year):
+    name = filename.replace(project_name, '') if project_name else filename
+    name = name.replace('.csv', '')
+    return(name.split(year)[0] if year else name)
 
 """
 INPUT: folder_path: the path of folder that saves daynamica data, project_name, year
+       (project_name and year are not needed for a folder saved by dict2file)
 
 OUTPUT: a dictionary (Python data type) of tables with table names modified from the original full names 
 
 """
 
-def path2dict(folder_path, project_name, year):
+def path2dict(folder_path, project_name = None, year = None):
     csv_dict = {}
     
     try:
         os.path.exists(folder_path)
         print("{} folder exists...".format(folder_path))
         print("now reading data into dictionary...")
+
+        # folder saved by dict2file
+        if os.path.exists(os.path.join(folder_path, schema_file)):
+            with open(os.path.join(folder_path, schema_file)) as f:
+                schema = json.load(f)
+            for dict_name, table_schema in schema.items():
+                csv_dict[dict_name] = read_table(os.path.join(folder_path, table_schema['file']), table_schema)
+                print('Tabel name: {}. # rows: {}. # columns: {} ...'.format(dict_name, str(csv_dict[dict_name].shape[0]), str(csv_dict[dict_name].shape[1])))
+            return(csv_dict)
         
         for filename in os.listdir(folder_path):
             filename_path = os.path.join(folder_path, filename)
-            dict_name = filename.replace(project_name, '').replace('.csv', '').split(year)[0]
+            dict_name = export_table_name(filename, project_name, year)
             csv_dict[dict_name] = pd.read_csv(filename_path)
             print('Tabel name: {}. # rows: {}. # columns: {} ...'.format(dict_name, str(csv_dict[dict_name].shape[0]), str(csv_dict[dict_name].shape[1])))
     
@@ -35,36 +63,194 @@ def path2dict(folder_path, project_name, year):
 
     return(csv_dict)
 
+"""
+INPUT: df: ONE table (DataFrame or GeoDataFrame)
+       file_format: 'csv', 'parquet' or 'feather'
+       index: True or False to keep the row index
+
+TASKS: geometry columns are encoded as WKB (hex strings in csv), the row index is saved as columns
+       the columns are written with text names ('col0', 'col1', ... if the labels are not unique texts, e.g. the MultiIndex
+       columns of activity_trip_subtype), the labels are saved in the schema
+
+OUTPUT: a plain DataFrame to be written, the schema of the table (column labels and types, crs of geometry columns, index columns)
+"""
+def encode_table(df, file_format, index = False):
+    schema = {'geometry': getattr(df, '_geometry_column_name', None), 'crs': {}, 'index': None, 'columns_name': df.columns.name}
+    df = pd.DataFrame(df)
+    if index:
+        index_names = list(df.index.names)
+        df = df.reset_index()
+        index_cols = list(range(len(index_names)))
+    else:
+        df = df.reset_index(drop = True)
+
+    # column labels as json values (MultiIndex labels as lists) and text names of the written columns
+    schema['columns'] = {'labels': [json_label(label) for label in df.columns], 'names': [json_label(name) for name in df.columns.names],
+                         'multiindex': isinstance(df.columns, pd.MultiIndex)}
+    text_names = all(isinstance(label, str) for label in df.columns) and df.columns.is_unique
+    df.columns = list(df.columns) if text_names else ['col{}'.format(i) for i in range(df.shape[1])]
+    if index:
+        schema['index'] = {'columns': [df.columns[i] for i in index_cols], 'names': [json_label(name) for name in index_names]}
+    if schema['geometry'] is not None:
+        schema['geometry'] = df.columns[schema['columns']['labels'].index(json_label(schema['geometry']))]
+
+    schema['dtypes'] = df.dtypes.astype(str).to_dict()
+
+    # object columns of tuples (e.g. centroid_cor), saved as text in csv and as lists in parquet / feather
+    schema['tuple_cols'] = [col for col, dtype in schema['dtypes'].items() 
+                            if dtype == 'object' and df[col].dropna().head(1).map(lambda x: isinstance(x, tuple)).any()]
+    if schema['tuple_cols'] and file_format == 'csv':
+        df = df.copy()
+        df[schema['tuple_cols']] = df[schema['tuple_cols']].apply(lambda x: x.map(repr, na_action = 'ignore'))
+
+    # object columns of dates (e.g. end_date = dt.date), saved as YYYY-MM-DD in csv
+    schema['date_cols'] = [col for col, dtype in schema['dtypes'].items()
+                           if dtype == 'object' and df[col].dropna().head(1).map(lambda x: isinstance(x, datetime.date) and not isinstance(x, datetime.datetime)).any()]
+
+    geometry_cols = [col for col, dtype in schema['dtypes'].items() if dtype == 'geometry']
+    if geometry_cols:
+        import geopandas as gpd
+        df = df.copy()
+    for col in geometry_cols:
+        crs = df[col].values.crs
+        schema['crs'][col] = crs.to_string() if crs is not None else None
+        df[col] = gpd.GeoSeries(df[col]).to_wkb(hex = (file_format == 'csv'))
+    return(df, schema)
+
+# column label as a json value: texts and numbers are kept, tuples as lists, other labels as texts
+def json_label(label):
+    if isinstance(label, tuple):
+        return([json_label(item) for item in label])
+    if hasattr(label, 'item') and not isinstance(label, str):
+        label = label.item()
+    return(label if (label is None) or isinstance(label, (str, int, float, bool)) else str(label))
+
+# column labels restored from the schema
+def schema_columns(columns_schema):
+    labels = [tuple(label) if isinstance(label, list) else label for label in columns_schema['labels']]
+    if columns_schema['multiindex']:
+        return(pd.MultiIndex.from_tuples(labels, names = columns_schema['names']))
+    return(pd.Index(labels, name = columns_schema['names'][0], tupleize_cols = False))
+
+"""
+INPUT: filename_path, table_schema <schema of the table saved by dict2file>
+
+OUTPUT: ONE table with the column types, geometries (GeoDataFrame) and row index restored
+"""
+def read_table(filename_path, table_schema):
+    dtypes = table_schema['dtypes']
+    file_format = table_schema['format']
+
+    if file_format == 'csv':
+        # only empty cells are missing values, so that texts like 'nan' or 'None' are kept
+        text_cols = [col for col, dtype in dtypes.items() if dtype in ('object', 'geometry')]
+        df = pd.read_csv(filename_path, dtype = {col: object for col in text_cols}, keep_default_na = False, na_values = {col: [''] for col in dtypes})
+        for col, dtype in dtypes.items():
+            if dtype.startswith('datetime64[ns, '):
+                df[col] = pd.to_datetime(df[col], utc = True).dt.tz_convert(dtype[len('datetime64[ns, '):-1])
+            elif dtype.startswith('datetime64'):
+                df[col] = pd.to_datetime(df[col])
+            elif dtype.startswith('timedelta64'):
+                df[col] = pd.to_timedelta(df[col])
+            elif dtype not in ('object', 'geometry'):
+                df[col] = df[col].astype(dtype)
+        for col in table_schema['tuple_cols']:
+            df[col] = df[col].map(ast.literal_eval, na_action = 'ignore')
+        for col in table_schema.get('date_cols', []):
+            df[col] = pd.to_datetime(df[col]).dt.date.where(df[col].notna(), None)
+    elif file_format == 'parquet':
+        df = pd.read_parquet(filename_path)
+    else:
+        df = pd.read_feather(filename_path)
+    if file_format != 'csv':
+        for col in table_schema['tuple_cols']:
+            df[col] = df[col].map(tuple, na_action = 'ignore')
+
+    if table_schema['crs']:
+        import geopandas as gpd
+        for col, crs in table_schema['crs'].items():
+            df[col] = gpd.GeoSeries.from_wkb(df[col].where(df[col].notna(), None), crs = crs)
+        if table_schema['geometry'] is not None:
+            df = gpd.GeoDataFrame(df, geometry = table_schema['geometry'], crs = table_schema['crs'][table_schema['geometry']])
+
+    # column labels (tables saved before the labels were in the schema have text column names)
+    if 'columns' in table_schema:
+        geometry = table_schema['geometry']
+        df.columns = schema_columns(table_schema['columns'])
+        if geometry is not None:
+            df = df.set_geometry(df.columns[list(dtypes).index(geometry)])
+    else:
+        df.columns.name = table_schema['columns_name']
+    if table_schema['index'] is not None:
+        index_cols = [df.columns[list(dtypes).index(col)] for col in table_schema['index']['columns']]
+        df = df.set_index(index_cols)
+        df.index.names = [tuple(name) if isinstance(name, list) else name for name in table_schema['index']['names']]
+    return(df)
+
+
+# write ONE table, returns its schema with the file name, file size and write time
+def write_table(filename, df_table, folder_path, file_format, compression, index):
+    start = time.perf_counter()
+    df, table_schema = encode_table(df_table, file_format, index = index)
+
+    file = filename + file_extensions[file_format]
+    if file_format == 'csv':
+        file = file + csv_compression_extensions.get(compression, '')
+        df.to_csv(os.path.join(folder_path, file), index = False, compression = compression)
+    elif file_format == 'parquet':
+        df.to_parquet(os.path.join(folder_path, file), index = False, **({} if compression is None else {'compression': compression}))
+    else:
+        df.to_feather(os.path.join(folder_path, file), **({} if compression is None else {'compression': compression}))
+
+    table_schema.update({'file': file, 'format': file_format})
+    size_mb = os.path.getsize(os.path.join(folder_path, file)) / 1e6
+    seconds = time.perf_counter() - start
+    print('Tabel name: {}. # rows: {}. file: {}. size: {:0.2f} MB. write time: {:0.2f} s'.format(filename, df.shape[0], file, size_mb, seconds))
+    return(table_schema, [filename, df.shape[0], df.shape[1], file, size_mb, seconds])
+
+
 """
 INPUT:a dictionary (Python data type) of tables with table names modified from the original full names  
     folder_path: the path of folder to saves processed data
     index: True or False to keep the row index
-OUTPUT: None
+    file_format: 'csv', 'parquet' or 'feather' (parquet and feather need pyarrow)
+    compression: None, or e.g. 'gzip' / 'zstd' for csv, 'snappy' / 'zstd' for parquet, 'lz4' / 'zstd' for feather
+    n_workers: number of tables written at the same time, 1 to write them one by one, None for the number of cpus
+               (processes for csv since formatting text holds the GIL, threads for parquet and feather;
+               the processes receive a copy of each table, and a script using them needs if __name__ == '__main__' on Windows and macOS)
+
+TASKS: geometry columns (e.g. geometry and buffer of convex_hull and sde) are saved as WKB and the column types are saved in _tables.json,
+       so that reading the folder with path2dict returns the same tables
+
+OUTPUT: table of the written files: table, rows, columns, file, size_mb, seconds
 
 """
-def dict2file(csv_dict, folder_path, index = False):
+def dict2file(csv_dict, folder_path, index = False, file_format = 'csv', compression = None, n_workers = 1):
+    n_workers = n_workers or os.cpu_count() or 1
+    schema = {}
+    result_list = []
     try:
         os.path.exists(folder_path)
         print("{} folder exists...".format(folder_path))
         print("now saving data into dictionary...")
-        
-        for filename, df_table in csv_dict.items():
-            filename_path = os.path.join(folder_path, filename + '.csv')
-            # remove geometry column to avoid output errors
-            if filename == 'convex_hull':
-                pd.DataFrame(df_table).drop(columns=['geometry', 'buffer']).to_csv(filename_path, index = index)
-            elif filename == 'sde':
-                pd.DataFrame(df_table).drop(columns='geometry').to_csv(filename_path, index = index)
-            else: 
-                df_table.to_csv(filename_path, index = index)
-            print('Tabel name: {}'.format(filename,))
-#             print('Tabel name: {}. # rows: {}. # columns: {} ...'.format(filename, str(df_table.shape[0]), str(df_table.shape[1])))
+
+        pool = ProcessPoolExecutor if (file_format == 'csv') and (n_workers > 1) else ThreadPoolExecutor
+        with pool(max_workers = n_workers) as executor:
+            futures = {filename: executor.submit(write_table, filename, df_table, folder_path, file_format, compression, index) 
+                       for filename, df_table in csv_dict.items()}
+            for filename, future in futures.items():
+                schema[filename], result_item = future.result()
+                result_list.append(result_item)
+
+        with open(os.path.join(folder_path, schema_file), 'w') as f:
+            json.dump(schema, f, indent = 2)
     
     # if folder does not exist
     except FileNotFoundError:
         print("{} folder does not exist, please check your folder path...".format(folder_path))
 
-    return(None)
+    result_df = pd.DataFrame(result_list, columns = ['table', 'rows', 'columns', 'file', 'size_mb', 'seconds'])
+    return(result_df)
 
 if __name__=='__main__':
     pass
\ No newline at end of file
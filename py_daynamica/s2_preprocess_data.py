@@ -8,105 +8,158 @@ __author__ = 'Xiaohuan Zeng'
 import numpy as np
 import pandas as pd
 
+from py_daynamica import kernels, local_day, person_day, survey_responses
+
 
 """
 INPUT: ucalitems_suvery, ucalitems <two tables in the data dictionary create from S1_read_data.py>
+       return_responses <True to also return the responses as a SurveyResponses (sparse episode x question matrix)>
        
+TASKS: the keys (user_id, calendar item id, timestamp) of both tables are factorized once in survey_responses.build_survey_responses,
+       an item has a survey ('survey_not_null') if at least one question has a response
+
 OUTPUT: a joined table "ucalitems_ljoin_ucisurvey" based on 'ucalitems' and 'ucalitems_suvery'
+        (and the SurveyResponses, its episode_key follows the rows of the joined table)
 """
 
-def ucalitems_ljoin_ucisurvey(ucalitems_suvery, ucalitems):
-    
-    ucalitems_suvery_agg = ucalitems_suvery.query('response==response').copy().groupby(['user_id', 'calendar_item_id', 'calendar_item_timestamp'])[['question_id']].agg('count').reset_index()
-    
-    # create shorter names for future modules. Please note that "question_id", "calendar_item_id", and "calendar_item_timestamp" are original column names
-    ucalitems_suvery_agg.rename(columns={'question_id': 'survey_not_null', 
-                             'calendar_item_id': 'cal_item_id', 
-                             'calendar_item_timestamp': 'start_timestamp'}, inplace=True)
+def ucalitems_ljoin_ucisurvey(ucalitems_suvery, ucalitems, return_responses = False):
     
-    ucalitems_suvery_agg['survey_not_null'] = True
+    responses = survey_responses.build_survey_responses(ucalitems_suvery, ucalitems)
+
+    # keys with at least one response (code >= 2 in the matrix)
+    key_answered = np.append(responses.key_answered(), False)
     
-    print('# rows of original survey data: {}. # rows after aggregation: {}'.format(str(ucalitems_suvery.shape[0]), str(ucalitems_suvery_agg.shape[0])))
+    print('# rows of original survey data: {}. # rows after aggregation: {}'.format(str(ucalitems_suvery.shape[0]), str(key_answered.sum())))
 
-    # join the ucalitems with calendar_item_survey as a master table ucalitems_split_survey
-    result = pd.merge(
-        left = ucalitems, 
-        right = ucalitems_suvery_agg, 
-        on = ['user_id', 'cal_item_id', 'start_timestamp'], 
-        how = 'left'
-    )
-    result['survey_not_null'] = result['survey_not_null'].fillna(False)
+    result = ucalitems.reset_index(drop=True)
+    # episodes without survey (episode_key -1) take the last value, False
+    result['survey_not_null'] = key_answered[responses.episode_key]
 
     print('# rows of original ucalitems: {}. # rows after left join: {}'.format(str(ucalitems.shape[0]), str(result.shape[0])))
     print('# ucalitems with survey (True) and without survey (False): ')
     print(result['survey_not_null'].value_counts().sort_index(ascending=False))
     
+    if return_responses:
+        return(result, responses)
     return(result)
 
 
 """
 INPUT: ucalitems_ljoin_ucisurvey <the master joint table after running the function ucalitems_ljoin_ucisurvey>, 
-        local_timezone <the local time zone, e.g. US/Central for Minnesota>, 
+        local_timezone <the local time zone, e.g. US/Central for Minnesota; 
+                        OR a dict (or pandas Series) of user_id -> local time zone for multi-region studies, 
+                        in that case start_dt and end_dt are local date times without time zone and a column 'local_timezone' is added>, 
         unix_time_unit <the time unit used in the original timestamp, 'ms' is the current default>, need to update if original data change formats> 
         min_time_stamp <the time stamp used to filter records with default setting, the default is (the current default timestamp-10000000000)>
+        copy_attributes <False: the days after the first day of an item have missing values in the columns with missing values
+                         (e.g. subtype_decoded, centroid_cor, confirm_timestamp, edit_timestamp), as the forward fill of the
+                         original version; True: all attributes are copied from the item to all its days>
         
 TASKS
-    - split multi-day data
+    - split multi-day data at local midnights; local days, midnights and utc offsets (daylight saving time) are computed
+      on int64 timestamps by the module local_day, without creating date objects
     - label calendar items with user interactions: new columns 'interact_with_app', 'interact_by_confirm', 'interact_by_edit'
 
 OUTPUT: a new table 'ucalitems_ljoin_ucisurvey_split' with split days and new labels for various types of user interactions with app
 
 """
 
-def split_ucalitems(ucalitems_ljoin_ucisurvey, local_timezone, unix_time_unit = 'ms', min_time_stamp=0):
-    
-    # preprocess before splitting days
-    # converting string to datetime objects with timezone and deal with time zones
-    ucalitems_ljoin_ucisurvey['start_dt'] = pd.to_datetime(ucalitems_ljoin_ucisurvey['start_timestamp'], unit=unix_time_unit, utc=True).dt.tz_convert(local_timezone)
-    ucalitems_ljoin_ucisurvey['end_dt'] = pd.to_datetime(ucalitems_ljoin_ucisurvey['end_timestamp'], unit=unix_time_unit, utc=True).dt.tz_convert(local_timezone)
+# missing timestamps (NaT) as int64
+NAT = np.iinfo(np.int64).min
 
-    ucalitems_ljoin_ucisurvey['start_date'] = pd.to_datetime(ucalitems_ljoin_ucisurvey['start_dt'].dt.date)
-    ucalitems_ljoin_ucisurvey['end_date'] = pd.to_datetime(ucalitems_ljoin_ucisurvey['end_dt'].dt.date)
+# int64 local times (ns) to a datetime column: with time zone for ONE time zone, local date time without time zone for multiple time zones
+def local_datetime(ts_ns, tz):
+    if isinstance(tz, str) or np.ndim(tz) == 0:
+        return(pd.DatetimeIndex(ts_ns.astype('datetime64[ns]')).tz_localize('UTC').tz_convert(tz))
+    valid = ts_ns != NAT
+    wall = np.full(ts_ns.shape[0], NAT, dtype=np.int64)
+    wall[valid] = local_day.local_wall_time(ts_ns[valid], tz[valid])
+    return(wall.astype('datetime64[ns]'))
 
-    ucalitems_ljoin_ucisurvey['days'] = (ucalitems_ljoin_ucisurvey['end_date']-ucalitems_ljoin_ucisurvey['start_date']).dt.days + 1
+# local day index of each timestamp, missing timestamps (NaT) get the day "missing"
+def valid_local_day(ts_ns, tz, valid, missing):
+    day = np.full(ts_ns.shape[0], missing, dtype=np.int64)
+    day[valid] = local_day.local_day(ts_ns[valid], tz if isinstance(tz, str) else tz[valid])
+    return(day)
 
-    ucalitems_ljoin_ucisurvey = ucalitems_ljoin_ucisurvey.query('days>0')
-    ucalitems_ljoin_ucisurvey.sort_values(by=['user_id', 'start_dt'], inplace=True)
-    ucalitems_ljoin_ucisurvey['id'] = range(ucalitems_ljoin_ucisurvey.shape[0])
-    ucalitems_ljoin_ucisurvey['duration_before_split'] = (ucalitems_ljoin_ucisurvey['end_dt'] - ucalitems_ljoin_ucisurvey['start_dt']) / pd.Timedelta(hours=1)
+def split_ucalitems(ucalitems_ljoin_ucisurvey, local_timezone, unix_time_unit = 'ms', min_time_stamp=0, copy_attributes=False):
     
-    # create duplicated lines for multiple days
-    split_days = pd.concat([pd.Series(r.id, pd.date_range(r.start_date, r.end_date, freq='D')) 
-                 for r in ucalitems_ljoin_ucisurvey.itertuples()]).reset_index()
-    split_days.columns = ['start_date','id']
-    split_days.sort_values(by=['id', 'start_date'], inplace=True)
-    
-    # outer join; duplicated records will have null values for many columns after the join
-    result = pd.merge(split_days, ucalitems_ljoin_ucisurvey, on=['id', 'start_date'], how='left')
-    result.sort_values(by=['id', 'start_date'], inplace=True)
-    cols = ucalitems_ljoin_ucisurvey.isna().sum()[ucalitems_ljoin_ucisurvey.isna().sum() <= 0].index.tolist()
-    cols.remove('start_dt')
-    # print(cols, len(cols), len(result.columns.tolist()))
-    result[cols]=result[cols].ffill()
-
-    # update the start and end date time of splitted days; end time set as 23:59:59, start time of the next day set as 00:00:00
-    result['diff'] = result['start_date'].dt.date - result['end_date'].dt.date
-    result.end_dt[result['start_date'].dt.date != result['end_date'].dt.date] = result['end_dt'].dt.normalize().copy() + result['diff'].copy() + pd.Timedelta(days=1) - pd.Timedelta(seconds=0.001)  
-    result.start_dt[result['start_dt'].isna()] = result['end_dt'].shift() + pd.Timedelta(seconds=0.001)
+    # preprocess before splitting days
+    # timestamps as int64 nanoseconds (UTC) and the local time zone of each calendar item
+    start_ns = pd.to_datetime(ucalitems_ljoin_ucisurvey['start_timestamp'], unit=unix_time_unit).values.view(np.int64)
+    end_ns = pd.to_datetime(ucalitems_ljoin_ucisurvey['end_timestamp'], unit=unix_time_unit).values.view(np.int64)
+
+    tz = local_timezone
+    if not isinstance(local_timezone, str):
+        tz = ucalitems_ljoin_ucisurvey['user_id'].map(local_timezone).values
+        if pd.isna(tz).any():
+            raise Exception("Sorry, local_timezone not found for user_id: {}".format(
+                ucalitems_ljoin_ucisurvey.loc[pd.isna(tz), 'user_id'].unique()))
+        ucalitems_ljoin_ucisurvey['local_timezone'] = tz
+
+    # items with a missing start or end timestamp have days = 0 (no local day), so they are dropped below
+    valid = (start_ns != NAT) & (end_ns != NAT)
+    start_day = valid_local_day(start_ns, tz, valid, 0)
+    end_day = valid_local_day(end_ns, tz, valid, -1)
+
+    ucalitems_ljoin_ucisurvey['start_dt'] = local_datetime(start_ns, tz)
+    ucalitems_ljoin_ucisurvey['end_dt'] = local_datetime(end_ns, tz)
+    ucalitems_ljoin_ucisurvey['start_date'] = np.where(valid, local_day.day2datetime(start_day), np.datetime64('NaT'))
+    ucalitems_ljoin_ucisurvey['end_date'] = np.where(valid, local_day.day2datetime(end_day), np.datetime64('NaT'))
+    ucalitems_ljoin_ucisurvey['days'] = end_day - start_day + 1
+
+    # keep items with days>0, sorted by user_id and start time
+    pos = np.flatnonzero(ucalitems_ljoin_ucisurvey['days'].values > 0)
+    all_user_codes = pd.factorize(ucalitems_ljoin_ucisurvey['user_id'].values, sort=True)[0]
+    user_codes = all_user_codes[pos]
+    pos = pos[np.lexsort((start_ns[pos], user_codes))]
+    user_codes = all_user_codes[pos]
+    all_user_codes = np.where(valid, all_user_codes, -1)  # no person day for the items with a missing timestamp
+    all_start_day = start_day
+    start_ns, end_ns, start_day, end_day = start_ns[pos], end_ns[pos], start_day[pos], end_day[pos]
+    tz = tz if isinstance(tz, str) else tz[pos]
+
+    items = ucalitems_ljoin_ucisurvey.iloc[pos].copy()
+    items['id'] = range(items.shape[0])
+    items['duration_before_split'] = (end_ns - start_ns) / 3.6e12
+    
+    # create duplicated lines for multiple days: one line per item and day, the attributes are copied from the item
+    days = items['days'].values
+    rep, piece = kernels.expand_days(days)
+    piece_day = start_day[rep] + piece
+    is_first = piece == 0
+    is_last = piece_day == end_day[rep]
+    tz = tz if isinstance(tz, str) else tz[rep]
+
+    # update the start and end date time of splitted days; end time set as 23:59:59.999, start time of the next day set as 00:00:00
+    piece_start = np.where(is_first, start_ns[rep], local_day.day_start(piece_day, tz))
+    piece_end = np.where(is_last, end_ns[rep], local_day.day_start(piece_day + 1, tz) - 10**6)
+
+    cols = ['start_date', 'id'] + [col for col in items.columns if col not in ['start_date', 'id', 'days']]
+    result = items[cols].iloc[rep].reset_index(drop=True)
+    result['start_date'] = local_day.day2datetime(piece_day)
+    result['start_dt'] = local_datetime(piece_start, tz)
+    result['end_dt'] = local_datetime(piece_end, tz)
+
+    # columns with missing values in some items are only kept for the first day of an item (see copy_attributes)
+    if not copy_attributes:
+        for col in [col for col in cols if col not in ['start_date', 'id', 'start_dt', 'end_dt'] and items[col].isna().any()]:
+            result[col] = result[col].where(is_first)
 
     # update the duration of calendar item after splitting
-    result['duration_after_split'] = (result['end_dt'] - result['start_dt']) / pd.Timedelta(hours=1)
-    result['end_date'] = result['end_dt'].dt.date
+    result['duration_after_split'] = (piece_end - piece_start) / 3.6e12
+    result['end_date'] = local_day.day2datetime(np.where(is_last, end_day[rep], piece_day))
     result['distance_after_split'] = result['duration_after_split'] / result['duration_before_split'] * result['distance']
     result['distance_after_split'] = result['distance_after_split'].fillna(0)
 
-    # print(result.isna().sum())
-    result.drop(columns = ['days', 'diff'], inplace=True)
-    result['dow'] = result['start_date'].dt.day_name()
+    result['dow'] = local_day.day2dayname(piece_day)
+
+    # integer code of each person day, also for the items before splitting (by their start day), see person_day
+    result['person_day'], ucalitems_ljoin_ucisurvey['person_day'] = person_day.person_day_codes(user_codes[rep], piece_day, all_user_codes, all_start_day)
     
-    print('# rows of original ucalitems: {0:0.0f}. # rows after splitting: {1:0.0f}'.format(ucalitems_ljoin_ucisurvey.shape[0], result.shape[0]))
-    print('# hours in  original ucalitems: {0:0.2f}. # hours after splitting: {1:0.2f}'.format(ucalitems_ljoin_ucisurvey['duration_before_split'].sum(), result['duration_after_split'].sum()))
-    print('# distance in  original ucalitems: {0:0.2f}. # distance after splitting: {1:0.2f}'.format(ucalitems_ljoin_ucisurvey['distance'].sum(), result['distance_after_split'].sum()))
+    print('# rows of original ucalitems: {0:0.0f}. # rows after splitting: {1:0.0f}'.format(items.shape[0], result.shape[0]))
+    print('# hours in  original ucalitems: {0:0.2f}. # hours after splitting: {1:0.2f}'.format(items['duration_before_split'].sum(), result['duration_after_split'].sum()))
+    print('# distance in  original ucalitems: {0:0.2f}. # distance after splitting: {1:0.2f}'.format(items['distance'].sum(), result['distance_after_split'].sum()))
     
     #for each calendar item, create labels for user interaction, set the default value for the label as 0, if satisfied, change label to 1
     #create 3 labels to select person day with user interactions: "confirm_timestamp" and "edit_timestamp"
@@ -129,13 +182,11 @@ TASKS: for each day of a given person (a.k.a. person-day), summarize
     - total counts and hours of trips
     - total counts and hours of activities
     
-OUTPUT: a day-level summary table 'day_summary' 
+OUTPUT: a day-level summary table 'day_summary' (with the column 'person_day' if the input table has the person-day codes)
 """
 
 def get_per_day_duration(df):
     
-    per_day = []
-
     mask_dict = {
     'total': ~df['user_id'].isna(), 
     'no_off': df['type_decoded'].isin(['ACTIVITY', 'TRIP']), # the same as df['subtype']!='UNKNOWN'
@@ -157,28 +208,34 @@ def get_per_day_duration(df):
     'activity_duration': df['type_decoded']=='ACTIVITY', 
     }
     
+    # sums and counts by person-day code (see person_day), one bincount per statistic
+    index = person_day.build_person_day_index(df)
+    codes = index.codes(df)
+    hours = df['duration_after_split'].values
+    days = index.days.index.values
+    result = index.attributes(days, ['user_id', 'dow', 'start_date'])
+    result['person_day'] = days
     for key, value in mask_dict.items():
-        group_cols = ['user_id', 'dow', 'start_date']
-        df_sub = df[value]
-        print(key, df_sub.shape)
-        agg_func = 'sum'
+        mask = value.values
+        print(key, (int(mask.sum()), df.shape[1]))
         if key in ['interact_with_app', 'interact_by_confirm', 'interact_by_edit', 'trip_count', 'activity_count']: 
-            agg_func = 'count'
-        per_day_duration = df_sub.groupby(group_cols).agg({'duration_after_split': agg_func})
-        per_day_duration.reset_index(inplace=True)
-        per_day_duration.rename(columns={'duration_after_split': 'hours'}, inplace=True)
-        per_day_duration['stat_type'] = key
-        per_day.append(per_day_duration)
-    
-    result = pd.concat(per_day).pivot(index=['user_id', 'dow', 'start_date'], columns='stat_type', values='hours')
-    result.reset_index(inplace=True)
-    # print(result.isna().sum())
-    result.fillna(0, inplace=True)
-    # print(result.isna().sum())
+            result[key] = index.sum(codes, mask=mask & ~np.isnan(hours))[days].astype(float)
+        else:
+            result[key] = index.sum(codes, hours, mask=mask)[days]
+
+    # the same layout as a pivot table: rows sorted by user_id, dow, start_date, statistics sorted by name
+    result = result.sort_values(by=['user_id', 'dow', 'start_date'], ignore_index=True)
+    codes = result['person_day']
+    result = result[['user_id', 'dow', 'start_date'] + sorted(mask_dict.keys())]
+    result.columns.name = 'stat_type'
     
     # create a new column to indicate whether that day (for a person) is during weekend or not
     result["IsWeekend"] = result['start_date'].dt.dayofweek > 4
     result["IsWeekend"] = result["IsWeekend"].map({True:'Weekend', False:'Weekday'})
+
+    # the person-day codes are kept for filtering the other tables (only if the split table has the codes)
+    if person_day.has_codes(df):
+        result['person_day'] = codes
     
     return(result)
 
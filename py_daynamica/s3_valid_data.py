@@ -5,19 +5,24 @@
 
 __author__ = 'Xiaohuan Zeng'
 
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+
+from py_daynamica import person_day, valid_rules
 
 """
 INPUT:  day_summary table in the data dictionary from S2_preprocess_data.py
         numerator_col <column in the table used to defined valid days, the default is 'with_subtype' - at least one activity or trip with subtype>
-        denominator_filter <days used as the baseline, the default are days with at least one confirmed OR edited item>
+        denominator_filter <days used as the baseline, the default are days with at least one confirmed OR edited item, 
+                            a query text or a rule of valid_rules>
 
 OUTPUT: table to show the count of valid days and all days
 """
 def count_valid_per_days(day_summary, numerator_col = 'with_subtype', denominator_filter = 'interact_with_app > 0'): 
     
-    df = day_summary.query(denominator_filter)
+    # masks of the denominator and days of the week are computed once (cached by rule in the evaluator)
+    evaluator = valid_rules.Evaluator(day_summary)
+    denominator = valid_rules.rule(denominator_filter)
     result_list = []
     
     # day of the week, used as the rows for the output table
@@ -30,26 +35,16 @@ def count_valid_per_days(day_summary, numerator_col = 'with_subtype', denominato
     
     for dow in dow_lsit: 
         result_item = [dow]
-        total_days = None
-        if dow=='Total': 
-            total_days = df.shape[0]
-            for threshold in threshold_list:
-                sub_days = df.query('(`{0}` >=@threshold)'.format(numerator_col)).shape[0]
-                if total_days==0:
-                    result_item.append('nan')
-                else:            
-                    sub_days_per = sub_days / total_days * 100
-                    result_item.append('{:,} ({:.1f}%)'.format(sub_days, sub_days_per))    
-        
-        else: 
-            total_days = df.query('dow==@dow').shape[0]
-            for threshold in threshold_list:
-                sub_days = df.query('(`{0}` >=@threshold)&(dow==@dow)'.format(numerator_col)).shape[0]
-                if total_days==0:
-                    result_item.append('nan')
-                else: 
-                    sub_days_per = sub_days / total_days * 100
-                    result_item.append('{:,} ({:.1f}%)'.format(sub_days, sub_days_per))
+        days = denominator if dow=='Total' else denominator & valid_rules.Threshold('dow', '==', dow)
+        total_days = evaluator.count(days)
+
+        # number of days above each threshold with ONE sort of the numerator column
+        for sub_days in evaluator.count_sweep(days, numerator_col, threshold_list, op = '>='):
+            if total_days==0:
+                result_item.append('nan')
+            else: 
+                sub_days_per = sub_days / total_days * 100
+                result_item.append('{:,} ({:.1f}%)'.format(sub_days, sub_days_per))
 
         # result_item.append('{:,}'.format(total_days))
         # result_item.append(str(int(total_days)))
@@ -64,18 +59,26 @@ def count_valid_per_days(day_summary, numerator_col = 'with_subtype', denominato
 """
 INPUT: csv_dict <data dictionary after S2 but before applying the filtering function above>,
        tb <ONE table to be filtered based on the day_summary table>, 
-       query_text <filtering condition, text expressions>, 
+       query_text <filtering condition, text expressions or a rule of valid_rules>, 
        cols <keys/columns used for merging>
+       evaluator <valid_rules.Evaluator of csv_dict['day_summary'] to reuse its cached masks, None for a new one>
        
+TASKS: if both tables have the person-day codes (see person_day) and no other column is merged, 
+       the rows are selected by the integer codes instead of merging on ['user_id', 'start_date']
+
 OUTPUT: ONE filtered table by filter condition
 """
-def query_valid_days_func(csv_dict, tb, query_text, cols = ['user_id', 'start_date']):
-    df = pd.merge(
-        left = csv_dict[tb], 
-        right = csv_dict['day_summary'].query(query_text)[cols], 
-        on = ['user_id', 'start_date'], 
-        how = 'inner'
-    )
+def query_valid_days_func(csv_dict, tb, query_text, cols = ['user_id', 'start_date'], evaluator = None):
+    days = valid_rules.select(csv_dict['day_summary'], query_text, evaluator)
+    if person_day.has_codes(csv_dict[tb], days) and (set(cols) == set(person_day.key_cols)):
+        df = csv_dict[tb][np.isin(csv_dict[tb]['person_day'].values, days['person_day'].values)].reset_index(drop=True)
+    else:
+        df = pd.merge(
+            left = csv_dict[tb], 
+            right = days[cols], 
+            on = ['user_id', 'start_date'], 
+            how = 'inner'
+        )
 
     print('Table Name: {0}. # items before filtering: {1:0.0f}. # items after filtering: {2:0.0f}'.format(tb, csv_dict[tb].shape[0], df.shape[0]))
     return(df)
@@ -83,22 +86,25 @@ def query_valid_days_func(csv_dict, tb, query_text, cols = ['user_id', 'start_da
 
 """
 INPUT: csv_dict_origin <original data dictionary after S2 but before applying the filtering function above>,
-       query_text      <filtering/selecting condition, text-based expressions>, 
+       query_text      <filtering/selecting condition, text-based expressions or a rule of valid_rules>, 
+       evaluator       <valid_rules.Evaluator of csv_dict_origin['day_summary'], e.g. kept by the caller to reuse the masks
+                        of many filtering conditions on the same day_summary, None for a new one>
 
 TASKS: call function query_valid defined above to handle multiple tables in the data dictionary using the same filtering condition
 
 OUTPUT: several filtered tables saved in a new dictionary of tables by filter condition 
 """
-def filter_valid_days(csv_dict_origin, query_text):
+def filter_valid_days(csv_dict_origin, query_text, evaluator = None):
     
     csv_dict_sub = {}  #output data dictionary with subset of records in each table in the original dictionary
     
-    # 0. day_summary filtered by query_text
-    csv_dict_sub['day_summary'] = csv_dict_origin['day_summary'].query(query_text)
+    # 0. day_summary filtered by query_text (the mask is computed once for all tables)
+    evaluator = valid_rules.Evaluator(csv_dict_origin['day_summary']) if evaluator is None else evaluator
+    csv_dict_sub['day_summary'] = valid_rules.select(csv_dict_origin['day_summary'], query_text, evaluator)
     print('# days before filtering: {0:0.0f}. # days after filtering: {1:0.0f}'.format(csv_dict_origin['day_summary'].shape[0], csv_dict_sub['day_summary'].shape[0]))
 
     # 1. ucalitems_ljoin_ucisurvey_split filtered by query_text
-    csv_dict_sub['ucalitems_ljoin_ucisurvey_split'] = query_valid_days_func(csv_dict_origin, tb='ucalitems_ljoin_ucisurvey_split', query_text=query_text)
+    csv_dict_sub['ucalitems_ljoin_ucisurvey_split'] = query_valid_days_func(csv_dict_origin, tb='ucalitems_ljoin_ucisurvey_split', query_text=query_text, evaluator=evaluator)
     csv_dict_sub['ucalitems_ljoin_ucisurvey_split']["IsWeekend"] = csv_dict_sub['ucalitems_ljoin_ucisurvey_split']['start_date'].dt.dayofweek > 4
     csv_dict_sub['ucalitems_ljoin_ucisurvey_split']["IsWeekend"] = csv_dict_sub['ucalitems_ljoin_ucisurvey_split']["IsWeekend"].map({True:'Weekend', False:'Weekday'})
     
@@ -132,7 +138,7 @@ def filter_valid_days(csv_dict_origin, query_text):
     tb_origin='ucalitems_ljoin_ucisurvey'
     tb_sub = 'ucalitems_activity'
 
-    csv_dict_sub[tb_sub] = query_valid_days_func(csv_dict_origin, tb=tb_origin, query_text=query_text)
+    csv_dict_sub[tb_sub] = query_valid_days_func(csv_dict_origin, tb=tb_origin, query_text=query_text, evaluator=evaluator)
     csv_dict_sub[tb_sub] = csv_dict_sub[tb_sub].query('(type_decoded=="ACTIVITY")&(centroid==centroid)')
     
     print('# activities with centroid_cor after filtering: {0:0.0f}.'.format(csv_dict_sub[tb_sub].shape[0]))
@@ -141,9 +147,11 @@ def filter_valid_days(csv_dict_origin, query_text):
     # Note: the table exit_survey is not included because it's not complete (only 9 records)
     # Note: the table ucalitems (trip / activity episodes) is not included because it contians episodes cross multiple days and can not be assigned to a single day. Instead, please use the saved table ucalitems_ljoin_ucisurvey for episode-level calculation.  
     # 1. ema_survey
-    csv_dict_origin['ema_survey'].rename(columns = {'ema_survey_date': 'start_date'}, inplace=True)
-    csv_dict_origin['ema_survey']['start_date'] = pd.to_datetime(csv_dict_origin['ema_survey']['start_date'])
-    csv_dict_sub['ema_survey'] = query_valid_days_func(csv_dict_origin, tb='ema_survey', query_text=query_text)
+    #    rename on a copy so that the original dictionary is not modified (filter_valid_days can be called repeatedly)
+    ema_survey = csv_dict_origin['ema_survey'].rename(columns = {'ema_survey_date': 'start_date'})
+    ema_survey['start_date'] = pd.to_datetime(ema_survey['start_date'])
+    csv_dict_sub['ema_survey'] = query_valid_days_func({'ema_survey': ema_survey, 'day_summary': csv_dict_origin['day_summary']},
+                                                       tb='ema_survey', query_text=query_text, evaluator=evaluator)
     
     # 2. calendar_item_survey
     csv_dict_sub['calendar_item_survey'] = pd.merge(
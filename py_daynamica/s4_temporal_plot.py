@@ -7,7 +7,8 @@ __author__ = 'Xiaohuan Zeng'
 
 import os
 import pandas as pd
-import plotly.express as px
+
+from py_daynamica import episode_store
 
 # configurations for plots
 
@@ -88,13 +89,76 @@ config = {
 
 
 """
-INPUT:  ucalitems_temporal_plot after filtering valid days, 
+INPUT:  df: episodes of ONE user (ucalitems_temporal_plot rows)
+
+TASKS:  create the timeline figure of the activity-trip sequences of the user
+        the activity and trip will have different heights
+        the color of the bar indicate different activity types or travel modes
+
+OUTPUT: plotly figure, None if there are no episodes
+"""
+def timeline_figure(df, 
+               color_discrete_map = color_discrete_map, 
+               pattern_shape_map = pattern_shape_map):
+    import plotly.express as px
+
+    # check if the the number of selected episodes > 0
+    if df.shape[0] == 0:
+        return(None)
+        
+    # format the date string to show on the plots
+    df = df.sort_values(by='start_dt', ignore_index=True)
+    df['Date'] = df['start_date'].astype(str) + '<br>' + df['dow'].astype(str)
+    df.sort_values(by='Date', inplace=True, ignore_index=True)
+
+    # create timeline plot
+    fig = px.timeline(df, x_start="start_time", x_end="end_time", y="Date",
+                      pattern_shape='type_decoded', color="subtype_decoded", 
+                      category_orders =  {'type_decoded': ['ACTIVITY', 'TRIP', 'DEVICE OFF'], 'subtype_decoded': list(color_discrete_map.keys())}, 
+                      color_discrete_map = color_discrete_map, 
+                      pattern_shape_map = pattern_shape_map
+                     
+                     )
+    fig.update_yaxes(categoryorder="category descending") # otherwise tasks are listed from the bottom up
+
+    # update rectangular weight and legend labels
+    for i, d in enumerate(fig.data):
+        mykey = d.name.split(', ')[1]
+
+        d.width = heigh_dict[mykey]
+        d.name = d.name.split(', ')[0]
+        d.legendgroup = mykey
+        d.legendgrouptitle= {'text': mykey}
+    
+    # update background color, legend orientation and xaxis tickformat
+    fig.update_layout(plot_bgcolor="rgba(0,0,0,0)", 
+                      legend= dict(title = {'text': ''}, orientation = 'v'), 
+                      xaxis=dict(tickformat="%H:%M", title='Time'), 
+                        autosize=False,
+                        width=1000,
+                        height=300+50*df['Date'].unique().shape[0], 
+                      font=dict(
+                        family="Calibri",
+                        size=18,  # Set the font size here
+                        color="#000000"
+                    )
+                     )
+    return(fig)
+
+
+# episodes of ONE user from ucalitems_temporal_plot or an EpisodeStore (only the episodes of the user are read)
+def user_episodes(ucalitems_temporal_plot, user_id):
+    if isinstance(ucalitems_temporal_plot, episode_store.EpisodeStore):
+        return(ucalitems_temporal_plot.load(user_id))
+    return(ucalitems_temporal_plot.query('user_id==@user_id'))
+
+
+"""
+INPUT:  ucalitems_temporal_plot after filtering valid days, or an EpisodeStore of it (only the episodes of the user are read),
         user_id: user id, commonly the email address
         directory/folder to save the plot
         
-TASKS:  create plots to show activity-trip sequences of a participant
-        the activity and trip will have different heights
-        the color of the bar indicate different activity types or travel modes
+TASKS:  create plots to show activity-trip sequences of a participant (timeline_figure)
     
 OUTPUT: plots for each individual person saved as images  (html files)
 """
@@ -103,50 +167,11 @@ def plot_indi_temp(ucalitems_temporal_plot, user_id, directory,
                pattern_shape_map = pattern_shape_map, 
                config = config):
     
-    # select the valid episodes for the user and sort by time
-    df = ucalitems_temporal_plot.query('user_id==@user_id')
-    df.sort_values(by='start_dt', inplace=True, ignore_index=True)
-
-    # check if the the number of selected episodes > 0
-    if df.shape[0]>0: 
-        
-        # format the date string to show on the plots
-        df['Date'] = df['start_date'].astype(str) + '<br>' + df['dow'].astype(str)
-        df.sort_values(by='Date', inplace=True, ignore_index=True)
-
-        # create timeline plot
-        fig = px.timeline(df, x_start="start_time", x_end="end_time", y="Date",
-                          pattern_shape='type_decoded', color="subtype_decoded", 
-                          category_orders =  {'type_decoded': ['ACTIVITY', 'TRIP', 'DEVICE OFF'], 'subtype_decoded': list(color_discrete_map.keys())}, 
-                          color_discrete_map = color_discrete_map, 
-                          pattern_shape_map = pattern_shape_map
-                         
-                         )
-        fig.update_yaxes(categoryorder="category descending") # otherwise tasks are listed from the bottom up
-
-        # update rectangular weight and legend labels
-        for i, d in enumerate(fig.data):
-            mykey = d.name.split(', ')[1]
-
-            d.width = heigh_dict[mykey]
-            d.name = d.name.split(', ')[0]
-            d.legendgroup = mykey
-            d.legendgrouptitle= {'text': mykey}
-        
-        # update background color, legend orientation and xaxis tickformat
-        fig.update_layout(plot_bgcolor="rgba(0,0,0,0)", 
-                          legend= dict(title = {'text': ''}, orientation = 'v'), 
-                          xaxis=dict(tickformat="%H:%M", title='Time'), 
-                            autosize=False,
-                            width=1000,
-                            height=300+50*df['Date'].unique().shape[0], 
-                          font=dict(
-                            family="Calibri",
-                            size=18,  # Set the font size here
-                            color="#000000"
-                        )
-                         )
+    # select the valid episodes for the user
+    df = user_episodes(ucalitems_temporal_plot, user_id)
+    fig = timeline_figure(df, color_discrete_map, pattern_shape_map)
 
+    if fig is not None: 
         # save plot as html file
         fig.write_html(os.path.join(directory, "{}.html".format(user_id)), config=config) 
         print(user_id, df.shape[0])
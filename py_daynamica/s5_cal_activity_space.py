@@ -5,15 +5,16 @@
 
 __author__ = 'Xiaohuan Zeng'
 
+import os
 import math
+import functools
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-import geopandas as gpd
 import polyline
-from pointpats.centrography import mean_center, ellipse
-from matplotlib.patches import Ellipse
-from shapely.geometry import Polygon 
+
+from py_daynamica import person_day, place_index
 
 unit_convert = 1609.34 # global paramter to convert mile to meter
 
@@ -32,29 +33,43 @@ def str2cor_tb(ucalitems, original_col = 'centroid', new_col = 'centroid_cor'):
     return(ucalitems)
 
 
+# transformer from origin_crs to projected_crs, created once for each pair of crs
+@functools.lru_cache(maxsize=None)
+def get_transformer(origin_crs, projected_crs):
+    from pyproj import Transformer
+    return(Transformer.from_crs(origin_crs, projected_crs, always_xy=True))
+
 """
 INPUT:  ucalitems_activity: all activities in the user calendar items
+        origin_crs, projected_crs: epsg codes
+        geodataframe: True to return a geodataframe with point geometry (needed by cal_convex_hull), 
+                      False to return a dataframe with x and y only (no geometry objects created)
 
-TASKS:  coordinate transformation from lat/long to x/y in meters
+TASKS:  coordinate transformation from lat/long to x/y in meters, on the coordinate arrays with a cached transformer
 
 OUTPUT: ucalitems_activity with pecified crs
 """
 
-def extract_geo_info(ucalitems_activity, origin_crs, projected_crs):
-    temp = ucalitems_activity.copy()
+def extract_geo_info(ucalitems_activity, origin_crs, projected_crs, geodataframe=True):
+    import geopandas as gpd
+
+    # new columns are added to a shallow copy, the input table is not modified
+    temp = ucalitems_activity.copy(deep=False)
     
     # get seperate lon and lat numbers from tuple of (lat, lon)
     temp['lat'] = temp['centroid_cor'].str[0]
     temp['lon'] = temp['centroid_cor'].str[1]
 
-    # dataframe to geodataframe
-    result = gpd.GeoDataFrame(temp, geometry=gpd.points_from_xy(temp.lon, temp.lat))
-    result.set_crs(epsg=origin_crs, inplace=True) # set the origin crs
-    result.to_crs(epsg=projected_crs, inplace=True) # convert to the crs with meter as unit
-
     # get the x y in meters in the new set crs
-    result['x'] = result['geometry'].x
-    result['y'] = result['geometry'].y
+    x, y = get_transformer(origin_crs, projected_crs).transform(temp['lon'].values.astype(float), temp['lat'].values.astype(float))
+
+    # dataframe to geodataframe with points in the projected crs
+    result = temp
+    if geodataframe:
+        result = gpd.GeoDataFrame(temp, geometry=gpd.points_from_xy(x, y), crs='EPSG:{}'.format(projected_crs))
+
+    result['x'] = x
+    result['y'] = y
     
     return(result)
 
@@ -69,6 +84,7 @@ TASKS:  get the geometry of the convext hull
 OUTPUT: convex hull area
 """
 def cal_convex_hull(ucalitems_activity, buffer_dis_meter, dissolve_col = ["user_id", "start_date"]):
+    import geopandas as gpd
 
     # dissove points to get convex hull
     result = ucalitems_activity.dissolve(dissolve_col).convex_hull.reset_index().set_geometry(0)
@@ -100,6 +116,7 @@ TASKS:  get the geometry of the convext hull
 OUTPUT: convex hull area
 """
 def cal_convex_hull_line_buffer(ucalitems_activity, buffer_dis_meter, dissolve_col = ["user_id", "start_date"]):
+    import geopandas as gpd
 
     # dissove points to get convex hull
     result = ucalitems_activity.dissolve(dissolve_col).convex_hull.reset_index().set_geometry(0)
@@ -131,7 +148,8 @@ INPUT:  ucalitems_activity
 OUTPUT: Standard Deviational Ellipse (SDE)
 """
 # cal standard deviation ellipse by group, each group is one person one day
-def cal_sde_group(group):
+# (the functions of pointpats, matplotlib and shapely are imported once by cal_sde)
+def cal_sde_group(group, mean_center, ellipse, Ellipse, Polygon):
     points = group[['x', 'y']] # get points
     sx, sy, theta = ellipse(points) # cal parameters for ellipse
     theta_degree = np.degrees(theta) # convert theta to degree
@@ -152,10 +170,14 @@ def cal_sde_group(group):
 
 
 def cal_sde(ucalitems_activity, convex_hull, buffer_dis_meter, group_cols = ["user_id", "start_date"]): 
+    import geopandas as gpd
+    from pointpats.centrography import mean_center, ellipse
+    from matplotlib.patches import Ellipse
+    from shapely.geometry import Polygon
 
     # cal sde by group and dataframe to geo dataframe (using the same crs as input table)
     grouped = ucalitems_activity.groupby(group_cols)
-    temp = grouped.apply(cal_sde_group)
+    temp = grouped.apply(cal_sde_group, mean_center=mean_center, ellipse=ellipse, Ellipse=Ellipse, Polygon=Polygon)
     temp.reset_index(inplace=True)
     temp = gpd.GeoDataFrame(temp, geometry='geometry')
     temp.set_crs(epsg=ucalitems_activity.crs.to_epsg(), inplace=True)
@@ -185,5 +207,165 @@ def cal_sde(ucalitems_activity, convex_hull, buffer_dis_meter, group_cols = ["us
     
     return(result)
 
+"""
+INPUT:  ucalitems_activity: activities items after coordinate transformation (x, y in meters)
+        place_radius_meter: distance to cluster activities into places (place_index.cluster_places)
+
+TASKS:  mobility metrics of each person-day, computed together on the x / y arrays sorted ONCE by person-day and start time,
+        with segmented reductions (bincount by person-day), no groupby apply:
+        - radius of gyration: root mean square distance of the activities to their mean point
+        - path length: sum of the straight-line distances between consecutive activities of the day
+        - max distance from home: home is the place with most HOME activities of the user (the most visited place
+          if there is no HOME activity), see place_index.PlaceIndex
+        - distinct places: number of places (place_index.cluster_places) visited during the day
+        activities without coordinates are skipped
+
+OUTPUT: one row per person-day: user_id, start_date, points, radius_gyration_meter, path_length_meter, max_home_distance_meter,
+        distinct_places, and the distances in miles ('_mile')
+"""
+def cal_mobility_metrics(ucalitems_activity, place_radius_meter = 100):
+    # only the columns used below (no geometry), so that no geodataframe is copied
+    cols = ['user_id', 'start_date', 'start_dt', 'subtype_decoded', 'x', 'y'] + (['person_day'] if person_day.has_codes(ucalitems_activity) else [])
+    ucalitems_activity = pd.DataFrame({col: ucalitems_activity[col].values for col in cols})
+    place_code, places = place_index.cluster_places(ucalitems_activity, radius_meter=place_radius_meter)
+    row, days = person_day.factorize_person_days(ucalitems_activity)
+    valid = place_code >= 0
+    n_days = days.shape[0]
+
+    # sort the activities with coordinates by person-day and start time
+    start_ns = ucalitems_activity['start_dt'].values.astype('datetime64[ns]').view(np.int64)
+    order = np.flatnonzero(valid)
+    order = order[np.lexsort((start_ns[order], row[order]))]
+    day, place = row[order], place_code[order]
+    x = ucalitems_activity['x'].values.astype(float)[order]
+    y = ucalitems_activity['y'].values.astype(float)[order]
+    sums = lambda weights: np.bincount(day, weights=weights, minlength=n_days)
+
+    n = np.bincount(day, minlength=n_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # radius of gyration around the mean point of the day
+        dx, dy = x - (sums(x) / n)[day], y - (sums(y) / n)[day]
+        radius = np.sqrt(sums(dx * dx + dy * dy) / n)
+
+    # path length: steps between consecutive activities of the same day
+    step = np.hypot(np.diff(x), np.diff(y))
+    same_day = day[1:] == day[:-1]
+    path = np.bincount(day[1:][same_day], weights=step[same_day], minlength=n_days)
+
+    # max distance from home (the home place of the user of each activity)
+    home = places.sort_values(by=['home_visits', 'visits'], ascending=False, kind='mergesort').drop_duplicates('user_id').set_index('user_id')
+    home_xy = home[['x', 'y']].reindex(ucalitems_activity['user_id'].values[order]).values
+    max_home = np.full(n_days, np.nan)
+    if day.shape[0] > 0:
+        np.fmax.at(max_home, day, np.hypot(x - home_xy[:, 0], y - home_xy[:, 1]))
+
+    # distinct places: unique (person-day, place) pairs
+    pairs = np.unique(day.astype(np.int64) * (places.shape[0] + 1) + place)
+    distinct = np.bincount(pairs // (places.shape[0] + 1), minlength=n_days)
+
+    result = days[['user_id', 'start_date']].copy()
+    result['points'] = n
+    result['radius_gyration_meter'] = np.where(n > 0, radius, np.nan)
+    result['path_length_meter'] = np.where(n > 0, path, np.nan)
+    result['max_home_distance_meter'] = max_home
+    result['distinct_places'] = distinct
+    for col in ['radius_gyration', 'path_length', 'max_home_distance']:
+        result[col + '_mile'] = result[col + '_meter'] / unit_convert
+
+    print('# activities: {0:0.0f}. # activities with coordinates: {1:0.0f}. # person-days: {2:0.0f}'.format(valid.shape[0], order.shape[0], n_days))
+    return(result)
+
+
+"""
+INPUT:  ucalitems_activity: activities items after coordinate transformation
+        n_chunks: number of chunks of person-days
+
+OUTPUT: chunk number of each activity, person-days are split into chunks with similar number of points
+        (person-days sorted by number of points and dealt to the chunks back and forth)
+"""
+def person_day_chunks(ucalitems_activity, n_chunks, group_cols = ["user_id", "start_date"]):
+    if group_cols == person_day.key_cols:
+        group_id = person_day.factorize_person_days(ucalitems_activity)[0]
+    else:
+        group_id = ucalitems_activity.groupby(group_cols).ngroup().values
+    sizes = np.bincount(group_id)
+
+    order = np.argsort(-sizes, kind='stable')
+    rank = np.arange(order.shape[0])
+    chunk = np.where((rank // n_chunks) % 2 == 0, rank % n_chunks, n_chunks - 1 - rank % n_chunks)
+    group_chunk = np.empty(order.shape[0], dtype=np.int64)
+    group_chunk[order] = chunk
+    
+    return(group_chunk[group_id])
+
+# compute all activity space tables for ONE chunk of person-days, run in the worker processes
+# columns of the activity space tables (geometry columns: 'geometry', 'buffer'), for empty results
+activity_space_columns = {
+    'convex_hull': ['user_id', 'start_date', 'geometry', 'buffer', 'area_meter', 'area_mile', 'len_meter', 'geometry_type'],
+    'sde': ['user_id', 'start_date', 'geometry', 'sx_meter', 'sy_meter', 'theta', 'theta_degree', 'geometry_type', 'len_meter',
+            'sx_mile', 'sy_mile', 'area_mile'],
+    'convex_hull_line_buffer': ['user_id', 'start_date', 'geometry', 'geometry_type', 'len', 'area_meter', 'area_mile'],
+}
+
+# empty activity space tables (no activity with coordinates)
+def empty_activity_space(crs, line_buffer=False):
+    import geopandas as gpd
+
+    result = {}
+    for key in ['convex_hull', 'sde'] + (['convex_hull_line_buffer'] if line_buffer else []):
+        df = pd.DataFrame({col: pd.Series(dtype=float) for col in activity_space_columns[key]})
+        df['user_id'], df['start_date'], df['geometry_type'] = df['user_id'].astype(object), df['start_date'].astype('datetime64[ns]'), df['geometry_type'].astype(object)
+        for col in ['geometry', 'buffer']:
+            if col in df.columns:
+                df[col] = gpd.GeoSeries([], crs=crs)
+        result[key] = gpd.GeoDataFrame(df, geometry='geometry', crs=crs)
+    return(result)
+
+def cal_activity_space_chunk(ucalitems_activity, buffer_dis_meter, line_buffer):
+    result = {}
+    result['convex_hull'] = cal_convex_hull(ucalitems_activity, buffer_dis_meter)
+    result['sde'] = cal_sde(ucalitems_activity, result['convex_hull'], buffer_dis_meter)
+    if line_buffer:
+        result['convex_hull_line_buffer'] = cal_convex_hull_line_buffer(ucalitems_activity, buffer_dis_meter)
+    return(result)
+
+
+"""
+INPUT:  ucalitems_activity: activities items after coordinate transformation
+        buffer_dis_meter: buffer distance in meters
+        n_workers: number of worker processes, the default is the number of cpus; 1 to run in the current process
+        n_chunks: number of chunks of person-days, the default is 4 chunks per worker
+        line_buffer: True to also calculate 'convex_hull_line_buffer' (cal_convex_hull_line_buffer)
+
+TASKS:  split person-days into balanced chunks by number of points
+        calculate convex hull, buffer and SDE of each chunk in a pool of worker processes
+
+OUTPUT: a dictionary of tables 'convex_hull', 'sde' (and 'convex_hull_line_buffer'), the same as calling the functions above
+        (empty tables if there is no activity)
+"""
+def cal_activity_space(ucalitems_activity, buffer_dis_meter, n_workers=None, n_chunks=None, line_buffer=False):
+    n_workers = n_workers or os.cpu_count() or 1
+    n_chunks = n_chunks or n_workers * 4
+    
+    if ucalitems_activity.shape[0] == 0:
+        return(empty_activity_space(getattr(ucalitems_activity, 'crs', None), line_buffer))
+    if n_workers == 1:
+        return(cal_activity_space_chunk(ucalitems_activity, buffer_dis_meter, line_buffer))
+
+    chunk = person_day_chunks(ucalitems_activity, n_chunks)
+    chunks = [ucalitems_activity[chunk == i] for i in range(n_chunks) if (chunk == i).any()]
+    print('# activities: {0:0.0f}. # chunks: {1:0.0f}. # workers: {2:0.0f}'.format(chunk.shape[0], len(chunks), n_workers))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        chunk_results = list(executor.map(cal_activity_space_chunk, chunks, [buffer_dis_meter] * len(chunks), [line_buffer] * len(chunks)))
+
+    # combine the chunks in the same order as the serial functions (sorted by user and date)
+    result = {}
+    for key in chunk_results[0].keys():
+        df = pd.concat([item[key] for item in chunk_results])
+        result[key] = df.sort_values(by=["user_id", "start_date"], kind='mergesort', ignore_index=True)
+    
+    return(result)
+
 if __name__=='__main__':
     pass
\ No newline at end of file
@@ -7,7 +7,8 @@ __author__ = 'Xiaohuan Zeng'
 
 import numpy as np
 import pandas as pd
-from functools import reduce
+
+from py_daynamica import kernels, person_day, sketches
 
 """
 INPUT:  ucalitems_temporal_plot after filtering valid days,
@@ -22,56 +23,65 @@ OUTPUT: trips with trip legs merged into a single item
 def leg2trip(ucalitems_temporal_plot):
     
     # create a new id for complete trips composed of legs, i.e., the new id increases only if the the next episode type changed to activity 
+    # the items of a person day are contiguous after sorting, so the previous type is taken from the previous row of the same person day
     temp = ucalitems_temporal_plot.sort_values(by=['user_id', 'start_dt'])
-    temp['type_decoded_pre'] = temp.groupby(['user_id', 'start_date'])['type_decoded'].shift()
-    temp['flag'] = (temp['type_decoded']!='TRIP') | (temp['type_decoded_pre']!='TRIP')
-    temp['leg2tripid'] = temp['flag'].cumsum()
-    
-    # agg to get the sum for each subtype in a complete trip
-    duration_sum = temp.groupby(['user_id', 'start_date', 'leg2tripid', 'subtype_decoded']).agg({'distance_after_split': 'sum'}).reset_index()
+    if person_day.has_codes(temp):
+        day_codes = temp['person_day'].values
+    else:
+        new_day = (temp['user_id'].values[1:] != temp['user_id'].values[:-1]) | (temp['start_date'].values[1:] != temp['start_date'].values[:-1])
+        day_codes = np.cumsum(np.concatenate([[False], new_day]))
+    leg2tripid, flag = kernels.trip_ids(temp['type_decoded'].values == 'TRIP', day_codes)
+    temp['leg2tripid'] = leg2tripid
+
+    # leg2tripid is unique across person days and increases with user_id and start_date, 
+    # so complete trips are grouped by leg2tripid only (integer keys) and sorted as by ['user_id', 'start_date', 'leg2tripid']
+    key_cols = ['user_id', 'start_date', 'leg2tripid']
     
-    # keep the longest leg in a complete trip and removing all other records
-    leg2trip_index = duration_sum.groupby(['user_id', 'start_date', 'leg2tripid'])['distance_after_split'].idxmax()
-    longest_type = duration_sum.loc[leg2trip_index].reset_index(drop=True).drop(columns='distance_after_split')
+    # keep the subtype of the longest leg in a complete trip (largest sum of distances by subtype, see kernels.longest_leg)
+    subtype_codes, subtypes = pd.factorize(temp['subtype_decoded'], sort=True)
+    longest = kernels.longest_leg(leg2tripid, subtype_codes, temp['distance_after_split'].values, subtypes.shape[0])
+    longest_type = pd.DataFrame({'subtype_decoded': subtypes.take(longest, fill_value=np.nan)},
+                                index=pd.Index(np.arange(1, longest.shape[0] + 1), name='leg2tripid'))
     
     # agg to get other attributes
-    other_attributes = temp.groupby(['user_id', 'start_date', 'leg2tripid']).agg({'distance_after_split': 'sum',
-                                                     'duration_after_split': 'sum', 
-                                                     'start_timestamp': 'first', 
-                                                     'end_timestamp': 'last', 
-                                                     'type_decoded': 'first', 
-                                                     'survey_not_null': 'max', 
-                                                     'start_dt': 'first', 
-                                                     'end_dt': 'last', 
-                                                     'end_date': 'last', 
-                                                     'dow': 'first', 
-                                                     'IsWeekend': 'first', 
-                                                     'start_time': 'first', 
-                                                     'end_time': 'last', 
-                                                     'id': 'first'}).reset_index()
-    
-    
+    agg_funcs = {'user_id': 'first', 
+                 'start_date': 'first', 
+                 'distance_after_split': 'sum',
+                 'duration_after_split': 'sum', 
+                 'start_timestamp': 'first', 
+                 'end_timestamp': 'last', 
+                 'type_decoded': 'first', 
+                 'survey_not_null': 'max', 
+                 'start_dt': 'first', 
+                 'end_dt': 'last', 
+                 'end_date': 'last', 
+                 'dow': 'first', 
+                 'IsWeekend': 'first', 
+                 'start_time': 'first', 
+                 'end_time': 'last', 
+                 'id': 'first'}
+    other_attributes = temp.groupby('leg2tripid').agg(agg_funcs)
     
     # keep segments attributes
-    segment_temp = temp[['user_id', 'start_date', 'leg2tripid', 'subtype_decoded', 'distance_after_split', 'duration_after_split']].copy()
+    segment_temp = temp[['leg2tripid', 'subtype_decoded', 'distance_after_split', 'duration_after_split']].copy()
     segment_temp['subtype_decoded'] = segment_temp['subtype_decoded'].replace(' ', '')
     segment_temp['duration_after_split'] = (segment_temp['duration_after_split'] * 60).apply(np.ceil).astype(int).astype(str)
     segment_temp['distance_after_split'] = segment_temp['distance_after_split'].apply(np.ceil).astype(int).astype(str)
     
-    segment_attributes = []
-    for col in  ['subtype_decoded', 'duration_after_split', 'distance_after_split']: 
-        segment_attributes.append(segment_temp.groupby(['user_id', 'start_date', 'leg2tripid'])[col].apply('_'.join).reset_index())
-    
-    segment_attributes_df = reduce(lambda x, y: pd.merge(x, y, how='inner',  on = ['user_id', 'start_date', 'leg2tripid']), segment_attributes)
+    segment_cols = ['subtype_decoded', 'duration_after_split', 'distance_after_split']
+    # one function per column: a column that cannot be joined raises an error instead of being dropped
+    segment_attributes_df = segment_temp.groupby('leg2tripid').agg({col: '_'.join for col in segment_cols})
     segment_attributes_df.rename(columns = {
         'subtype_decoded': 'segment_subtype', 
         'duration_after_split': 'segment_duration_minute', 
         'distance_after_split': 'segment_distance_meter', 
     }, inplace=True)
     
-    # merge tables to get results
-    result = reduce(lambda x, y: pd.merge(x, y, how='inner',  on = ['user_id', 'start_date', 'leg2tripid']), 
-                   [longest_type, other_attributes, segment_attributes_df])
+    # join tables (all indexed by leg2tripid) to get results
+    result = pd.concat([longest_type, other_attributes, segment_attributes_df], axis=1).reset_index()
+    result = result[key_cols + [col for col in result.columns if col not in key_cols]]
+    if person_day.has_codes(temp):
+        result['person_day'] = temp['person_day'].values[flag]  # first item of each complete trip
     
     print('# rows before leg2trip: {}. # rows after leg2trip: {}'.format(str(temp.shape[0]), str(result.shape[0])))
     
@@ -79,12 +89,13 @@ def leg2trip(ucalitems_temporal_plot):
 
 """
 INPUT:  csv dict with selected valid dates
+        if csv dict has the table 'subtype_cube' (s7_summary_subtype.build_subtype_cube), 
+        the trip and activity summaries are rolled up from the cube instead of the episodes
 
-OUTPUT: pandas dataframe with 'Median', 'Mean', 'SD', 'Min', 'Max' values for 
-        trip, activity counts, duration, distance, activity space measures
+OUTPUT: long table of person-day values (column 'value') of each statistic, with user_id, start_date, Statistics, dow, IsWeekend
 
 """
-def overview_statistics(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics']): 
+def per_day_statistics(csv_dict): 
     per_day = []
 
     # groupby person_day
@@ -96,6 +107,13 @@ def overview_statistics(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'])
                  ['sde', 'sx_mile', '91_Ellipse semi-major Axis (Miles)'], 
                 ['sde', 'sy_mile', '92_Ellipse semi-minor Axis (Miles)']]
     
+    # mobility metrics by person_day (s5_cal_activity_space.cal_mobility_metrics), if the table is in the csv dict
+    if 'mobility' in csv_dict:
+        agg_list0 = agg_list0 + [['mobility', 'radius_gyration_mile', '93_Radius of Gyration (Miles)'], 
+                                 ['mobility', 'path_length_mile', '94_Path Length between Activities (Miles)'], 
+                                 ['mobility', 'max_home_distance_mile', '95_Max Distance from Home (Miles)'], 
+                                 ['mobility', 'distinct_places', '96_Distinct Places per Day']]
+    
     for item in agg_list0:
         per_day_duration = csv_dict[item[0]].copy()[['user_id', 'start_date', item[1]]].copy()
         per_day_duration.rename(columns={item[1]: 'value'}, inplace=True)
@@ -124,12 +142,32 @@ def overview_statistics(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'])
         
         tb = item[-1]
         types = item[0]
-        df_sub = csv_dict[tb].query("type_decoded==@types")    
-
-        per_day_item = df_sub.groupby(group_cols).agg({item[1]: item[2]})
-        per_day_item.reset_index(inplace=True)
-        per_day_item.rename(columns={item[1]: 'value'}, inplace=True)
-        per_day_item = pd.merge(left=per_day_item, right=per_day_duration[['user_id', 'start_date']], on=['user_id', 'start_date'], how='right')
+        agg_func = item[2]
+        if 'subtype_cube' in csv_dict:
+            # roll up the subtype cube instead of the episodes, the count 'id' is summed
+            cube = csv_dict['subtype_cube']
+            df_sub = cube[(cube['source']==('complete' if tb=='leg2trip' else 'segment')) & (cube['type_decoded']==types)]
+            agg_func = 'sum'
+        else:
+            df_sub = csv_dict[tb].query("type_decoded==@types")    
+
+        if person_day.has_codes(df_sub, csv_dict['day_summary']):
+            # sum (count) by person-day code, read at the codes of the days of day_summary
+            day_codes = csv_dict['day_summary']['person_day'].values
+            codes = df_sub['person_day'].values
+            size = max(day_codes.max(initial=-1), codes.max(initial=-1)) + 1
+            values = df_sub[item[1]].values
+            if agg_func == 'sum':
+                per_day_value = person_day.sum_by_code(codes, values, size=size)
+            else:
+                per_day_value = person_day.sum_by_code(codes, mask=pd.notna(values), size=size)
+            per_day_item = per_day_duration[['user_id', 'start_date']].reset_index(drop=True)
+            per_day_item['value'] = per_day_value[day_codes]
+        else:
+            per_day_item = df_sub.groupby(group_cols).agg({item[1]: agg_func})
+            per_day_item.reset_index(inplace=True)
+            per_day_item.rename(columns={item[1]: 'value'}, inplace=True)
+            per_day_item = pd.merge(left=per_day_item, right=per_day_duration[['user_id', 'start_date']], on=['user_id', 'start_date'], how='right')
 
         per_day_item['value'] = per_day_item['value'].fillna(0)
         per_day_item['value'] = per_day_item['value']*item[3]
@@ -145,9 +183,44 @@ def overview_statistics(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'])
     per_day_df['dow_num'] = per_day_df['date_new'].dt.dayofweek
     per_day_df['dow'] = per_day_df['date_new'].dt.day_name()
     per_day_df['IsWeekend'] = per_day_df['date_new'].dt.dayofweek > 4
+
+    return(per_day_df)
+
+
+"""
+INPUT:  csv dict with selected valid dates (see per_day_statistics), e.g. the tables of one shard of users
+        stat_group_cols, compression <see sketches.StatisticsSketch>
+
+OUTPUT: a StatisticsSketch of the person-day values, to be merged with the sketches of other shards (sketch.merge)
+        and summarized with format_statistics(sketch.summary(), stat_group_cols)
+"""
+def overview_sketch(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'], compression = 200):
+    return(sketches.StatisticsSketch(stat_group_cols, compression=compression).update(per_day_statistics(csv_dict)))
+
+
+"""
+INPUT:  csv dict with selected valid dates
+        if csv dict has the table 'subtype_cube' (s7_summary_subtype.build_subtype_cube), 
+        the trip and activity summaries are rolled up from the cube instead of the episodes
+        backend <'exact' to compute on all person-day values, 'sketch' to use mergeable sketches in constant memory 
+                 (exact mean, SD, min, max, approximate median for large groups)>
+
+OUTPUT: pandas dataframe with 'Median', 'Mean', 'SD', 'Min', 'Max' values for 
+        trip, activity counts, duration, distance, activity space measures
+
+"""
+def overview_statistics(csv_dict, stat_group_cols = ['IsWeekend', 'Statistics'], backend = 'exact'): 
     
     # summarize the median, mean, std, min, max
-    result = per_day_df.groupby(stat_group_cols)['value'].agg(['median', 'mean', np.std, 'min', 'max']).reset_index()
+    if backend == 'sketch':
+        result = overview_sketch(csv_dict, stat_group_cols).summary()
+    else:
+        result = per_day_statistics(csv_dict).groupby(stat_group_cols)['value'].agg(['median', 'mean', np.std, 'min', 'max']).reset_index()
+    return(format_statistics(result, stat_group_cols))
+
+
+# rename the statistics and columns of the summary table (median, mean, std, min, max by stat_group_cols)
+def format_statistics(result, stat_group_cols = ['IsWeekend', 'Statistics']):
     # rename the description for the statistics
     result['Statistics'] = result['Statistics'].str.split('_').str[1]
     
@@ -9,11 +9,7 @@ import os
 import numpy as np
 import pandas as pd
 
-import seaborn as sns
-import matplotlib.pyplot as plt
-import xlsxwriter
-
-from py_daynamica import s3_valid_data, s6_daily_episode_summary
+from py_daynamica import s3_valid_data, s6_daily_episode_summary, episode_store, person_day, valid_rules
 
 unit_convert = 1609.344  # global paramter to convert between miles and meters
 
@@ -88,39 +84,112 @@ agg_dict = {
 
 # get the number of valid days by all days, weekend, weekday
 def get_valid_days(day_summary, trip_count=-1):
-    df = day_summary.query('trip_count>@trip_count')
+    evaluator = valid_rules.Evaluator(day_summary)
+    days = valid_rules.Threshold('trip_count', '>', trip_count)
     valid_days_count = {}
-    valid_days_count['All Days'] = df.shape[0]
-    valid_days_count['Weekend'] = df.query('IsWeekend=="Weekend"').shape[0]
-    valid_days_count['Weekday'] = df.query('IsWeekend=="Weekday"').shape[0]
+    valid_days_count['All Days'] = evaluator.count(days)
+    valid_days_count['Weekend'] = evaluator.count(days & valid_rules.Threshold('IsWeekend', '==', 'Weekend'))
+    valid_days_count['Weekday'] = evaluator.count(days & valid_rules.Threshold('IsWeekend', '==', 'Weekday'))
     
     print(valid_days_count)
     return(valid_days_count)
 
+# keys to group episodes by person day and subtype, the integer person-day codes if the table has them (see person_day)
+def person_day_subtype_keys(df):
+    if person_day.has_codes(df):
+        return(['person_day', 'IsWeekend', 'subtype_decoded'])
+    return(['user_id', 'IsWeekend', 'start_date', 'subtype_decoded'])
+
+
+# keys and measures of the person-day x subtype cube
+cube_keys = ['user_id', 'start_date', 'dow', 'IsWeekend', 'type_decoded', 'subtype_decoded']
+cube_measures = {'id': 'count', 'duration_after_split': 'sum', 'distance_after_split': 'sum'}
+
+"""
+INPUT:  ucalitems_temporal_plot (trip segments), leg2trip (complete trips) after filtering valid days
+
+TASKS:  aggregate episodes ONCE by person day, type and subtype: count ('id'), hours ('duration_after_split'), meters ('distance_after_split')
+        the column 'source' is 'segment' for ucalitems_temporal_plot and 'complete' for leg2trip
+
+OUTPUT: the subtype cube; the tables and figures below accept it (parameter cube) instead of the episodes, 
+        the measures of the cube are summed in all roll-ups (the count 'id' too)
+"""
+def subtype_cube(ucalitems, source='segment'):
+    # dropna=False: episodes with a missing subtype (or other key) are kept, as in the summaries of the episodes
+    result = ucalitems.groupby(cube_keys, dropna=False).agg(cube_measures).reset_index()
+    result['source'] = source
+    return(result)
+
+def build_subtype_cube(ucalitems_temporal_plot, leg2trip=None):
+    cubes = [subtype_cube(ucalitems_temporal_plot, 'segment')]
+    if leg2trip is not None:
+        cubes.append(subtype_cube(leg2trip, 'complete'))
+    result = pd.concat(cubes, ignore_index=True)
+    print('# rows of subtype cube: {}. # episodes: {}'.format(result.shape[0], ucalitems_temporal_plot.shape[0] + (0 if leg2trip is None else leg2trip.shape[0])))
+    return(result)
+
+"""
+INPUT:  cube <output of build_subtype_cube>
+        by <keys of the cube to keep, e.g. ['IsWeekend', 'subtype_decoded']>
+        source <'segment' or 'complete'>
+        types, subtypes, day_type ('Weekday' or 'Weekend'), users <optional slices, None for all>
+
+OUTPUT: the measures summed by the columns "by"
+"""
+def cube_rollup(cube, by, source='segment', types=None, subtypes=None, day_type=None, users=None):
+    mask = cube['source'] == source
+    if types is not None:
+        mask &= cube['type_decoded'].isin(np.atleast_1d(types))
+    if subtypes is not None:
+        mask &= cube['subtype_decoded'].isin(np.atleast_1d(subtypes))
+    if day_type is not None:
+        mask &= cube['IsWeekend'] == day_type
+    if users is not None:
+        mask &= cube['user_id'].isin(np.atleast_1d(users))
+    return(cube[mask].groupby(by)[list(cube_measures.keys())].sum().reset_index())
+
+# rows of the cube for the table ucalitems, aggregated as the episodes (the count 'id' is summed)
+def cube_source(cube, source):
+    return(cube[cube['source'] == source], {col: 'sum' for col in cube_measures.keys()})
+
+# source of the cube rows that replace the table ucalitems: source if given, otherwise 'complete' for leg2trip
+# (the table with the column leg2tripid) and 'segment' for the trip legs (or no table)
+def episode_source(ucalitems, source=None):
+    if source is not None:
+        return(source)
+    return('complete' if (ucalitems is not None) and ('leg2tripid' in ucalitems.columns) else 'segment')
+
 """
 INPUT: ucalitems
     day_summary
     mytype: 'trip' or 'activity'
     trip_count: -1 to include all days, 0 to include the days with >0 trips
+    cube: subtype cube (build_subtype_cube) to use instead of ucalitems, 
+    source: 'segment' or 'complete' rows of the cube, None for the rows of ucalitems (see episode_source)
 OUTPUT: a table to summarize the duration (and distance) by subtypes
 
 """
-def activity_trip_subtype(ucalitems, day_summary, mytype, trip_count=-1): 
+def activity_trip_subtype(ucalitems, day_summary, mytype, trip_count=-1, cube=None, source=None): 
     valid_days_count = get_valid_days(day_summary, trip_count = trip_count)
     
-    # select episodes of trips or activities
+    # select episodes (or cube rows) of trips or activities
+    agg_funcs = agg_dict[mytype]
+    if cube is not None:
+        ucalitems, agg_funcs = cube_source(cube, episode_source(ucalitems, source))
+        agg_funcs = {col: agg_funcs[col] for col in agg_dict[mytype].keys()}
     df = ucalitems.query('type_decoded==@mytype')
     # print(df.shape)
     
-    # convert the unit, hour for activity, minutes and miles for trips,
-    df['duration_after_split'] = df['duration_after_split'].copy()*duration_unit[mytype]
-    df['distance_after_split'] = df['distance_after_split'] / unit_convert 
-    
     # groupby and aggregate
-    df = df.groupby(['user_id', 'IsWeekend', 'start_date', 'subtype_decoded']).agg(agg_dict[mytype])
+    df = df.groupby(person_day_subtype_keys(df)).agg(agg_funcs)
     df.reset_index(inplace=True)
     cols = list(agg_dict[mytype].keys())
     
+    # convert the unit, hour for activity, minutes and miles for trips,
+    df['duration_after_split'] = df['duration_after_split']*duration_unit[mytype]
+    if 'distance_after_split' in df.columns:
+        df['distance_after_split'] = df['distance_after_split'] / unit_convert 
+    
     # calculate mean for all days of a week, weekends, and weekdays
     result = []
     for key, value in valid_days_count.items():
@@ -165,13 +234,20 @@ INPUT:  ucalitems: can the the table before or after leg2trip
         directory: the folder to save the figure
         agg_col: id, duration or distance
         agg_func: count (id) or sum (duration or distance)
+        cube: subtype cube (build_subtype_cube) to use instead of ucalitems, the rows are selected by tb
 
 OUTPUT: a figure to summarize the duration (and distance) by subtypes
 
 """
-def activity_trip_subtype_figure(ucalitems, tb, day_summary, mytype, directory, agg_col, agg_func): 
+def activity_trip_subtype_figure(ucalitems, tb, day_summary, mytype, directory, agg_col, agg_func, cube=None): 
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
     valid_days_count = get_valid_days(day_summary)
     
+    if cube is not None:
+        ucalitems, agg_funcs = cube_source(cube, 'complete' if tb=='leg2trip' else 'segment')
+        agg_func = agg_funcs[agg_col]
     df = ucalitems.copy()
 
     # reclassify the subtype and type
@@ -184,14 +260,15 @@ def activity_trip_subtype_figure(ucalitems, tb, day_summary, mytype, directory,
     
     df = df.query('type_decoded==@mytype')
     
-    # print(df.shape)
-    # convert the unit, hour for activity, minutes and miles for trips,
-    df['duration_after_split'] = df['duration_after_split'].copy()*duration_unit[mytype]
-    df['distance_after_split'] = df['distance_after_split'] / 1609.344 
-
     # groupby and aggregate
-    df = df.groupby(['user_id', 'IsWeekend', 'start_date', 'subtype_decoded']).agg({agg_col: agg_func})
+    df = df.groupby(person_day_subtype_keys(df)).agg({agg_col: agg_func})
     df.reset_index(inplace=True)
+
+    # convert the unit, hour for activity, minutes and miles for trips,
+    if agg_col == 'duration_after_split':
+        df[agg_col] = df[agg_col]*duration_unit[mytype]
+    elif agg_col == 'distance_after_split':
+        df[agg_col] = df[agg_col] / 1609.344 
     new_agg_col = col_dict_final[mytype][agg_col]
     df.rename(columns = {agg_col: new_agg_col}, inplace=True)
     
@@ -305,6 +382,9 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
     print(csv_dict['ucalitems_ljoin_ucisurvey_split'].shape, 
           csv_dict_sub['ucalitems_ljoin_ucisurvey_split'].shape)
 
+    # aggregate episodes once, all tables and figures below are rolled up from the cube
+    cube = build_subtype_cube(csv_dict_sub['ucalitems_temporal_plot'], csv_dict_sub['leg2trip'])
+
     # summary tables
     subtype_confirmed_hours = s3_valid_data.count_valid_per_days(day_summary = csv_dict['day_summary'], 
                                                                  numerator_col = 'with_subtype', 
@@ -312,20 +392,24 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
     survey_answered_hours = s3_valid_data.count_valid_per_days(day_summary = csv_dict['day_summary'], 
                                                                numerator_col = 'with_survey', 
                                                                denominator_filter = '(interact_by_confirm>0)&(with_subtype>=(12-0.1))')
-    daily_summary = s6_daily_episode_summary.overview_statistics(csv_dict = csv_dict_sub, 
+    daily_summary = s6_daily_episode_summary.overview_statistics(csv_dict = dict(csv_dict_sub, subtype_cube=cube), 
                                                                  stat_group_cols = ['Statistics'])
     activity = activity_trip_subtype(ucalitems=csv_dict_sub['ucalitems_temporal_plot'], 
                                          day_summary=csv_dict_sub['day_summary'], 
                                          mytype='ACTIVITY', 
-                                         trip_count=-1)
+                                         trip_count=-1, 
+                                         cube=cube)
     trip = activity_trip_subtype(ucalitems=csv_dict_sub['ucalitems_temporal_plot'], 
                                          day_summary=csv_dict_sub['day_summary'], 
                                          mytype='TRIP', 
-                                         trip_count=-1)
+                                         trip_count=-1, 
+                                         cube=cube)
     complete_trip = activity_trip_subtype(ucalitems=csv_dict_sub['leg2trip'], 
                                          day_summary=csv_dict_sub['day_summary'], 
                                          mytype='TRIP', 
-                                         trip_count=-1)
+                                         trip_count=-1, 
+                                         cube=cube, 
+                                         source='complete')
     
     # write to excel and format
     writer = pd.ExcelWriter(r'{}\tables.xlsx'.format(directory), engine='xlsxwriter')
@@ -347,7 +431,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='ACTIVITY', 
                              directory=directory, 
                              agg_col='duration_after_split', 
-                             agg_func='sum')
+                             agg_func='sum', 
+                             cube=cube)
     
 
     
@@ -357,7 +442,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='id', 
-                             agg_func='count')
+                             agg_func='count', 
+                             cube=cube)
     
     activity_trip_subtype_figure(ucalitems=csv_dict_sub['ucalitems_temporal_plot'], 
                              tb = 'ucalitems_temporal_plot', 
@@ -365,7 +451,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='duration_after_split', 
-                             agg_func='sum')
+                             agg_func='sum', 
+                             cube=cube)
     
     activity_trip_subtype_figure(ucalitems=csv_dict_sub['ucalitems_temporal_plot'], 
                              tb = 'ucalitems_temporal_plot', 
@@ -373,7 +460,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='distance_after_split', 
-                             agg_func='sum')
+                             agg_func='sum', 
+                             cube=cube)
     
     activity_trip_subtype_figure(ucalitems=csv_dict_sub['leg2trip'], 
                              tb = 'leg2trip', 
@@ -381,7 +469,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='id', 
-                             agg_func='count')
+                             agg_func='count', 
+                             cube=cube)
     
     activity_trip_subtype_figure(ucalitems=csv_dict_sub['leg2trip'], 
                              tb = 'leg2trip', 
@@ -389,7 +478,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='duration_after_split', 
-                             agg_func='sum')
+                             agg_func='sum', 
+                             cube=cube)
     
     activity_trip_subtype_figure(ucalitems=csv_dict_sub['leg2trip'], 
                              tb = 'leg2trip', 
@@ -397,7 +487,8 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
                              mytype='TRIP', 
                              directory=directory, 
                              agg_col='distance_after_split', 
-                             agg_func='sum')
+                             agg_func='sum', 
+                             cube=cube)
     
 
 # PresonDay Summary
@@ -406,24 +497,45 @@ def save_tables_plots(directory, csv_dict, csv_dict_sub):
 # For each subtype for whole trip (count, distance_meter, duration_minute)
 # For each subtype for activity (count, duration_minute)
 
-def person_day_subtype(ucalitems, day_summary, mytype): 
+# cube: subtype cube (build_subtype_cube) to use instead of ucalitems, source: 'segment' or 'complete' rows of the cube,
+#       None for the rows of ucalitems (see episode_source)
+# ucalitems can also be an EpisodeStore, user_ids: the users to summarize (None for all users), only their episodes are read from the store
+
+def person_day_subtype(ucalitems, day_summary, mytype, cube=None, source=None, user_ids=None): 
     
-    # select episodes of trips or activities
+    # select episodes (or cube rows) of trips or activities
+    agg_funcs = agg_dict[mytype]
+    if isinstance(ucalitems, episode_store.EpisodeStore):
+        ucalitems = ucalitems.load(user_ids, columns=['user_id', 'IsWeekend', 'start_date', 'type_decoded', 'subtype_decoded'] + list(agg_funcs.keys()))
+    if cube is not None:
+        ucalitems, agg_funcs = cube_source(cube, episode_source(ucalitems, source))
+        agg_funcs = {col: agg_funcs[col] for col in agg_dict[mytype].keys()}
     df = ucalitems.query('type_decoded==@mytype')
+    if user_ids is not None:
+        df = df[df['user_id'].isin([user_ids] if np.ndim(user_ids) == 0 else user_ids)]
     # print(df.shape)
     
-    # convert the unit, hour for activity, minutes and miles for trips,
-    df['duration_after_split'] = df['duration_after_split'].copy()*duration_unit[mytype]
-    df['distance_after_split'] = df['distance_after_split'] / unit_convert 
-    
     # groupby and aggregate
-    df = df.groupby(['user_id', 'IsWeekend', 'start_date', 'subtype_decoded']).agg(agg_dict[mytype])
+    df = df.groupby(person_day_subtype_keys(df)).agg(agg_funcs)
     df.reset_index(inplace=True)
+
+    # convert the unit, hour for activity, minutes and miles for trips,
+    df['duration_after_split'] = df['duration_after_split']*duration_unit[mytype]
+    if 'distance_after_split' in df.columns:
+        df['distance_after_split'] = df['distance_after_split'] / unit_convert 
     df.rename(columns = col_dict_final[mytype], inplace=True)
     
     # pivot long to wide tables
     cols = list(col_dict_final[mytype].values())
-    result_df = df.pivot(index=['user_id', 'IsWeekend', 'start_date'], columns=['subtype_decoded'], values=cols).reset_index()
+    if person_day.has_codes(df):
+        # pivot by person-day code, then add the user_id and start_date of the codes
+        result_df = df.pivot(index='person_day', columns=['subtype_decoded'], values=cols)
+        days = person_day.build_person_day_index(ucalitems).attributes(result_df.index.values, ['user_id', 'IsWeekend', 'start_date'])
+        result_df = pd.concat([days, result_df.reset_index(drop=True)], axis=1)
+        result_df.columns = pd.MultiIndex.from_tuples([(col, '') for col in days.columns] + list(result_df.columns[days.shape[1]:]))
+        result_df = result_df.sort_values(by=[('user_id', ''), ('IsWeekend', ''), ('start_date', '')], ignore_index=True)
+    else:
+        result_df = df.pivot(index=['user_id', 'IsWeekend', 'start_date'], columns=['subtype_decoded'], values=cols).reset_index()
     renamed_columns = []
     for i in result_df.columns:
         if i[1] == '':
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Minute-resolution time use by person day'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import numpy as np
+import pandas as pd
+
+from py_daynamica import kernels, person_day, s4_temporal_plot
+
+minutes_per_day = 1440
+# person days counted at once by time_use_share (bounded memory of the count keys)
+block_rows = 4096
+
+# labels of the time use matrix: code 0 is no data, codes 1.. follow the order of the colors in the schedule plot
+time_use_labels = ['NO DATA'] + list(s4_temporal_plot.color_discrete_map.keys()) + ['DEVICE OFF']
+time_use_colors = dict(s4_temporal_plot.color_discrete_map, **{'NO DATA': '#ffffff', 'DEVICE OFF': '#f0f0f0'})
+
+
+# local wall clock minutes since the start of the day (start_date) of a date time column
+def minute_of_day(dt, start_date):
+    if getattr(dt.dt, 'tz', None) is not None:
+        dt = dt.dt.tz_localize(None)
+    return(((dt - start_date) / pd.Timedelta(minutes=1)).values)
+
+
+"""
+INPUT:  ucalitems_temporal_plot after filtering valid days
+
+TASKS:  paint each episode as an interval of minutes [start, end) on a person-day x 1440 matrix
+        the episodes are painted in start time order (kernels.paint_intervals): each minute takes the label of the last episode
+        covering it, so an episode nested in another one replaces it only between its own start and end minutes
+        episodes of type DEVICE OFF are labeled as 'DEVICE OFF'
+
+OUTPUT: matrix <uint8 array, person-day x 1440, codes of time_use_labels>,
+        person_days <table of person days (rows of the matrix): user_id, start_date, dow, IsWeekend>
+"""
+def time_use_matrix(ucalitems_temporal_plot):
+    df = ucalitems_temporal_plot.sort_values(by=['user_id', 'start_dt'], kind='mergesort')
+
+    # person-day of each episode
+    row, person_days = person_day.factorize_person_days(df)
+
+    # label code of each episode
+    label = df['subtype_decoded'].where(df['type_decoded'] != 'DEVICE OFF', 'DEVICE OFF')
+    code = np.maximum(pd.Categorical(label, categories=time_use_labels).codes, 0)  # labels not in time_use_labels as no data
+
+    # start and end minutes
+    start_date = df['start_date']
+    start_minute = np.clip(np.round(minute_of_day(df['start_dt'], start_date)), 0, minutes_per_day).astype(np.int64)
+    end_minute = np.clip(np.round(minute_of_day(df['end_dt'], start_date)), 0, minutes_per_day).astype(np.int64)
+    keep = end_minute > start_minute
+
+    matrix = kernels.paint_intervals(row[keep], start_minute[keep], end_minute[keep], code[keep], person_days.shape[0], minutes_per_day)
+
+    print('# episodes: {0:0.0f}. # person-days: {1:0.0f}. matrix size: {2:0.1f} MB'.format(df.shape[0], person_days.shape[0], matrix.nbytes / 1e6))
+    return(matrix, person_days)
+
+
+"""
+INPUT:  matrix, person_days <outputs of time_use_matrix>
+        by <columns of person_days to group person days, e.g. ['IsWeekend'] or ['dow'], [] for all days>
+        resolution <minutes per time slot, e.g. 1, 10, 60>
+
+TASKS:  count person days by group, label and time slot with a bincount over each block of rows of the matrix
+
+OUTPUT: long table: by columns, 'label', 'time' (HH:MM at the start of the slot), 'share' (share of person days x minutes in the slot)
+"""
+def time_use_share(matrix, person_days, by = ['IsWeekend'], resolution = 1):
+    n_labels = len(time_use_labels)
+    n_slots = minutes_per_day // resolution
+
+    if by:
+        group, group_keys = pd.factorize(pd.MultiIndex.from_frame(person_days[by]), sort=True)
+        group_keys = pd.DataFrame(list(group_keys), columns=by)
+    else:
+        group, group_keys = np.zeros(person_days.shape[0], dtype=np.int64), pd.DataFrame(index=[0])
+    n_groups = group_keys.shape[0]
+
+    # one bincount per block of person days, with the smallest integer type of the (group, label, slot) key
+    size = n_groups * n_labels * n_slots
+    dtype = np.int32 if size < 2**31 else np.int64
+    slot = (np.arange(minutes_per_day) // resolution).astype(dtype)
+    counts = np.zeros(size, dtype=np.int64)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = slice(start, start + block_rows)
+        flat = (group[block, None].astype(dtype) * n_labels + matrix[block]) * n_slots + slot[None, :]
+        counts += np.bincount(flat.ravel(), minlength=size)
+    counts = counts.reshape(n_groups, n_labels, n_slots)
+    share = counts / (np.bincount(group, minlength=n_groups)[:, None, None] * resolution)
+
+    result = pd.DataFrame({
+        'group': np.repeat(np.arange(n_groups), n_labels * n_slots),
+        'label': np.tile(np.repeat(time_use_labels, n_slots), n_groups),
+        'time': np.tile(['{:02d}:{:02d}'.format(m // 60, m % 60) for m in range(0, minutes_per_day, resolution)], n_groups * n_labels),
+        'share': share.ravel(),
+    })
+    result = pd.merge(group_keys.reset_index(drop=True).rename_axis('group').reset_index(), result, on='group').drop(columns='group')
+
+    return(result)
+
+
+"""
+INPUT:  matrix, person_days <outputs of time_use_matrix>
+        time <time of the day, HH:MM>
+        by <columns of person_days to group person days>
+
+OUTPUT: table of shares of person days by label at the given time, one column per group
+        e.g. share of people at WORKPLACE at 10:00 by day of the week
+"""
+def time_use_share_at(matrix, person_days, time = '10:00', by = ['dow']):
+    minute = int(time.split(':')[0]) * 60 + int(time.split(':')[1])
+    df = person_days[by].copy()
+    df['label'] = np.array(time_use_labels, dtype=object)[matrix[:, minute]]
+    result = pd.crosstab(df['label'], [df[col] for col in by], normalize='columns')
+    return(result)
+
+
+"""
+INPUT:  shares <output of time_use_share with by = ['IsWeekend'] or []>
+        directory <the folder to save the figure>
+        day_type <'Weekday', 'Weekend' or None for all days>
+
+OUTPUT: a stacked area figure of the shares of labels by time of the day
+"""
+def time_of_day_profile_figure(shares, directory, day_type = None):
+    import matplotlib.pyplot as plt
+
+    df = shares if day_type is None else shares.query('IsWeekend==@day_type')
+    df = df.pivot_table(index='time', columns='label', values='share', aggfunc='sum')
+    cols = [col for col in time_use_labels if (col in df.columns) and (df[col].sum() > 0)]
+
+    plt.rcParams.update({'font.size': 12})
+    fig, ax = plt.subplots(figsize=(12, 5))
+    df[cols].plot.area(ax=ax, color=[time_use_colors[col] for col in cols], linewidth=0)
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    ax.set(xlabel='Time', ylabel='Share of Person Days', ylim=(0, 1))
+
+    fig.savefig(os.path.join(directory, 'time_of_day_profile_{}.png'.format(day_type or 'All Days')), bbox_inches='tight', dpi=600)
+    return(df[cols])
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Activity-trip sequences and daily patterns by person day'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+from py_daynamica import person_day
+
+"""
+Each person day is encoded as a sequence of integer tokens, stored for all person days in ONE flat array
+plus offsets (the sequence of person day i is codes[offsets[i]:offsets[i+1]]):
+    - activities are labeled by their subtype (e.g. HOME, WORKPLACE), trips as 'TRIP' (or by travel mode)
+    - episodes of type DEVICE OFF are dropped by default
+    - episodes without subtype (e.g. kept by the subtype cube) are labeled 'UNKNOWN', as in s4_temporal_plot
+    - consecutive episodes with the same label are merged, e.g. trip legs TRIP-TRIP into one TRIP
+All counts below are computed on the flat array with numpy (no groupby-apply per person day).
+"""
+
+pattern_sep = '-'
+
+# label of the episodes without subtype
+missing_label = 'UNKNOWN'
+
+# multipliers of the two polynomial hashes used to identify whole-day sequences
+hash_base = (1000003, 998244353)
+
+
+class DaySequences(object):
+    """
+    codes: int64 array of tokens of all person days
+    offsets: int64 array, start of each person day in codes (length = # person days + 1)
+    vocab: labels of the tokens
+    person_days: table of person days (user_id, start_date, dow, IsWeekend), in the order of the offsets
+    """
+    def __init__(self, codes, offsets, vocab, person_days):
+        self.codes = codes
+        self.offsets = offsets
+        self.vocab = np.array(vocab, dtype=object)
+        self.person_days = person_days
+
+        self.lengths = np.diff(offsets)
+        self.day = np.repeat(np.arange(self.lengths.shape[0]), self.lengths)  # person day of each token
+        self.position = np.arange(codes.shape[0]) - offsets[self.day]         # position of each token in its day
+
+    def __len__(self):
+        return(self.lengths.shape[0])
+
+    # sequence of ONE person day as text, e.g. HOME-TRIP-WORKPLACE-TRIP-HOME
+    def pattern(self, i):
+        return(pattern_sep.join(self.vocab[self.codes[self.offsets[i]:self.offsets[i + 1]]]))
+
+    def patterns(self):
+        return(pd.Series([self.pattern(i) for i in range(len(self))], name='pattern'))
+
+
+"""
+INPUT:  ucalitems <ucalitems_temporal_plot (trip legs) or leg2trip (complete trips) after filtering valid days>
+        trip_mode <False to label all trips as 'TRIP', True to label trips by subtype (travel mode)>
+        device_off <False to drop DEVICE OFF episodes, True to keep them as 'DEVICE OFF'>
+
+OUTPUT: DaySequences of all person days
+"""
+def encode_sequences(ucalitems, trip_mode=False, device_off=False):
+    df = ucalitems.sort_values(by=['user_id', 'start_dt'], kind='mergesort')
+    if not device_off:
+        df = df[df['type_decoded'] != 'DEVICE OFF']
+
+    label = df['subtype_decoded'].fillna(missing_label).values.astype(object)
+    if not trip_mode:
+        label = np.where(df['type_decoded'].values == 'TRIP', 'TRIP', label)
+    label = np.where(df['type_decoded'].values == 'DEVICE OFF', 'DEVICE OFF', label)
+    codes, vocab = pd.factorize(label)
+
+    day, person_days = person_day.factorize_person_days(df)
+
+    # merge consecutive episodes with the same label in the same person day
+    keep = np.ones(codes.shape[0], dtype=bool)
+    keep[1:] = (codes[1:] != codes[:-1]) | (day[1:] != day[:-1])
+    codes, day = codes[keep].astype(np.int64), day[keep]
+
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(day, minlength=person_days.shape[0]))])
+
+    print('# episodes: {0:0.0f}. # tokens: {1:0.0f}. # person-days: {2:0.0f}. # labels: {3:0.0f}'.format(df.shape[0], codes.shape[0], person_days.shape[0], len(vocab)))
+    return(DaySequences(codes, offsets, list(vocab), person_days))
+
+
+# group number of each person day by the columns "by" of person_days
+def _group_person_days(seqs, by):
+    if not by:
+        return(np.zeros(len(seqs), dtype=np.int64), pd.DataFrame(index=[0]))
+    group, keys = pd.factorize(pd.MultiIndex.from_frame(seqs.person_days[by]), sort=True)
+    return(group, pd.DataFrame(list(keys), columns=by))
+
+# add the group columns to a table with a column 'group'
+def _add_group_cols(df, group_keys):
+    group_keys = group_keys.reset_index(drop=True).rename_axis('group').reset_index()
+    return(pd.merge(group_keys, df, on='group').drop(columns='group'))
+
+# patterns (text) of integer keys of n tokens
+def _decode_keys(keys, n, vocab):
+    size = vocab.shape[0]
+    tokens = np.stack([(keys // size**(n - 1 - j)) % size for j in range(n)], axis=1)
+    return([pattern_sep.join(row) for row in vocab[tokens]])
+
+
+"""
+INPUT:  seqs <DaySequences>
+        n <length of n-grams, e.g. 3 for HOME-TRIP-WORKPLACE>
+        by <columns of person_days to group person days, e.g. ['IsWeekend'], [] for all days>
+
+TASKS:  n-gram of each position = integer key of n consecutive tokens of the same person day, counted with np.unique
+
+OUTPUT: table: by columns, pattern, count (# occurrences), days (# person days with the pattern), share_days (days / # person days in group)
+"""
+def ngram_counts(seqs, n, by = ['IsWeekend']):
+    group, group_keys = _group_person_days(seqs, by)
+    size = seqs.vocab.shape[0]
+
+    start = np.flatnonzero(seqs.position <= seqs.lengths[seqs.day] - n)
+    keys = np.zeros(start.shape[0], dtype=np.int64)
+    for j in range(n):
+        keys = keys * size + seqs.codes[start + j]
+    day = seqs.day[start]
+
+    # occurrences and person days by (group, n-gram)
+    group_key = np.stack([group[day], keys], axis=1)
+    uniq, count = np.unique(group_key, axis=0, return_counts=True)
+    uniq_day = np.unique(np.stack([group[day], keys, day], axis=1), axis=0)
+    _, days = np.unique(uniq_day[:, :2], axis=0, return_counts=True)
+
+    result = pd.DataFrame({'group': uniq[:, 0], 'pattern': _decode_keys(uniq[:, 1], n, seqs.vocab), 'count': count, 'days': days})
+    result['share_days'] = result['days'] / np.bincount(group, minlength=group_keys.shape[0])[result['group'].values]
+    result = _add_group_cols(result, group_keys)
+    result.sort_values(by=by + ['count'], ascending=[True] * len(by) + [False], inplace=True, ignore_index=True)
+    return(result)
+
+
+"""
+INPUT:  seqs <DaySequences>
+        by <columns of person_days to group person days>
+
+TASKS:  identify the whole-day sequence of each person day by its length and two polynomial hashes (np.add.reduceat over the flat array)
+
+OUTPUT: table: by columns, pattern (whole day), days, share_days
+"""
+def day_pattern_counts(seqs, by = ['IsWeekend']):
+    group, group_keys = _group_person_days(seqs, by)
+
+    hashes = []
+    for base in hash_base:
+        # sum of (token + 1) * base**position by person day, uint64 arithmetic wraps around (modulo 2**64)
+        power = np.cumprod(np.concatenate([[1], np.full(int(seqs.lengths.max(initial=1)) - 1, base)]).astype(np.uint64))
+        value = (seqs.codes.astype(np.uint64) + np.uint64(1)) * power[seqs.position]
+        hashes.append(np.add.reduceat(value, seqs.offsets[:-1]).view(np.int64))
+
+    key = np.stack([group, seqs.lengths] + hashes, axis=1)
+    uniq, first, days = np.unique(key, axis=0, return_index=True, return_counts=True)
+
+    result = pd.DataFrame({'group': uniq[:, 0], 'pattern': [seqs.pattern(i) for i in first], 'days': days})
+    result['share_days'] = result['days'] / np.bincount(group, minlength=group_keys.shape[0])[result['group'].values]
+    result = _add_group_cols(result, group_keys)
+    result.sort_values(by=by + ['days'], ascending=[True] * len(by) + [False], inplace=True, ignore_index=True)
+    return(result)
+
+
+# top k rows of a count table (ngram_counts or day_pattern_counts) by group
+def top_patterns(counts, k = 10, by = ['IsWeekend']):
+    if not by:
+        return(counts.head(k))
+    return(counts.groupby(by, sort=True).head(k).reset_index(drop=True))
+
+
+"""
+INPUT:  seqs <DaySequences encoded with trip_mode=False>
+        home <label of home>
+
+TASKS:  home-based tours: segments of a person day from one HOME to the next HOME with at least one other token between
+
+OUTPUT: one row per tour: user_id, start_date, dow, IsWeekend, tour (number in the day), pattern, trips, stops (non-home activities),
+        tour_type ('simple' with at most one stop, 'complex' with more stops)
+"""
+def home_based_tours(seqs, home = 'HOME'):
+    home_code = np.flatnonzero(seqs.vocab == home)
+    trip_code = np.flatnonzero(seqs.vocab == 'TRIP')
+    is_home = np.isin(seqs.codes, home_code)
+    is_trip = np.isin(seqs.codes, trip_code)
+
+    home_pos = np.flatnonzero(is_home)
+    start, end = home_pos[:-1], home_pos[1:]
+    valid = (seqs.day[start] == seqs.day[end]) & (end - start > 1)
+    start, end = start[valid], end[valid]
+
+    trips_cum = np.concatenate([[0], np.cumsum(is_trip)])
+    trips = trips_cum[end] - trips_cum[start]
+    stops = (end - start - 1) - trips
+
+    result = seqs.person_days.iloc[seqs.day[start]].reset_index(drop=True)
+    result['tour'] = pd.Series(seqs.day[start]).groupby(seqs.day[start]).cumcount().values + 1
+    result['pattern'] = [pattern_sep.join(seqs.vocab[seqs.codes[s:e + 1]]) for s, e in zip(start, end)]
+    result['trips'] = trips
+    result['stops'] = stops
+    result['tour_type'] = np.where(stops > 1, 'complex', 'simple')
+
+    print('# person-days: {0:0.0f}. # home-based tours: {1:0.0f}'.format(len(seqs), result.shape[0]))
+    return(result)
+
+
+"""
+INPUT:  tours <output of home_based_tours>, seqs <DaySequences>
+        by <columns of person_days to group person days>
+
+OUTPUT: trip chain summary by group: tours per day, trips per tour, share of complex tours
+"""
+def trip_chain_summary(tours, seqs, by = ['IsWeekend']):
+    days = seqs.person_days.groupby(by).size().rename('days') if by else pd.Series({'All Days': len(seqs)}, name='days')
+    group = tours.groupby(by) if by else tours.groupby(lambda x: 'All Days')
+    result = group.agg(tours=('tour', 'size'), trips=('trips', 'sum'), complex_tours=('tour_type', lambda x: (x == 'complex').sum()))
+    result = result.join(days, how='right').fillna(0)
+    result['tours_per_day'] = result['tours'] / result['days']
+    result['trips_per_tour'] = result['trips'] / result['tours'].where(result['tours'] > 0)
+    result['share_complex_tours'] = result['complex_tours'] / result['tours'].where(result['tours'] > 0)
+    return(result.rename_axis(by or 'day_type').reset_index())
+
+if __name__=='__main__':
+    pass
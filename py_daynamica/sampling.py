@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Stratified user sampling for fast previews'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+from py_daynamica import bootstrap, local_day, pipeline, s3_valid_data, s7_summary_subtype
+
+"""
+A preview runs the pipeline on a stratified sample of users to check a parameter (e.g. query_text or buffer_dis_meter)
+in seconds, the full run is only needed at the end.
+
+The users are stratified in ONE pass over the raw calendar items: the items are counted by user (bincount on user codes),
+the users are ranked by the stratification variable and cut into n_strata strata of equal size:
+    - 'volume': number of calendar items of the user
+    - 'weekend': share of the items of the user starting on a weekend (local day)
+Each stratum is sampled with the same fraction (proportional allocation, at least min_per_stratum users),
+so the sample keeps the mix of light / heavy users or of weekday / weekend users of the cohort.
+
+The sampling errors are estimated by a stratified cluster bootstrap: users are resampled within their strata
+(bootstrap.overview_statistics_ci, bootstrap.activity_trip_subtype_ci). No finite population correction is applied,
+so the standard errors are slightly conservative for large sampling fractions.
+"""
+
+
+"""
+INPUT:  ucalitems <raw calendar items>
+        by <'volume' or 'weekend'>, n_strata <number of strata>
+        local_timezone, unix_time_unit <see s2_preprocess_data.split_ucalitems, used for 'weekend'>
+
+OUTPUT: one row per user: user_id, items, value (stratification variable), stratum (0 .. n_strata - 1, sorted by value)
+"""
+def user_strata(ucalitems, by = 'volume', n_strata = 4, local_timezone = 'US/Central', unix_time_unit = 'ms'):
+    codes, users = pd.factorize(ucalitems['user_id'], sort=True)
+    keep = codes >= 0
+    items = np.bincount(codes[keep], minlength=users.shape[0])
+
+    if by == 'volume':
+        value = items.astype(float)
+    elif by == 'weekend':
+        start_ns = pd.to_datetime(ucalitems['start_timestamp'], unit=unix_time_unit).values.view(np.int64)
+        tz = local_timezone if isinstance(local_timezone, str) else ucalitems['user_id'].map(local_timezone).values
+        weekend = (local_day.local_day(start_ns, tz) + 3) % 7 >= 5
+        value = np.bincount(codes[keep], weights=weekend[keep], minlength=users.shape[0]) / items
+    else:
+        raise Exception("Sorry, by parameter not correct: 'volume' or 'weekend'")
+
+    # strata of equal size by rank of the value (ties broken by user_id)
+    rank = np.empty(users.shape[0], dtype=np.int64)
+    rank[np.argsort(value, kind='mergesort')] = np.arange(users.shape[0])
+    n_strata = max(1, min(n_strata, users.shape[0]))
+    return(pd.DataFrame({'user_id': users, 'items': items, 'value': value, 'stratum': rank * n_strata // max(users.shape[0], 1)}))
+
+
+"""
+INPUT:  strata <output of user_strata>
+        fraction <sampling fraction of each stratum>, min_per_stratum <minimum number of users of a stratum (for the error estimates)>
+        seed
+
+OUTPUT: the rows of strata of the sampled users, with the column 'stratum_users' (number of users of the stratum)
+"""
+def sample_users(strata, fraction = 0.1, min_per_stratum = 2, seed = 0):
+    rng = np.random.default_rng(seed)
+    stratum = strata['stratum'].values
+    size = np.bincount(stratum)
+    n_sample = np.minimum(size, np.maximum(np.round(size * fraction).astype(np.int64), min_per_stratum))
+
+    # users in random order within each stratum, the first n_sample of each stratum are drawn
+    order = np.lexsort((rng.random(stratum.shape[0]), stratum))
+    position = np.arange(order.shape[0]) - (np.cumsum(size) - size)[stratum[order]]
+    chosen = np.sort(order[position < n_sample[stratum[order]]])
+
+    result = strata.iloc[chosen].reset_index(drop=True)
+    result['stratum_users'] = size[result['stratum'].values]
+    print('# users: {0:0.0f}. # sampled users: {1:0.0f}. # users by stratum: {2}. # sampled: {3}'.format(
+        strata.shape[0], result.shape[0], list(size), list(n_sample)))
+    return(result)
+
+
+"""
+INPUT:  pipe <pipeline.Pipeline of the sampled users>, sample <output of sample_users>
+        n_replicates, alpha, seed, n_workers <see bootstrap.person_day_bootstrap>
+
+OUTPUT: dictionary of tables with the estimated sampling errors (ci_lower, ci_upper, se):
+        overview_statistics, activity_subtype, trip_segment_subtype, trip_complete_subtype
+"""
+def preview_tables(pipe, sample, n_replicates = 200, alpha = 0.05, seed = 0, n_workers = 1):
+    csv_dict_sub = pipe.valid_dict()
+    strata = sample.set_index('user_id')['stratum']
+    cube = s7_summary_subtype.build_subtype_cube(csv_dict_sub['ucalitems_temporal_plot'], csv_dict_sub['leg2trip'])
+    kwargs = dict(n_replicates=n_replicates, alpha=alpha, seed=seed, n_workers=n_workers, strata=strata)
+
+    result = {}
+    result['overview_statistics'] = bootstrap.overview_statistics_ci(dict(csv_dict_sub, subtype_cube=cube), stat_group_cols=pipe.params['stat_group_cols'], **kwargs)
+    for name, mytype, source in [('activity_subtype', 'ACTIVITY', 'segment'), ('trip_segment_subtype', 'TRIP', 'segment'), ('trip_complete_subtype', 'TRIP', 'complete')]:
+        result[name] = bootstrap.activity_trip_subtype_ci(None, csv_dict_sub['day_summary'], mytype, cube=cube, source=source, **kwargs)
+    return(result)
+
+
+"""
+INPUT:  csv_dict <data dictionary from S1 (path2dict), only the raw tables are used>
+        fraction, by, n_strata, min_per_stratum, seed <see user_strata and sample_users>
+        n_replicates, n_workers <see preview_tables>
+        **params <parameters of the pipeline, see pipeline.default_params>
+
+TASKS:  stratify and sample the users, select their rows (s3_valid_data.select_userids) and run the pipeline on them
+
+OUTPUT: dictionary: 'sample' (sampled users and strata), 'pipeline' (Pipeline of the sample, pipe.set_params(...) then
+        preview_tables(pipe, sample) to try another parameter), and the tables of preview_tables
+"""
+def preview(csv_dict, fraction = 0.1, by = 'volume', n_strata = 4, min_per_stratum = 2, seed = 0, n_replicates = 200, n_workers = 1, **params):
+    settings = dict(pipeline.default_params, **params)
+    strata = user_strata(csv_dict['ucalitems'], by=by, n_strata=n_strata, local_timezone=settings['local_timezone'], unix_time_unit=settings['unix_time_unit'])
+    sample = sample_users(strata, fraction=fraction, min_per_stratum=min_per_stratum, seed=seed)
+
+    raw = s3_valid_data.select_userids({name: csv_dict[name] for name in pipeline.raw_tables}, list(sample['user_id']))
+    pipe = pipeline.Pipeline(raw, **params)
+    result = {'sample': sample, 'pipeline': pipe}
+    result.update(preview_tables(pipe, sample, n_replicates=n_replicates, seed=seed, n_workers=n_workers))
+    return(result)
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Mergeable sketches of person-day statistics'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+"""
+Sketches summarize a stream of values in constant memory and can be merged, e.g. across users, cohorts,
+shards of data or worker processes, and give the same summary as computing on all values at once:
+    - MomentSketch: count, mean, sum of squared deviations (Welford / Chan et al. merging), min, max -> exact mean, SD, min, max
+    - QuantileSketch: t-digest, a sorted list of centroids (mean, weight); centroids near the tails are kept small
+      (scale function k = compression / (2 pi) * asin(2q - 1)), so quantiles have a small relative rank error,
+      values are kept as they are until there are more than buffer_size of them (the median is exact for small samples)
+Missing values (NaN) are skipped, like pandas.
+"""
+
+
+class MomentSketch(object):
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = np.nan
+        self.max = np.nan
+
+    def _merge_moments(self, count, mean, m2, vmin, vmax):
+        if count == 0:
+            return(self)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = vmin if np.isnan(self.min) else min(self.min, vmin)
+        self.max = vmax if np.isnan(self.max) else max(self.max, vmax)
+        return(self)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.shape[0] == 0:
+            return(self)
+        mean = values.mean()
+        return(self._merge_moments(values.shape[0], mean, ((values - mean) ** 2).sum(), values.min(), values.max()))
+
+    def merge(self, other):
+        return(self._merge_moments(other.count, other.mean, other.m2, other.min, other.max))
+
+    # sample standard deviation (ddof = 1, as pandas)
+    def std(self):
+        return(np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan)
+
+
+class QuantileSketch(object):
+    """
+    compression: about compression / 2 centroids are kept after compressing (memory does not depend on the number of values)
+    buffer_size: number of centroids before compressing
+    """
+    def __init__(self, compression = 200, buffer_size = 2000):
+        self.compression = compression
+        self.buffer_size = max(buffer_size, compression)
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    @property
+    def count(self):
+        return(self.weights.sum())
+
+    def _add(self, means, weights):
+        self.means = np.concatenate([self.means, means])
+        self.weights = np.concatenate([self.weights, weights])
+        if self.means.shape[0] > self.buffer_size:
+            self.compress()
+        return(self)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        return(self._add(values, np.ones(values.shape[0])))
+
+    def merge(self, other):
+        return(self._add(other.means, other.weights))
+
+    # merge neighbouring centroids whose cumulative weights fall into the same unit of the scale function
+    def compress(self):
+        order = np.argsort(self.means, kind='mergesort')
+        means, weights = self.means[order], self.weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)).astype(np.int64)
+        # the first and last values stay single centroids to keep min and max
+        k[0], k[-1] = k.min() - 1, k.max() + 1
+        start = np.flatnonzero(np.concatenate([[True], k[1:] != k[:-1]]))
+        new_weights = np.add.reduceat(weights, start)
+        self.means = np.add.reduceat(means * weights, start) / new_weights
+        self.weights = new_weights
+        return(self)
+
+    # quantiles by linear interpolation between the centers of the centroids
+    def quantile(self, q):
+        if self.weights.shape[0] == 0:
+            return(np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan)
+        order = np.argsort(self.means, kind='mergesort')
+        means, weights = self.means[order], self.weights[order]
+        centers = np.cumsum(weights) - weights / 2
+        return(np.interp(np.asarray(q) * weights.sum(), centers, means))
+
+
+"""
+INPUT:  stat_group_cols <columns of the long table of person-day values defining the groups, e.g. ['IsWeekend', 'Statistics']>
+
+TASKS:  one MomentSketch and one QuantileSketch per group, updated by batches of person-day values (e.g. one shard of users)
+        and merged with the sketches of other shards
+"""
+class StatisticsSketch(object):
+
+    def __init__(self, stat_group_cols = ['IsWeekend', 'Statistics'], compression = 200):
+        self.stat_group_cols = list(stat_group_cols)
+        self.compression = compression
+        self.groups = {}  # group key -> (MomentSketch, QuantileSketch)
+
+    def _group(self, key):
+        if key not in self.groups:
+            self.groups[key] = (MomentSketch(), QuantileSketch(compression=self.compression))
+        return(self.groups[key])
+
+    # per_day_df: long table with stat_group_cols and 'value'
+    def update(self, per_day_df):
+        for key, values in per_day_df.groupby(self.stat_group_cols)['value']:
+            key = key if isinstance(key, tuple) else (key,)
+            moments, quantiles = self._group(key)
+            moments.update(values.values)
+            quantiles.update(values.values)
+        return(self)
+
+    def merge(self, other):
+        for key, (moments, quantiles) in other.groups.items():
+            self._group(key)[0].merge(moments)
+            self._group(key)[1].merge(quantiles)
+        return(self)
+
+    # table with stat_group_cols and median, mean, std, min, max (groups sorted as groupby)
+    def summary(self):
+        result_list = []
+        for key in sorted(self.groups.keys()):
+            moments, quantiles = self.groups[key]
+            mean = moments.mean if moments.count > 0 else np.nan
+            result_list.append(list(key) + [quantiles.quantile(0.5), mean, moments.std(), moments.min, moments.max])
+        return(pd.DataFrame(result_list, columns = self.stat_group_cols + ['median', 'mean', 'std', 'min', 'max']))
+
+if __name__=='__main__':
+    pass
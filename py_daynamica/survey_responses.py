@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Sparse matrix of survey responses by calendar item'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+"""
+The responses of calendar_item_survey are stored as a sparse matrix in compressed rows (numpy arrays, no scipy) with
+one row per calendar item key (user_id, cal_item_id, start_timestamp) and one column per question: the cells of the key
+row k are indptr[k]:indptr[k + 1] of the arrays question (column) and code (value). The value of a cell is
+    - 0 (not stored): the question was not asked for the item
+    - 1: the question was asked without response
+    - k >= 2: the response values[k - 2]
+The keys are factorized once together with the keys of ucalitems, so that the matrix can be joined by row number:
+episode_key[i] is the key row of the episode i of ucalitems_ljoin_ucisurvey (-1 if the episode has no survey).
+"""
+
+key_cols = ['user_id', 'cal_item_id', 'start_timestamp']
+
+
+class SurveyResponses(object):
+    """
+    indptr, question, code: compressed rows of the matrix key x question, codes of the responses
+    keys: MultiIndex of the keys (user_id, cal_item_id, start_timestamp), in the order of the rows of the matrix
+    questions: question_id of each column
+    values: response values
+    episode_key: key row of each row of ucalitems_ljoin_ucisurvey
+    """
+    def __init__(self, indptr, question, code, keys, questions, values, episode_key):
+        self.indptr = indptr
+        self.question = question
+        self.code = code
+        self.keys = keys
+        self.questions = np.asarray(questions)
+        self.values = np.asarray(values, dtype=object)
+        self.episode_key = episode_key
+
+    # key rows of the episodes of a table with the key columns (e.g. ucalitems_ljoin_ucisurvey_split), -1 if the key has no survey
+    def key_rows(self, ucalitems):
+        return(self.keys.get_indexer(pd.MultiIndex.from_frame(ucalitems[key_cols])))
+
+    # True for the keys with at least one response
+    def key_answered(self):
+        key = np.repeat(np.arange(self.indptr.shape[0] - 1), np.diff(self.indptr))
+        return(np.bincount(key[self.code >= 2], minlength=self.indptr.shape[0] - 1) > 0)
+
+    """
+    INPUT:  ucalitems <None for the rows of ucalitems_ljoin_ucisurvey, or a table with the key columns, e.g. after splitting or filtering valid days>
+
+    OUTPUT: the stored cells of the matrix episode x question (rows in the order of the table): episode row, question column, code
+    """
+    def episode_cells(self, ucalitems = None):
+        rows = self.episode_key if ucalitems is None else self.key_rows(ucalitems)
+        counts = np.where(rows < 0, 0, np.diff(self.indptr)[rows])
+        episode = np.repeat(np.arange(rows.shape[0]), counts)
+        # position of each cell in the compressed rows: first cell of its key row + rank of the cell in the episode
+        cell = np.repeat(self.indptr[rows] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return(episode, self.question[cell], self.code[cell])
+
+    """
+    INPUT:  ucalitems <see episode_cells>
+
+    OUTPUT: one row per question: question_id, asked (# episodes), answered (# episodes), completion_rate (answered / asked)
+    """
+    def completion_rate(self, ucalitems = None):
+        _, question, code = self.episode_cells(ucalitems)
+        n_questions = self.questions.shape[0]
+        asked = np.bincount(question, minlength=n_questions)
+        answered = np.bincount(question[code >= 2], minlength=n_questions)
+        result = pd.DataFrame({'question_id': self.questions, 'asked': asked, 'answered': answered})
+        result['completion_rate'] = result['answered'] / result['asked'].where(result['asked'] > 0)
+        return(result)
+
+    """
+    INPUT:  ucalitems <see episode_cells>
+
+    OUTPUT: one row per question and response: question_id, response, count (# episodes), share (count / # answered)
+    """
+    def answer_counts(self, ucalitems = None):
+        _, question, code = self.episode_cells(ucalitems)
+        answered = code >= 2
+        n_questions, n_values = self.questions.shape[0], self.values.shape[0]
+        counts = np.bincount(question[answered] * n_values + (code[answered] - 2), minlength=n_questions * n_values).reshape(n_questions, n_values)
+
+        q, v = np.nonzero(counts)
+        result = pd.DataFrame({'question_id': self.questions[q], 'response': self.values[v], 'count': counts[q, v]})
+        result['share'] = result['count'] / counts.sum(axis=1)[q]
+        return(result)
+
+    """
+    INPUT:  ucalitems <see episode_cells>
+            questions <question_id to include, None for all questions>
+
+    OUTPUT: wide table of responses (one column per question, NaN if not asked or not answered), index = rows of the table
+    """
+    def to_frame(self, ucalitems = None, questions = None):
+        episode, question, code = self.episode_cells(ucalitems)
+        n_rows = self.episode_key.shape[0] if ucalitems is None else ucalitems.shape[0]
+        cols = np.arange(self.questions.shape[0]) if questions is None else np.flatnonzero(np.isin(self.questions, questions))
+        col_of_question = np.full(self.questions.shape[0], -1)
+        col_of_question[cols] = np.arange(cols.shape[0])
+        dense = np.zeros((n_rows, cols.shape[0]), dtype=np.int32)
+        keep = col_of_question[question] >= 0
+        dense[episode[keep], col_of_question[question[keep]]] = code[keep]
+        lookup = np.concatenate([[np.nan, np.nan], self.values]).astype(object)
+        result = pd.DataFrame(lookup[dense], columns=self.questions[cols])
+        if ucalitems is not None:
+            result.index = ucalitems.index
+        return(result)
+
+
+"""
+INPUT:  ucalitems_suvery, ucalitems <two tables in the data dictionary create from S1_read_data.py>
+
+TASKS:  factorize the keys of both tables once, the survey rows are mapped to key rows with integer codes (no merge)
+        survey rows with a missing key or question_id are dropped
+        if a question has several rows for the same key, the last response is kept (rows without response only count if
+        the question has no response for the key)
+
+OUTPUT: SurveyResponses
+"""
+def build_survey_responses(ucalitems_suvery, ucalitems):
+    survey_keys = ucalitems_suvery[['user_id', 'calendar_item_id', 'calendar_item_timestamp']].set_axis(key_cols, axis=1)
+    key_codes, keys = pd.factorize(pd.MultiIndex.from_frame(pd.concat([ucalitems[key_cols], survey_keys], ignore_index=True)))
+    keys = pd.MultiIndex.from_tuples(keys, names=key_cols) if not isinstance(keys, pd.MultiIndex) else keys.set_names(key_cols)
+    episode_key, survey_key = key_codes[:ucalitems.shape[0]], key_codes[ucalitems.shape[0]:]
+
+    question, questions = pd.factorize(ucalitems_suvery['question_id'], sort=True)
+    response, values = pd.factorize(ucalitems_suvery['response'], sort=True)
+
+    # keys or question_id with NaN are coded -1
+    valid = (survey_key >= 0) & (question >= 0)
+    survey_key, question, code = survey_key[valid].astype(np.int64), question[valid], (response[valid] + 2).astype(np.int32)
+
+    # cells sorted by key row and question, the rows with a response after the rows without response (stable sort: the
+    # order of the survey is kept otherwise), so that the last row of each cell is its last response
+    n_questions = max(questions.shape[0], 1)
+    cell = survey_key * n_questions + question
+    order = np.lexsort((code >= 2, cell))
+    cell, code = cell[order], code[order]
+    last = np.ones(cell.shape[0], dtype=bool)
+    last[:-1] = cell[1:] != cell[:-1]
+    cell, code = cell[last], code[last]
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(cell // n_questions, minlength=keys.shape[0]))])
+    return(SurveyResponses(indptr, cell % n_questions, code, keys, questions, values, episode_key))
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Validity rules of person days, compiled into boolean masks'
+
+__author__ = 'Xiaohuan Zeng'
+
+import ast
+import operator
+import functools
+import numpy as np
+
+"""
+A validity rule selects rows of day_summary, e.g. days with at least one confirmed item and 12 hours with subtype:
+    Threshold('interact_by_confirm', '>', 0) & Threshold('with_subtype', '>=', 12 - 0.1)
+or, equivalently, the text used by pandas query '(interact_by_confirm>0)&(with_subtype>=(12-0.1))'.
+
+Texts are compiled once into rules (comparisons of a column with a constant combined with &, |, ~, and, or, not),
+texts that can not be compiled are kept as a Query evaluated by pandas eval.
+The masks are evaluated on numpy arrays and cached by rule key in an Evaluator of the table, so a rule shared by many
+definitions (e.g. the denominator of a threshold sweep) is evaluated only once. The caller holds the Evaluator for as long
+as the table is not modified (a new Evaluator is needed after the table is modified in place).
+"""
+
+operators = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne}
+flipped_operators = {'>': '<', '>=': '<=', '<': '>', '<=': '>=', '==': '==', '!=': '!='}
+
+
+class Rule(object):
+    """
+    key: canonical text of the rule, used as the cache key (rules with the same key select the same rows)
+    """
+    key = None
+
+    def __and__(self, other):
+        return(And(self, rule(other)))
+
+    def __or__(self, other):
+        return(Or(self, rule(other)))
+
+    def __invert__(self):
+        return(Not(self))
+
+    def __repr__(self):
+        return(self.key)
+
+    def __eq__(self, other):
+        return(isinstance(other, Rule) and (self.key == other.key))
+
+    def __hash__(self):
+        return(hash(self.key))
+
+    # boolean mask of the rule on the table of an Evaluator (called once per table and rule, see Evaluator.mask)
+    def evaluate(self, evaluator):
+        raise NotImplementedError('{} does not define evaluate'.format(type(self).__name__))
+
+
+class Threshold(Rule):
+    """
+    col: column of the table
+    op: one of '>', '>=', '<', '<=', '==', '!='
+    value: constant (number or text)
+    """
+    def __init__(self, col, op, value):
+        self.col = col
+        self.op = op
+        self.value = value
+        self.key = '({} {} {!r})'.format(col, op, value)
+
+    def evaluate(self, evaluator):
+        return(np.asarray(operators[self.op](evaluator.column(self.col), self.value), dtype=bool))
+
+
+class Query(Rule):
+    """
+    text: pandas query text that can not be compiled, evaluated with DataFrame.eval
+    """
+    def __init__(self, text):
+        self.text = text
+        self.key = 'Query({!r})'.format(text)
+
+    def evaluate(self, evaluator):
+        return(np.asarray(evaluator.df.eval(self.text), dtype=bool))
+
+
+class And(Rule):
+    def __init__(self, *rules):
+        # flatten nested And, sort the rules so that the key does not depend on the order
+        self.rules = sorted(set(r for rule_item in rules for r in (rule_item.rules if isinstance(rule_item, And) else [rule_item])), key=repr)
+        self.key = '(' + ' & '.join(repr(r) for r in self.rules) + ')'
+
+    def evaluate(self, evaluator):
+        return(np.logical_and.reduce([evaluator.mask(r) for r in self.rules]))
+
+
+class Or(Rule):
+    def __init__(self, *rules):
+        self.rules = sorted(set(r for rule_item in rules for r in (rule_item.rules if isinstance(rule_item, Or) else [rule_item])), key=repr)
+        self.key = '(' + ' | '.join(repr(r) for r in self.rules) + ')'
+
+    def evaluate(self, evaluator):
+        return(np.logical_or.reduce([evaluator.mask(r) for r in self.rules]))
+
+
+class Not(Rule):
+    def __init__(self, rule_item):
+        self.rule = rule_item
+        self.key = '~' + repr(rule_item)
+
+    def evaluate(self, evaluator):
+        return(~evaluator.mask(self.rule))
+
+
+# value of a constant expression of the text (numbers, texts, + - * / and unary -)
+def _constant(node):
+    if isinstance(node, ast.Constant):
+        return(node.value)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _constant(node.operand)
+        return(-value if isinstance(node.op, ast.USub) else value)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div)):
+        ops = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+        return(ops[type(node.op)](_constant(node.left), _constant(node.right)))
+    raise ValueError('not a constant')
+
+def _compile(node):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        return(And(_compile(node.left), _compile(node.right)))
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return(Or(_compile(node.left), _compile(node.right)))
+    if isinstance(node, ast.BoolOp):
+        rules = [_compile(value) for value in node.values]
+        return(And(*rules) if isinstance(node.op, ast.And) else Or(*rules))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Invert, ast.Not)):
+        return(Not(_compile(node.operand)))
+    if isinstance(node, ast.Compare):
+        ops = {ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', ast.Eq: '==', ast.NotEq: '!='}
+        rules = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if type(op) not in ops:
+                raise ValueError('operator not supported')
+            if isinstance(left, ast.Name):
+                rules.append(Threshold(left.id, ops[type(op)], _constant(right)))
+            elif isinstance(right, ast.Name):
+                rules.append(Threshold(right.id, flipped_operators[ops[type(op)]], _constant(left)))
+            else:
+                raise ValueError('comparison without column')
+            left = right
+        return(rules[0] if len(rules) == 1 else And(*rules))
+    raise ValueError('expression not supported')
+
+# compile a pandas query text into a rule, falls back to Query (e.g. for `column names` or @variables)
+@functools.lru_cache(maxsize=1024)
+def compile_rule(text):
+    try:
+        return(_compile(ast.parse(text.strip(), mode='eval').body))
+    except (SyntaxError, ValueError):
+        return(Query(text))
+
+# a Rule, or a text compiled into a rule
+def rule(rule_or_text):
+    return(rule_or_text if isinstance(rule_or_text, Rule) else compile_rule(rule_or_text))
+
+
+# rules col >= threshold (or another operator) for each threshold, e.g. minimum hours of data to define valid days
+def threshold_sweep(col, thresholds, op = '>='):
+    return([Threshold(col, op, threshold) for threshold in thresholds])
+
+
+class Evaluator(object):
+    """
+    df: table (e.g. day_summary), columns are read as numpy arrays once and masks are cached by rule key
+        (the table must not be modified while the Evaluator is in use)
+    """
+    def __init__(self, df):
+        self.df = df
+        self._columns = {}
+        self._masks = {}
+
+    def column(self, col):
+        if col not in self._columns:
+            self._columns[col] = self.df[col].values
+        return(self._columns[col])
+
+    def mask(self, rule_or_text):
+        rule_item = rule(rule_or_text)
+        if rule_item.key not in self._masks:
+            self._masks[rule_item.key] = rule_item.evaluate(self)
+        return(self._masks[rule_item.key])
+
+    def count(self, rule_or_text):
+        return(int(np.count_nonzero(self.mask(rule_or_text))))
+
+    def select(self, rule_or_text):
+        return(self.df[self.mask(rule_or_text)])
+
+    """
+    INPUT:  base <rule of the days to count, e.g. the denominator>
+            col, thresholds, op <rules col op threshold, op is one of the operators of Threshold>
+
+    OUTPUT: number of days of base with col op threshold, for all thresholds with ONE sort (no mask per threshold)
+            (the same counts as the Threshold rules: NaN values only count for '!=')
+    """
+    def count_sweep(self, base, col, thresholds, op = '>='):
+        if op not in operators:
+            raise ValueError('operator {!r} not supported, use one of {}'.format(op, list(operators)))
+        values = np.sort(self.column(col)[self.mask(base)].astype(float))
+        n_base = values.shape[0]
+        values = values[~np.isnan(values)]
+        thresholds = np.asarray(thresholds, dtype=float)
+        counts = {
+            '>=': lambda: values.shape[0] - np.searchsorted(values, thresholds, side='left'),
+            '>': lambda: values.shape[0] - np.searchsorted(values, thresholds, side='right'),
+            '<=': lambda: np.searchsorted(values, thresholds, side='right'),
+            '<': lambda: np.searchsorted(values, thresholds, side='left'),
+            '==': lambda: np.searchsorted(values, thresholds, side='right') - np.searchsorted(values, thresholds, side='left'),
+            '!=': lambda: n_base - (np.searchsorted(values, thresholds, side='right') - np.searchsorted(values, thresholds, side='left')),
+        }
+        return(counts[op]())
+
+
+# rows of the table selected by the rule (or text), with the cached masks of evaluator (an Evaluator of df, None for a new one)
+def select(df, rule_or_text, evaluator = None):
+    evaluator = Evaluator(df) if evaluator is None else evaluator
+    if evaluator.df is not df:
+        raise ValueError('evaluator is not an Evaluator of the table')
+    return(evaluator.select(rule_or_text))
+
+if __name__=='__main__':
+    pass
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Requests of the local dashboard'
+
+__author__ = 'Xiaohuan Zeng'
+
+import json
+import pytest
+
+from py_daynamica import dashboard, equivalence
+
+
+@pytest.fixture(scope='module')
+def csv_dict():
+    return(equivalence.prepare_inputs(equivalence.synthetic_export(n_users=3, n_days=3))['csv_dict_sub_cube'])
+
+
+def test_subtype_with_missing_subtypes(csv_dict):
+    cube = csv_dict['subtype_cube']
+    assert cube['subtype_decoded'].isna().any()
+    board = dashboard.Dashboard(cube, csv_dict['day_summary'])
+
+    status, _, body, _ = board.handle('/api/subtype')
+    assert status == 200
+    rows = json.loads(body)['rows']
+    missing = [row for row in rows if row['subtype_decoded'] == dashboard.missing_label]
+    assert [row['rows'] for row in missing] == [cube[cube['subtype_decoded'].isna() & (cube['source'] == 'segment')].shape[0]]
+
+    status, _, body, _ = board.handle('/api/options')
+    assert dashboard.missing_label in json.loads(body)['subtype']
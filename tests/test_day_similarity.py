@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Clustering of person days by daily schedule'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from py_daynamica import s10_day_similarity
+
+
+def days(n):
+    rng = np.random.default_rng(0)
+    slots = rng.integers(0, 3, size=(n, 96)).astype(np.int8)
+    return(slots, pd.DataFrame({'user_id': 1, 'start_date': pd.date_range('2021-03-01', periods=n)}))
+
+
+@pytest.mark.parametrize('sample_size', [None, 2])
+def test_fewer_days_than_clusters(sample_size):
+    slots, person_days = days(3)
+    labels, medoids = s10_day_similarity.cluster_days(slots, person_days, k=5, sample_size=sample_size)
+    k = 3 if sample_size is None else sample_size
+    assert medoids.shape[0] == k
+    assert len(set(medoids['start_date'])) == k
+    assert sorted(labels['cluster'].unique()) == list(range(k))
+
+
+def test_kmedoids_checks_k():
+    slots, _ = days(3)
+    with pytest.raises(Exception, match='Sorry'):
+        s10_day_similarity.kmedoids(s10_day_similarity.distance_matrix(slots), 4)
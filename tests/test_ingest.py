@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Hot-folder ingestion of Daynamica exports'
+
+__author__ = 'Xiaohuan Zeng'
+
+import os
+import asyncio
+
+from py_daynamica import ingest, equivalence
+
+
+def write_export(folder_path, tables):
+    for name, df in tables.items():
+        df.to_csv(os.path.join(folder_path, 'proj{}2023_a.csv'.format(name)), index=False)
+
+
+def test_watch_retries_a_malformed_file(tmp_path):
+    export_path, output_path = tmp_path / 'export', tmp_path / 'output'
+    export_path.mkdir()
+    tables = equivalence.synthetic_export(n_users=2, n_days=2)
+    write_export(export_path, {name: tables[name] for name in ['ucalitems', 'calendar_item_survey']})
+    # a file still being copied, cut in a quoted field
+    (export_path / 'projema_survey2023_a.csv').write_text('user_id,ema_survey_date,q1\nu0,"2021-03')
+
+    hot_folder = ingest.HotFolder(str(export_path), str(output_path), project_name='proj', year='2023', n_workers=1, settle_seconds=0)
+    asyncio.run(hot_folder.watch(poll_seconds=0, max_updates=1))
+    assert sorted(hot_folder.files) == ['calendar_item_survey', 'ucalitems']
+    assert hot_folder.pending == set(tables['ucalitems']['user_id'])
+
+    write_export(export_path, {'ema_survey': tables['ema_survey']})
+    asyncio.run(hot_folder.watch(poll_seconds=0, max_updates=1))
+    assert sorted(hot_folder.files) == sorted(ingest.raw_tables)
+    assert hot_folder.pending == set()
+    assert set(hot_folder.tables['day_summary']['user_id']) == set(tables['ucalitems']['user_id'])
+
+
+def test_recent_files_wait_for_the_next_poll(tmp_path):
+    write_export(tmp_path, {'ucalitems': equivalence.synthetic_export(n_users=1, n_days=1)['ucalitems']})
+    assert ingest.HotFolder(str(tmp_path), str(tmp_path), 'proj', '2023', settle_seconds=60).changed_tables() == {}
+    assert list(ingest.HotFolder(str(tmp_path), str(tmp_path), 'proj', '2023', settle_seconds=0).changed_tables()) == ['ucalitems']
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Round trip of tables saved by s1_io_data.dict2file and read by s1_io_data.path2dict'
+
+__author__ = 'Xiaohuan Zeng'
+
+import datetime
+import pandas as pd
+import pytest
+
+from py_daynamica import s1_io_data, s7_summary_subtype, equivalence
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    return(equivalence.prepare_inputs(equivalence.synthetic_export(n_users=3, n_days=3)))
+
+
+def round_trip(csv_dict, folder_path, **kwargs):
+    s1_io_data.dict2file(csv_dict, str(folder_path), **kwargs)
+    return(s1_io_data.path2dict(str(folder_path)))
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+@pytest.mark.parametrize('index', [False, True])
+def test_round_trip_subtype_table(inputs, tmp_path, file_format, index):
+    valid_days = inputs['valid_days']
+    table = s7_summary_subtype.activity_trip_subtype(valid_days['ucalitems_temporal_plot'], valid_days['day_summary'], 'ACTIVITY')
+    assert isinstance(table.columns, pd.MultiIndex)
+
+    result = round_trip({'activity_subtype': table}, tmp_path, index=index, file_format=file_format)['activity_subtype']
+    expected = table if index else table.reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_index_type=False)
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_round_trip_geometry_and_dates(inputs, tmp_path, file_format):
+    sde = inputs['sde']
+    dates = pd.DataFrame({'user_id': [1, 2, 3], 'date': [datetime.date(2021, 3, 1), None, datetime.date(2021, 3, 3)],
+                          ('a', 1): [0.5, 1.5, 2.5]})
+
+    result = round_trip({'sde': sde, 'dates': dates}, tmp_path, file_format=file_format)
+    pd.testing.assert_frame_equal(result['sde'], sde.reset_index(drop=True), check_index_type=False)
+    assert result['sde'].geometry.name == sde.geometry.name
+    assert list(result['dates'].columns) == list(dates.columns)
+    assert result['dates']['date'].tolist() == dates['date'].tolist()
+
+
+def test_export_table_name_without_project_or_year():
+    assert s1_io_data.export_table_name('projectucalitems2021_05_01.csv', 'project', '2021') == 'ucalitems'
+    assert s1_io_data.export_table_name('ucalitems.csv', '', '') == 'ucalitems'
+    assert s1_io_data.export_table_name('ucalitems.csv', None, None) == 'ucalitems'
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Splitting calendar items at local midnights'
+
+__author__ = 'Xiaohuan Zeng'
+
+import pandas as pd
+import pytest
+
+from py_daynamica import s2_preprocess_data
+
+
+def ucalitems():
+    start = pd.Timestamp('2021-03-01 20:00', tz='US/Central').value // 10**6
+    hour = 3600 * 1000
+    # the first item lasts two local days, the second one has no subtype and no confirmation
+    return(pd.DataFrame({'user_id': [1, 1], 'start_timestamp': [start, start + 8 * hour], 'end_timestamp': [start + 8 * hour, start + 9 * hour],
+                         'type_decoded': ['ACTIVITY', 'ACTIVITY'], 'subtype_decoded': ['HOME', None], 'distance': [0.0, 0.0],
+                         'confirm_timestamp': [start, None], 'edit_timestamp': [0, 0]}))
+
+
+@pytest.mark.parametrize('copy_attributes', [False, True])
+def test_attributes_of_the_next_days(copy_attributes):
+    result = s2_preprocess_data.split_ucalitems(ucalitems(), 'US/Central', copy_attributes=copy_attributes)
+    assert result['start_date'].dt.day.tolist() == [1, 2, 2]
+    assert result['duration_after_split'].round(6).tolist() == [4.0, 4.0, 1.0]
+
+    # columns without missing values are always copied, the others only with copy_attributes
+    assert result['type_decoded'].tolist() == ['ACTIVITY'] * 3
+    assert result['edit_timestamp'].tolist() == [0, 0, 0]
+    assert result['subtype_decoded'].fillna('').tolist() == (['HOME', 'HOME', ''] if copy_attributes else ['HOME', '', ''])
+    assert result['interact_by_confirm'].tolist() == ([True, True, False] if copy_attributes else [True, False, False])
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Activity-trip sequences of person days'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+from py_daynamica import s9_sequence_pattern
+
+
+def test_episode_without_subtype():
+    # HOME -> TRIP -> (no subtype) -> TRIP -> WORKPLACE in one day
+    ucalitems = pd.DataFrame({'user_id': 1, 'start_date': pd.Timestamp('2021-03-01'),
+                              'start_dt': pd.date_range('2021-03-01 08:00', periods=5, freq='H'),
+                              'type_decoded': ['ACTIVITY', 'TRIP', 'ACTIVITY', 'TRIP', 'ACTIVITY'],
+                              'subtype_decoded': ['HOME', 'CAR', np.nan, 'WALK', 'WORKPLACE']})
+
+    seqs = s9_sequence_pattern.encode_sequences(ucalitems)
+    assert seqs.pattern(0) == 'HOME-TRIP-UNKNOWN-TRIP-WORKPLACE'
+
+    bigrams = s9_sequence_pattern.ngram_counts(seqs, 2, by=[])
+    assert 'WORKPLACE-WORKPLACE' not in bigrams['pattern'].tolist()
+    assert bigrams['count'].sum() == 4
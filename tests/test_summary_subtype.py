@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Summaries by subtype from the episodes and from the subtype cube'
+
+__author__ = 'Xiaohuan Zeng'
+
+import pandas as pd
+import pytest
+
+from py_daynamica import s7_summary_subtype, equivalence
+
+
+@pytest.fixture(scope='module')
+def csv_dict():
+    return(equivalence.prepare_inputs(equivalence.synthetic_export(n_users=3, n_days=3))['csv_dict_sub_cube'])
+
+
+@pytest.mark.parametrize('tb, mytype', [('ucalitems_temporal_plot', 'ACTIVITY'), ('ucalitems_temporal_plot', 'TRIP'), ('leg2trip', 'TRIP')])
+def test_cube_rows_follow_the_table(csv_dict, tb, mytype):
+    expected = s7_summary_subtype.activity_trip_subtype(csv_dict[tb], csv_dict['day_summary'], mytype)
+    result = s7_summary_subtype.activity_trip_subtype(csv_dict[tb], csv_dict['day_summary'], mytype, cube=csv_dict['subtype_cube'])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_explicit_source(csv_dict):
+    expected = s7_summary_subtype.activity_trip_subtype(csv_dict['leg2trip'], csv_dict['day_summary'], 'TRIP')
+    result = s7_summary_subtype.activity_trip_subtype(None, csv_dict['day_summary'], 'TRIP', cube=csv_dict['subtype_cube'], source='complete')
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Responses of calendar_item_survey joined to ucalitems'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+
+from py_daynamica import s2_preprocess_data, survey_responses
+
+
+ucalitems = pd.DataFrame({'user_id': ['a', 'a', 'b'], 'cal_item_id': [1, 2, 1], 'start_timestamp': [10, 20, 10]})
+
+
+def survey(rows):
+    return(pd.DataFrame(rows, columns=['user_id', 'calendar_item_id', 'calendar_item_timestamp', 'question_id', 'response']))
+
+
+def test_response_followed_by_missing_response():
+    # q5 of ('a', 1, 10) is answered, then a row without response
+    ucalitems_suvery = survey([['a', 1, 10, 5, 'yes'], ['a', 1, 10, 5, np.nan], ['a', 2, 20, 5, np.nan]])
+
+    result, responses = s2_preprocess_data.ucalitems_ljoin_ucisurvey(ucalitems_suvery, ucalitems, return_responses=True)
+    assert result['survey_not_null'].tolist() == [True, False, False]
+    assert responses.to_frame()[5].fillna('').tolist() == ['yes', '', '']
+    rate = responses.completion_rate()
+    assert rate[['asked', 'answered']].values.tolist() == [[2, 1]]
+
+
+def test_last_response_is_kept():
+    ucalitems_suvery = survey([['a', 1, 10, 5, 'no'], ['a', 1, 10, 5, 'yes'], ['a', 1, 10, 5, np.nan]])
+
+    responses = survey_responses.build_survey_responses(ucalitems_suvery, ucalitems)
+    assert responses.to_frame()[5].fillna('').tolist() == ['yes', '', '']
+
+
+def test_survey_rows_with_missing_key():
+    ucalitems_suvery = survey([[np.nan, 1, 10, 5, 'yes'], ['b', 1, np.nan, 5, 'yes'], ['b', 1, 10, 5, 'no']])
+
+    result, responses = s2_preprocess_data.ucalitems_ljoin_ucisurvey(ucalitems_suvery, ucalitems, return_responses=True)
+    assert result['survey_not_null'].tolist() == [False, False, True]
+    assert responses.to_frame()[5].fillna('').tolist() == ['', '', 'no']
+    assert responses.answer_counts()[['response', 'count']].values.tolist() == [['no', 1]]
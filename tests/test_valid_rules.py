@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'Validity rules of person days'
+
+__author__ = 'Xiaohuan Zeng'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from py_daynamica import valid_rules
+
+
+@pytest.fixture
+def day_summary():
+    return(pd.DataFrame({'with_subtype': [0.0, 6.0, 12.0, 12.0, np.nan, 20.0], 'trip_count': [0, 1, 2, 3, 4, 5]}))
+
+
+def test_select_with_evaluator(day_summary):
+    evaluator = valid_rules.Evaluator(day_summary)
+    assert valid_rules.select(day_summary, 'with_subtype>=12', evaluator).shape[0] == 3
+    assert valid_rules.rule('with_subtype>=12').key in evaluator._masks
+
+    # a new evaluator (or none) after the table is modified in place
+    day_summary.loc[0, 'with_subtype'] = 15.0
+    assert valid_rules.select(day_summary, 'with_subtype>=12').shape[0] == 4
+    assert valid_rules.Evaluator(day_summary).count('with_subtype>=12') == 4
+
+    with pytest.raises(ValueError):
+        valid_rules.select(day_summary.copy(), 'with_subtype>=12', evaluator)
+
+
+@pytest.mark.parametrize('op', list(valid_rules.operators))
+def test_count_sweep_matches_thresholds(day_summary, op):
+    evaluator = valid_rules.Evaluator(day_summary)
+    base = valid_rules.Threshold('trip_count', '>', 0)
+    thresholds = [0, 6, 12, 13]
+
+    counts = evaluator.count_sweep(base, 'with_subtype', thresholds, op=op)
+    assert list(counts) == [evaluator.count(base & rule) for rule in valid_rules.threshold_sweep('with_subtype', thresholds, op=op)]
+
+
+def test_rule_without_evaluate(day_summary):
+    with pytest.raises(NotImplementedError, match='Rule'):
+        valid_rules.Evaluator(day_summary).mask(valid_rules.Rule())